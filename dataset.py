@@ -10,35 +10,114 @@ import utils
 import transforms as T
 from xxx import LoadImagesAndLabels
 
-def letterbox_image(im, insize=(320,576,3), border=128):
-    '''生成letterbox图像
+def letterbox_geometry(size, insize=(320,576,3)):
+    '''计算letterbox的缩放和填充参数
     
     Args:
-        im (ndarray): RGB/BGR格式图像
+        size (tuple): 原始图像大小, size=(height, width)
         insize (tuple, optional): 神经网络输入大小, insize=(height, width,
             channels)
-        border (float, optional): 图像边沿填充颜色
     Returns:
-        lb_im (ndarray): letterbox图像
         s (float): 图像缩放系数
-        dx (int): 非填充区域的水平偏移量
-        dy (int): 非填充区域的垂直偏移量
+        nh (int): 缩放后的图像高度
+        nw (int): 缩放后的图像宽度
+        dx (float): 非填充区域的水平偏移量
+        dy (float): 非填充区域的垂直偏移量
+        left (int): 非填充区域的左边界
+        above (int): 非填充区域的上边界
     '''
-    h, w = im.shape[:2]
+    h, w = size
     s = min(insize[0] / h, insize[1] / w)
     nh = round(s * h)
     nw = round(s * w)
     dx = (insize[1] - nw) / 2
     dy = (insize[0] - nh) / 2
     left  = round(dx - 0.1)
-    right = round(dx + 0.1)
     above = round(dy - 0.1)
-    below = round(dy + 0.1)
+    return s, nh, nw, dx, dy, left, above
+
+def letterbox_image(im, insize=(320,576,3), border=128):
+    '''生成letterbox图像
+    
+    Args:
+        im (ndarray): RGB/BGR格式图像
+        insize (tuple, optional): 神经网络输入大小, insize=(height, width,
+            channels)
+        border (float, optional): 图像边沿填充颜色
+    Returns:
+        lb_im (ndarray): letterbox图像
+        s (float): 图像缩放系数
+        dx (int): 非填充区域的水平偏移量
+        dy (int): 非填充区域的垂直偏移量
+    '''
+    s, nh, nw, dx, dy, left, above = letterbox_geometry(im.shape[:2], insize)
     lb_im = np.full(insize, border, dtype=np.uint8)
-    lb_im[above:above+nh, left:left+nw, :] = cv2.resize(im, (nw,nh), interpolation=
-        cv2.INTER_AREA)
+    cv2.resize(im, (nw,nh), dst=lb_im[above:above+nh, left:left+nw, :],
+        interpolation=cv2.INTER_AREA)
     return lb_im, s, dx, dy
 
+class LetterboxBuffer(object):
+    '''预分配缓冲区的letterbox预处理. 图像直接缩放到常驻画布的非填充区域,
+        再一次性转换成CHW格式的float32神经网络输入, 写入轮转使用的缓冲区.
+        缩放和填充参数按原始图像分辨率缓存. 返回的数组会在ring次调用后被覆盖,
+        调用者需要在此之前使用完毕或者自行拷贝.
+    
+    Args:
+        insize (tuple, optional): 神经网络输入大小, insize=(height, width,
+            channels)
+        border (float, optional): 图像边沿填充颜色
+        ring (int, optional): 轮转缓冲区数量
+        backbone (str, optional): 主干网络, 'darknet'需要RGB格式和归一化
+        pin_memory (bool, optional): CUDA可用时是否使用锁页内存
+    '''
+    def __init__(self, insize=(320,576,3), border=128, ring=2,
+        backbone='shufflenetv2', pin_memory=True):
+        self.insize = insize
+        self.border = border
+        self.backbone = backbone
+        pin_memory = pin_memory and torch.cuda.is_available()
+        self.buffers = []
+        for _ in range(max(ring, 1)):
+            buffer = torch.empty((insize[2], insize[0], insize[1]), dtype=torch.float32)
+            if pin_memory:
+                buffer = buffer.pin_memory()
+            self.buffers.append(buffer.numpy())
+        self.canvas = np.full(insize, border, dtype=np.uint8)
+        self.geometries = {}
+        self.geometry = None
+        self.index = 0
+    
+    def __call__(self, im):
+        '''生成letterbox图像
+        
+        Args:
+            im (ndarray): RGB/BGR格式图像
+        Returns:
+            lb_im (ndarray): CHW格式的float32神经网络输入
+            s (float): 图像缩放系数
+            dx (int): 非填充区域的水平偏移量
+            dy (int): 非填充区域的垂直偏移量
+        '''
+        size = im.shape[:2]
+        geometry = self.geometries.get(size)
+        if geometry is None:
+            geometry = letterbox_geometry(size, self.insize)
+            self.geometries[size] = geometry
+        s, nh, nw, dx, dy, left, above = geometry
+        if geometry is not self.geometry:
+            self.canvas.fill(self.border)
+            self.geometry = geometry
+        cv2.resize(im, (nw,nh), dst=self.canvas[above:above+nh, left:left+nw, :],
+            interpolation=cv2.INTER_AREA)
+        lb_im = self.buffers[self.index]
+        self.index = (self.index + 1) % len(self.buffers)
+        if self.backbone == 'darknet':
+            np.copyto(lb_im, self.canvas[...,::-1].transpose(2, 0, 1))
+            lb_im /= 255.0
+        else:
+            np.copyto(lb_im, self.canvas.transpose(2, 0, 1))
+        return lb_im, s, dx, dy
+
 class ImagesLoader(object):
     '''图像迭代器
     
@@ -46,8 +125,10 @@ class ImagesLoader(object):
         path (str): 图像路径
         insize (tuple): 神经网络输入大小, insize=(height, width)
         formats (list of str): 需要解码的图像格式列表
+        ring (int, optional): 大于0时使用LetterboxBuffer, 轮转缓冲区数量为ring,
+            返回的lb_im在ring帧之后被覆盖. 等于0时每帧分配新的数组
     '''
-    def __init__(self, path, insize, formats=['*.jpg'], backbone='shufflenetv2'):
+    def __init__(self, path, insize, formats=['*.jpg'], backbone='shufflenetv2', ring=0):
         if os.path.isdir(path):
             self.files = []
             for format in formats:
@@ -57,6 +138,8 @@ class ImagesLoader(object):
         self.insize = insize
         self.count = 0
         self.backbone = backbone
+        self.letterbox = LetterboxBuffer(insize, ring=ring,
+            backbone=backbone) if ring > 0 else None
 
     def __iter__(self):
         self.count = -1
@@ -69,14 +152,17 @@ class ImagesLoader(object):
         path = self.files[self.count]
         im = cv2.imread(path)
         assert im is not None, 'cv2.imread{} fail'.format(path)
-        lb_im, s, dx, dy = letterbox_image(im, insize=self.insize)
-        if self.backbone is 'darknet':
-            lb_im = lb_im[...,::-1].transpose(2, 0, 1)
-            lb_im = np.ascontiguousarray(lb_im, dtype=np.float32)
-            lb_im /= 255.0
+        if self.letterbox is not None:
+            lb_im, s, dx, dy = self.letterbox(im)
         else:
-            lb_im = lb_im.transpose(2, 0, 1)
-            lb_im = np.ascontiguousarray(lb_im, dtype=np.float32)
+            lb_im, s, dx, dy = letterbox_image(im, insize=self.insize)
+            if self.backbone is 'darknet':
+                lb_im = lb_im[...,::-1].transpose(2, 0, 1)
+                lb_im = np.ascontiguousarray(lb_im, dtype=np.float32)
+                lb_im /= 255.0
+            else:
+                lb_im = lb_im.transpose(2, 0, 1)
+                lb_im = np.ascontiguousarray(lb_im, dtype=np.float32)
         return path, im, lb_im
 
 class VideoLoader(object):
@@ -87,8 +173,10 @@ class VideoLoader(object):
     path    : The file path for video.
     insize  : The input size of neural network.
     backbone: The backbone architecture. It can be 'darknet' or 'shufflenetv2'.
+    ring    : Use a LetterboxBuffer with `ring` rotating buffers if ring > 0.
+              The returned lb_im is overwritten `ring` frames later.
     '''
-    def __init__(self, path, insize, backbone='shufflenetv2'):
+    def __init__(self, path, insize, backbone='shufflenetv2', ring=0):
         if not os.path.isfile(path):
             raise FileExistsError
         self.vcap = cv2.VideoCapture(path)
@@ -96,6 +184,8 @@ class VideoLoader(object):
         self.insize = insize
         self.backbone = backbone
         self.count = 0
+        self.letterbox = LetterboxBuffer(insize, ring=ring,
+            backbone=backbone) if ring > 0 else None
     
     def __iter__(self):
         self.count = -1
@@ -107,14 +197,17 @@ class VideoLoader(object):
             raise StopIteration
         retval, im = self.vcap.read()
         assert im is not None, 'VideoCapture.read() fail'
-        lb_im, s, dx, dy = letterbox_image(im, insize=self.insize)
-        if self.backbone is 'darknet':
-            lb_im = lb_im[...,::-1].transpose(2, 0, 1)
-            lb_im = np.ascontiguousarray(lb_im, dtype=np.float32)
-            lb_im /= 255.0
+        if self.letterbox is not None:
+            lb_im, s, dx, dy = self.letterbox(im)
         else:
-            lb_im = lb_im.transpose(2, 0, 1)
-            lb_im = np.ascontiguousarray(lb_im, dtype=np.float32)
+            lb_im, s, dx, dy = letterbox_image(im, insize=self.insize)
+            if self.backbone is 'darknet':
+                lb_im = lb_im[...,::-1].transpose(2, 0, 1)
+                lb_im = np.ascontiguousarray(lb_im, dtype=np.float32)
+                lb_im /= 255.0
+            else:
+                lb_im = lb_im.transpose(2, 0, 1)
+                lb_im = np.ascontiguousarray(lb_im, dtype=np.float32)
         # Keep consistency with ImagesLoader with fake path.
         path = '%06d.jpg' % self.count
         return path, im, lb_im
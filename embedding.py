@@ -0,0 +1,141 @@
+import numpy as np
+
+def pairwise_distance(A, B, metric='euclidean', dtype=np.float32, out=None):
+    '''计算两组L2归一化表观嵌入之间的距离矩阵. 只做一次矩阵乘法,
+        欧氏距离由sqrt(2-2*A*B^T)得到, 余弦距离为1-A*B^T
+
+    Args:
+        A (numpy.ndarray): (M,dim)的嵌入矩阵, 每行的L2范数为1
+        B (numpy.ndarray): (N,dim)的嵌入矩阵, 每行的L2范数为1
+        metric (str, optional): 'euclidean'或'cosine'
+        dtype (numpy.dtype, optional): 计算精度, np.float32或np.float16.
+            numpy没有半精度的BLAS实现, np.float16只减少数据量, 不一定更快
+        out (numpy.ndarray, optional): 写入结果的(M,N)连续矩阵, 与dtype相同时
+            矩阵乘法直接写入其中, 缺省时新分配float32矩阵
+    Returns:
+        costs (numpy.ndarray): (M,N)的距离矩阵
+    '''
+    if metric not in ['euclidean', 'cosine']:
+        raise ValueError('unknown metric {}'.format(metric))
+    A = np.asarray(A, dtype=dtype)
+    B = np.asarray(B, dtype=dtype)
+    if out is None:
+        out = np.empty((A.shape[0], B.shape[0]), dtype=np.float32)
+    if A.dtype == out.dtype:
+        np.dot(A, B.T, out=out)
+    else:
+        np.copyto(out, np.dot(A, B.T))
+    # 原地计算sqrt(max(0, 2-2*A*B^T))或max(0, 1-A*B^T), 不再分配临时矩阵
+    if metric == 'euclidean':
+        out *= -2
+        out += 2
+        np.maximum(out, 0, out=out)
+        np.sqrt(out, out=out)
+    else:
+        out *= -1
+        out += 1
+        np.maximum(out, 0, out=out)
+    return out
+
+class EmbeddingBank(object):
+    '''轨迹表观嵌入库. 所有轨迹的平滑嵌入保存在连续的(N,dim) float32矩阵中,
+        每条轨迹只持有其中一行的索引, 嵌入的平滑更新直接在矩阵中进行.
+        计算代价矩阵时只需按索引取出一个子矩阵, 不必逐条轨迹拼接.
+
+    Args:
+        dim (int, optional): 嵌入维度, 为None时由第一个分配的嵌入决定
+        capacity (int, optional): 初始容量, 容量不足时按倍数增长
+    '''
+    def __init__(self, dim=None, capacity=64):
+        self.dim = dim
+        self.capacity = capacity
+        self.matrix = np.zeros((0, dim or 0), dtype=np.float32)
+        self.free = []
+        if dim is not None:
+            self._grow(capacity)
+
+    def __len__(self):
+        return self.matrix.shape[0] - len(self.free)
+
+    def _grow(self, capacity):
+        '''扩充嵌入库容量
+
+        Args:
+            capacity (int): 新的容量
+        '''
+        size = self.matrix.shape[0]
+        if capacity <= size:
+            return
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:size] = self.matrix
+        self.matrix = matrix
+        # 低索引优先分配
+        self.free = list(range(capacity - 1, size - 1, -1)) + self.free
+
+    def allocate(self, embedding):
+        '''分配一行并写入嵌入
+
+        Args:
+            embedding (numpy.ndarray): L2归一化的嵌入
+        Returns:
+            index (int): 分配的行索引
+        '''
+        if self.dim is None:
+            self.dim = len(embedding)
+            self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+            self._grow(self.capacity)
+        if not self.free:
+            self._grow(max(2 * self.matrix.shape[0], 1))
+        index = self.free.pop()
+        self.matrix[index] = embedding
+        return index
+
+    def release(self, index):
+        '''释放一行, 供之后的轨迹复用
+
+        Args:
+            index (int): allocate()返回的行索引
+        '''
+        if index < 0:
+            return
+        self.free.append(index)
+
+    def retain(self, indices):
+        '''只保留indices中的行, 释放其余已分配的行
+
+        Args:
+            indices (array like): 需要保留的行索引
+        '''
+        released = np.ones(self.matrix.shape[0], dtype=bool)
+        released[self.free] = False
+        released[np.asarray(indices, dtype=np.int64)] = False
+        self.free.extend(np.where(released)[0][::-1].tolist())
+
+    def update(self, index, embedding, eta):
+        '''原地平滑更新一行嵌入, row = normalize(eta * row + (1 - eta) * embedding)
+
+        Args:
+            index (int): 行索引
+            embedding (numpy.ndarray): L2归一化的新嵌入
+            eta (float): 平滑系数
+        '''
+        row = self.matrix[index]
+        row *= eta
+        row += (1 - eta) * embedding
+        row /= np.linalg.norm(row)
+
+    def distance(self, indices, embeddings, metric='euclidean', dtype=np.float32,
+        out=None):
+        '''计算嵌入库中若干行与一组嵌入之间的距离矩阵
+
+        Args:
+            indices (array like): 行索引
+            embeddings (numpy.ndarray): (N,dim)的嵌入矩阵
+            metric (str, optional): 'euclidean'或'cosine'
+            dtype (numpy.dtype, optional): 计算精度, 见pairwise_distance
+            out (numpy.ndarray, optional): 写入结果的矩阵, 见pairwise_distance
+        Returns:
+            costs (numpy.ndarray): (len(indices),N)的距离矩阵
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        return pairwise_distance(self.matrix[indices], embeddings, metric, dtype, out)
@@ -170,6 +170,7 @@ class JDELoss(JDEcoder):
         self.s_box = nn.Parameter(torch.FloatTensor([0, 0, 0]))
         self.s_cls = nn.Parameter(torch.FloatTensor([0, 0, 0]))
         self.s_ide = nn.Parameter(torch.FloatTensor([0, 0, 0]))
+        self._anchor_boxes = {}
     
     def forward(self, input, target, im_size, classifier):
         '''JDELoss forward propagation.
@@ -184,7 +185,7 @@ class JDELoss(JDEcoder):
         '''
         self.im_size = im_size
         loss_box, loss_cls, loss_ide = [], [], []
-        for inp, anchor in zip(input, self.anchor):
+        for scale, (inp, anchor) in enumerate(zip(input, self.anchor)):
             n, c, h, w = inp.size()
             stride = im_size[0] / h
             anc = (anchor / stride).type(inp.type()) # Scale anchors to match grid size
@@ -204,7 +205,7 @@ class JDELoss(JDEcoder):
             ide = F.normalize(ide).permute(0, 2, 3, 1).contiguous() # NHWC
 
             # Build ground truth based on target.
-            gt_box, gt_cls, gt_ide = self._build_ground_truth(inp, target, im_size, anc)
+            gt_box, gt_cls, gt_ide = self._build_ground_truth(inp, target, im_size, anc, scale)
 
             # Bounding boxes loss.
             obj_mask = gt_cls > 0                   # NAHW
@@ -246,7 +247,7 @@ class JDELoss(JDEcoder):
 
         return loss, metrics
     
-    def _build_ground_truth(self, input, target, im_size, anchor):
+    def _build_ground_truth(self, input, target, im_size, anchor, scale=None):
         '''Build ground truth.
         
         Param
@@ -256,6 +257,7 @@ class JDELoss(JDEcoder):
                  [[image id, class id, identity, x, y, w, h], ...].
         im_size: Neural network input image size with format [height, width].
         anchor : Anchor parameters with format [[w, h], ...].
+        scale  : Index of the anchor set, see _make_anchor_box.
         
         Return
         ------
@@ -276,13 +278,16 @@ class JDELoss(JDEcoder):
         if target.size(0) == 0:
             return box, cls, ide
 
-        # Make target and anchor boxes and calculate IOU matrix between them.
+        # Make target and anchor boxes, and calculate IOUs between targets
+        # and the anchors around them only.
         tg_box = self._make_target_box(target[:, 3:], w, h)                 # T4
-        ac_box = self._make_anchor_box(anchor, w, h)                        # [AHW]4
-        iou = self._iou_xywh(tg_box, ac_box)                                # T[AHW]
-        val, ind = self._iou_max(iou, im_id, n, dim=0)                      # [AHW],[AHW],...
-        max_iou = torch.stack([v.view(a, h, w) for v in val])               # NAHW
-        tg_id = torch.stack([i.view(a, h, w) for i in ind])                 # NAHW
+        ac_box = self._make_anchor_box(anchor, w, h, scale)                 # [AHW]4
+        tg_ind, ac_ind = self._neighbourhood(tg_box, anchor, w, h)          # K,K
+        iou = self._iou_xywh(tg_box[tg_ind], ac_box[ac_ind])                # K
+        cell = im_id[tg_ind] * ac_box.size(0) + ac_ind                      # K
+        max_iou, tg_id = self._iou_max(iou, tg_ind, cell, n * ac_box.size(0))
+        max_iou = max_iou.view(n, a, h, w)                                  # NAHW
+        tg_id = tg_id.view(n, a, h, w)                                      # NAHW
         
         # Calculate ground truth masks based on IOU.
         ide_mask = max_iou > self.ide_thresh                                # NAHW
@@ -293,12 +298,8 @@ class JDELoss(JDEcoder):
         # Mask box ground truth.
         tg_box_left = tg_box[tg_id[obj_mask]]
         if isinstance(self.lf_box, nn.SmoothL1Loss):
-            ac_box = ac_box.view(a, h, w, self.box_dim)                     # AHW4
-            ac_box_left = []
-            for i in range(n):
-                ac_box_left.append(ac_box[obj_mask[i]])
-            ac_box_left = torch.cat(ac_box_left, dim=0)
-            box[obj_mask] = self._encode_box(tg_box_left, ac_box_left)
+            ac_box = ac_box.view(1, a, h, w, self.box_dim).expand(n, -1, -1, -1, -1)
+            box[obj_mask] = self._encode_box(tg_box_left, ac_box[obj_mask])
         else:
             box[obj_mask] = tg_box_left * im_size[0] / h
         
@@ -330,29 +331,83 @@ class JDELoss(JDEcoder):
         h = norm_box[:, 3] * grid_h
         return torch.stack([x, y, w, h], dim=-1)
     
-    def _make_anchor_box(self, anchor, grid_w, grid_h):
-        '''Make anchor boxes.
+    def _make_anchor_box(self, anchor, grid_w, grid_h, scale=None):
+        '''Make anchor boxes. They are cached for each scale and grid size.
         
         Param
         -----
         anchor: Anchor parameters with format [[w, h], ...].
         grid_w: Feature tensor grid width.
         grid_h: Feature tensor grid height.
+        scale : Index of the anchor set, which identifies the anchors in the
+                cache without reading them back from the device. If it is
+                None, the anchor values are used instead.
         
         Return
         ------
         The anchor box matrix with format [[x, y, w, h], ...].
         '''
-        a = anchor.size(0)
-        y, x = torch.meshgrid(torch.arange(grid_h), torch.arange(grid_w))       # HW
-        x = x.unsqueeze(0).repeat(a, 1, 1).unsqueeze(-1).type(anchor.type())    # AHW1
-        y = y.unsqueeze(0).repeat(a, 1, 1).unsqueeze(-1).type(anchor.type())    # AHW1
-        wh = anchor.unsqueeze(-1).unsqueeze(-1).repeat(1, 1, grid_h, grid_w)    # A2HW
-        wh = wh.permute(0, 2, 3, 1).contiguous()                                # AHW2
-        return torch.cat([x, y, wh], dim=-1).view(-1, self.box_dim)
+        if scale is None:
+            scale = tuple(anchor.flatten().tolist())
+        key = (scale, grid_w, grid_h, anchor.device, anchor.dtype)
+        box = self._anchor_boxes.get(key)
+        if box is None:
+            a = anchor.size(0)
+            y, x = torch.meshgrid(torch.arange(grid_h), torch.arange(grid_w))       # HW
+            x = x.unsqueeze(0).repeat(a, 1, 1).unsqueeze(-1).type(anchor.type())    # AHW1
+            y = y.unsqueeze(0).repeat(a, 1, 1).unsqueeze(-1).type(anchor.type())    # AHW1
+            wh = anchor.unsqueeze(-1).unsqueeze(-1).repeat(1, 1, grid_h, grid_w)    # A2HW
+            wh = wh.permute(0, 2, 3, 1).contiguous()                                # AHW2
+            box = torch.cat([x, y, wh], dim=-1).view(-1, self.box_dim)
+            self._anchor_boxes[key] = box
+        return box
+    
+    def _neighbourhood(self, tg_box, anchor, grid_w, grid_h):
+        '''Find the anchors around each target box. An anchor at cell
+        (x, y) can only overlap a target centered at (cx, cy) if
+        |x - cx| < rx and |y - cy| < ry, where rx and ry are half the sums
+        of the target and anchor widths and heights. The neighbourhood is
+        the cells from floor(cx - rx) to ceil(cx + rx) and from
+        floor(cy - ry) to ceil(cy + ry), clipped to the grid.
+        
+        Param
+        -----
+        tg_box: Target boxes with format [[x, y, w, h], ...].
+        anchor: Anchor parameters with format [[w, h], ...].
+        grid_w: Feature tensor grid width.
+        grid_h: Feature tensor grid height.
+        
+        Return
+        ------
+        Target indices and anchor indices in the anchor box matrix of
+        all target and anchor pairs in the neighbourhoods.
+        '''
+        t, a = tg_box.size(0), anchor.size(0)
+        device = tg_box.device
+        anchor = anchor.to(device, tg_box.dtype)
+        tg = tg_box.unsqueeze(1)                                            # T14
+        rx = (tg[..., 2] + anchor[:, 0]) / 2                                # TA
+        ry = (tg[..., 3] + anchor[:, 1]) / 2                                # TA
+        x0 = torch.clamp(torch.floor(tg[..., 0] - rx), min=0, max=grid_w-1).long()
+        x1 = torch.clamp(torch.ceil(tg[..., 0] + rx), min=0, max=grid_w-1).long()
+        y0 = torch.clamp(torch.floor(tg[..., 1] - ry), min=0, max=grid_h-1).long()
+        y1 = torch.clamp(torch.ceil(tg[..., 1] + ry), min=0, max=grid_h-1).long()
+        nx = (x1 - x0 + 1).view(-1)
+        ny = (y1 - y0 + 1).view(-1)
+        
+        # Enumerate the cells of all windows at once.
+        count = nx * ny                                                     # [TA]
+        pair = torch.repeat_interleave(torch.arange(t * a, device=device), count)
+        begin = torch.cumsum(count, dim=0) - count
+        k = torch.arange(pair.size(0), device=device) - begin[pair]        # K
+        x = x0.view(-1)[pair] + k % nx[pair]
+        y = y0.view(-1)[pair] + k // nx[pair]
+        tg_ind = pair // a
+        ac_ind = ((pair % a) * grid_h + y) * grid_w + x
+        return tg_ind, ac_ind
     
     def _iou_xywh(self, A, B, eps=1e-10):
-        '''Calculate IOU matrix between boxes A and boxes B.
+        '''Calculate IOUs between boxes A and boxes B pairwise.
         
         Param
         -----
@@ -361,52 +416,45 @@ class JDELoss(JDEcoder):
         
         Return
         ------
-        The IOU matrix. If the number of boxes A and B is M and N
-        respectively, the IOU matrix shape will be [M, N].
+        The IOU vector. The number of boxes A and B should be the same.
         '''
-        m, n = A.size(0), B.size(0)
         t1, l1 = A[:, 0] - A[:, 2] / 2, A[:, 1] - A[:, 3] / 2
         b1, r1 = A[:, 0] + A[:, 2] / 2, A[:, 1] + A[:, 3] / 2
         t2, l2 = B[:, 0] - B[:, 2] / 2, B[:, 1] - B[:, 3] / 2
         b2, r2 = B[:, 0] + B[:, 2] / 2, B[:, 1] + B[:, 3] / 2
-        area1 = (A[:, 2] * A[:, 3]).view(-1, 1).expand(m, n)
-        area2 = (B[:, 2] * B[:, 3]).view(1, -1).expand(m, n)
+        area1 = A[:, 2] * A[:, 3]
+        area2 = B[:, 2] * B[:, 3]
         
-        ti, li = torch.max(t1.unsqueeze(1), t2), torch.max(l1.unsqueeze(1), l2)
-        bi, ri = torch.min(b1.unsqueeze(1), b2), torch.min(r1.unsqueeze(1), r2)
+        ti, li = torch.max(t1, t2), torch.max(l1, l2)
+        bi, ri = torch.min(b1, b2), torch.min(r1, r2)
         wi, hi = torch.clamp(ri - li, 0), torch.clamp(bi - ti, 0)
         inter = wi * hi
         
         return inter / (area1 + area2 - inter + eps)
     
-    def _iou_max(self, iou, im_id, batch_size, dim=0):
-        '''Find the maximum IOUs between target and anchor boxes.
+    def _iou_max(self, iou, tg_ind, cell, size):
+        '''Find the maximum IOUs between target and anchor boxes of all
+        images in the batch at once.
         
         Param
         -----
-        iou       : IOU matrix between target and anchor boxes.
-        im_id     : Image indices of target boxes.
-        batch_size: Batch size.
-        dim       : The dimension looking for the maximum IOUs.
+        iou   : IOUs of target and anchor pairs.
+        tg_ind: Target indices of the pairs.
+        cell  : Indices of the anchors of the pairs in the batch, that is
+                image id * number of anchor boxes + anchor index.
+        size  : Number of anchor boxes in the batch.
         
         Return
         ------
-        The maximum IOUs and corresponding indices
-        along dimension /dim/.
+        The maximum IOU of each anchor box and the index of the target
+        giving it. The lowest index is taken if several targets give it.
+        Anchor boxes overlapping no target have zero IOU and index 0.
         '''
-        val, ind = [], []
-        last_ind = 0
-        for i in range(batch_size):
-            iou_i = iou[im_id == i]
-            if iou_i.size(0) > 0:
-                val_i, ind_i = iou_i.max(dim)
-                ind_i += last_ind   # Transform index in image to index in batch.
-            else:   # No object in current image.
-                val_i = torch.FloatTensor(iou_i.size(1),).fill_(0).to(iou.device)
-                ind_i = torch.LongTensor(iou_i.size(1),).fill_(False).to(iou.device)
-            val.append(val_i)
-            ind.append(ind_i)
-            last_ind += iou_i.size(0)
+        val = iou.new_zeros(size).scatter_reduce(0, cell, iou, 'amax')
+        best = (iou == val[cell]) & (iou > 0)
+        ind = torch.full((size,), tg_ind.numel(), dtype=torch.long, device=iou.device)
+        ind = ind.scatter_reduce(0, cell[best], tg_ind[best], 'amin')
+        ind[val == 0] = 0
         return val, ind
 
     def _encode_box(self, tg_box, ac_box):
@@ -1,7 +1,5 @@
 import cv2
-import scipy
 import numpy as np
-from scipy.spatial.distance import mahalanobis
 
 # 取95%置信度时卡方分布上侧alpha分数
 # 同样来自Matlab的chi2inv()函数
@@ -122,12 +120,223 @@ class KalmanFilter(object):
         Returns:
             dists (numpy.ndarray): 测量和状态分布之间的马氏距离
         '''
+        # scipy is imported when needed, it slows down the startup noticeably.
+        from scipy.spatial.distance import mahalanobis
         mean, covariance = self.project()
+        if only_position:
+            mean, covariance = mean[:2], covariance[:2, :2]
+            measurement = np.asarray(measurement)[:, :2]
         covariance = np.linalg.inv(covariance)
         dists = [mahalanobis(x, mean, covariance) for x in measurement]
         dists = np.square(dists)
         return dists
 
+class KalmanFilterBank(object):
+    '''多目标跟踪的卡尔曼滤波器组. 状态向量和状态转移函数与KalmanFilter相同,
+        但所有目标的状态均值和误差估计协方差分别保存在连续的(N,8)和(N,8,8)数组
+        中, 每个目标只持有其中一行的索引. 预测, 更新和投影都对一组行索引批量计算,
+        避免为每个目标单独创建cv2.KalmanFilter和噪声协方差矩阵.
+    
+    Args:
+        capacity (int, optional): 初始容量, 容量不足时按倍数增长
+    '''
+    def __init__(self, capacity=64):
+        self.transition = np.eye(8, 8, dtype=np.float32)
+        for i in range(4):
+            self.transition[i, 4+i] = 1.0
+        self.std_weight_position = 1. / 20
+        self.std_weight_velocity = 1. / 160
+        p, v = self.std_weight_position, self.std_weight_velocity
+        # 噪声标准差 = 高度 * scale + offset
+        self.init_scale  = np.array([2*p, 2*p, 0, 2*p, 10*v, 10*v, 0, 10*v], dtype=np.float32)
+        self.init_offset = np.array([0, 0, 1e-2, 0, 0, 0, 1e-5, 0], dtype=np.float32)
+        self.process_scale  = np.array([p, p, 0, p, v, v, 0, v], dtype=np.float32)
+        self.process_offset = np.array([0, 0, 1e-2, 0, 0, 0, 1e-5, 0], dtype=np.float32)
+        self.measure_scale  = np.array([p, p, 0, p], dtype=np.float32)
+        self.measure_offset = np.array([0, 0, 1e-1, 0], dtype=np.float32)
+        self.mean = np.zeros((0, 8), dtype=np.float32)
+        self.covariance = np.zeros((0, 8, 8), dtype=np.float32)
+        self.free = []
+        self._grow(capacity)
+    
+    def __len__(self):
+        return self.mean.shape[0] - len(self.free)
+    
+    def _grow(self, capacity):
+        '''扩充滤波器组容量
+        
+        Args:
+            capacity (int): 新的容量
+        '''
+        size = self.mean.shape[0]
+        if capacity <= size:
+            return
+        mean = np.zeros((capacity, 8), dtype=np.float32)
+        covariance = np.zeros((capacity, 8, 8), dtype=np.float32)
+        mean[:size] = self.mean
+        covariance[:size] = self.covariance
+        self.mean, self.covariance = mean, covariance
+        # 低索引优先分配
+        self.free = list(range(capacity - 1, size - 1, -1)) + self.free
+    
+    def allocate(self, measurement):
+        '''分配一行并初始化后验状态和后验误差估计协方差
+        
+        Args:
+            measurement (numpy.ndarray): 测量, measurement=[x,y,a,h]
+        Returns:
+            index (int): 分配的行索引
+        '''
+        if not self.free:
+            self._grow(max(2 * self.mean.shape[0], 1))
+        index = self.free.pop()
+        self.initialize([index], np.reshape(measurement, (1, 4)))
+        return index
+    
+    def release(self, index):
+        '''释放一行, 供之后的目标复用
+        
+        Args:
+            index (int): allocate()返回的行索引
+        '''
+        if index < 0:
+            return
+        self.free.append(index)
+    
+    def retain(self, indices):
+        '''只保留indices中的行, 释放其余已分配的行
+        
+        Args:
+            indices (array like): 需要保留的行索引
+        '''
+        released = np.ones(self.mean.shape[0], dtype=bool)
+        released[self.free] = False
+        released[np.asarray(indices, dtype=np.int64)] = False
+        self.free.extend(np.where(released)[0][::-1].tolist())
+    
+    def initialize(self, indices, measurements):
+        '''批量初始化后验状态和后验误差估计协方差
+        
+        Args:
+            indices (array like): 行索引
+            measurements (numpy.ndarray): 测量矩阵, measurements[:]=[x,y,a,h]
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        measurements = np.asarray(measurements, dtype=np.float32).reshape(-1, 4)
+        std = measurements[:, 3:4] * self.init_scale + self.init_offset
+        self.mean[indices, :4] = measurements
+        self.mean[indices, 4:] = 0
+        covariance = np.zeros((len(indices), 8, 8), dtype=np.float32)
+        covariance[:, range(8), range(8)] = np.square(std)
+        self.covariance[indices] = covariance
+    
+    def predict(self, indices):
+        '''批量预测状态和误差估计协方差
+        
+        Args:
+            indices (array like): 行索引
+        Returns:
+            mean (numpy.ndarray): 预测的状态均值, mean.shape=(len(indices),8)
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size == 0:
+            return np.zeros((0, 8), dtype=np.float32)
+        
+        # 计算过程噪声协方差
+        mean = self.mean[indices]
+        std = mean[:, 3:4] * self.process_scale + self.process_offset
+        
+        # 预测状态和误差估计协方差
+        mean = np.dot(mean, self.transition.T)
+        covariance = np.matmul(np.matmul(self.transition,
+            self.covariance[indices]), self.transition.T)
+        covariance[:, range(8), range(8)] += np.square(std)
+        
+        self.mean[indices] = mean
+        self.covariance[indices] = covariance
+        return mean
+    
+    def correct(self, indices, measurements):
+        '''批量更新状态和误差估计协方差
+        
+        Args:
+            indices (array like): 行索引
+            measurements (numpy.ndarray): 测量矩阵, measurements[:]=[x,y,a,h]
+        Returns:
+            mean (numpy.ndarray): 更新后的状态均值, mean.shape=(len(indices),8)
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size == 0:
+            return np.zeros((0, 8), dtype=np.float32)
+        measurements = np.asarray(measurements, dtype=np.float32).reshape(-1, 4)
+        
+        mean = self.mean[indices]
+        covariance = self.covariance[indices]
+        
+        # 计算测量噪声协方差
+        std = mean[:, 3:4] * self.measure_scale + self.measure_offset
+        projected_cov = covariance[:, :4, :4].copy()
+        projected_cov[:, range(4), range(4)] += np.square(std)
+        
+        # 卡尔曼增益K=P*H'*S^-1, 其中S对称, 所以K'=S^-1*H*P
+        gain = np.linalg.solve(projected_cov, covariance[:, :4, :]).transpose(0, 2, 1)
+        innovation = measurements - mean[:, :4]
+        mean = mean + np.matmul(gain, innovation[..., None])[..., 0]
+        covariance = covariance - np.matmul(gain, covariance[:, :4, :])
+        
+        self.mean[indices] = mean
+        self.covariance[indices] = covariance
+        return mean
+    
+    def project(self, indices):
+        '''批量将状态分布投影到测量空间
+        
+        Args:
+            indices (array like): 行索引
+        Returns:
+            mean (numpy.ndarray): 投影均值, mean.shape=(len(indices),4)
+            covariance (numpy.ndarray): 投影协方差, covariance.shape=(len(indices),4,4)
+        '''
+        indices = np.asarray(indices, dtype=np.int64)
+        mean = self.mean[indices, :4]
+        std = mean[:, 3:4] * self.measure_scale + self.measure_offset
+        covariance = self.covariance[indices, :4, :4].astype(np.float64)
+        covariance[:, range(4), range(4)] += np.square(std)
+        return mean, covariance
+    
+    def gating_distance(self, indices, measurements, only_position=False, metric='maha',
+        out=None):
+        '''批量计算测量和状态分布之间的平方马氏距离(Mahalanobis distance). 对投影
+            协方差做Cholesky分解S=L*L', 再解三角方程L*z=d, 则d'*S^-1*d=|z|^2,
+            一次计算出所有状态分布和所有测量之间的距离矩阵.
+        
+        Args:
+            indices (array like): 行索引
+            measurements (numpy.ndarray): 测量矩阵, measurements[:]=[x,y,a,h]
+            only_position (bool, optional): 仅使用位置信息, 如果为真,
+                仅考虑建议框的中心坐标
+            metric (str, optional): 距离度量方法, 'maha'为平方马氏距离,
+                'gaussian'为平方欧氏距离
+            out (numpy.ndarray, optional): 写入结果的float64矩阵, 缺省时新分配
+        Returns:
+            dists (numpy.ndarray): 测量和状态分布之间的平方距离,
+                dists.shape=(len(indices),len(measurements))
+        '''
+        mean, covariance = self.project(indices)
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+        d = measurements[None, :, :] - mean[:, None, :]
+        if metric == 'gaussian':
+            return np.sum(d * d, axis=-1, out=out)
+        elif metric == 'maha':
+            cholesky = np.linalg.cholesky(covariance)
+            z = np.linalg.solve(cholesky, d.transpose(0, 2, 1))
+            return np.sum(z * z, axis=1, out=out)
+        else:
+            raise ValueError('invalid distance metric {}'.format(metric))
+
 if __name__ == '__main__':
     kfs = [KalmanFilter() for _ in range(50)]
     print(kfs)
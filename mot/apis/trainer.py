@@ -1,21 +1,38 @@
 import os
 import torch
+import logging
+from torch.nn.parallel import DistributedDataParallel
 from mot.utils import get_logger
-from mot.datasets import build_dataloader
+from mot.utils import is_distributed, is_main_process, get_rank, get_local_rank
+from mot.datasets import build_dataloader, build_augment
 from mot.optimizers import build_optimizer, build_lr_scheduler
 from mot.runner import Runner
 
 def train_tracker(model, dataset, config):
-    model.cuda()
+    # One device per process. The process group must have been initialized
+    # for distributed training, see mot.utils.init_distributed.
+    if torch.cuda.is_available():
+        device = torch.device('cuda', get_local_rank())
+        torch.cuda.set_device(device)
+    else:
+        device = torch.device('cpu')
+    model.to(device)
 
-    # Build logger.
-    logger_path = os.path.join(config.SYSTEM.TASK_DIR, 'log.txt')
-    logger = get_logger(path=logger_path)
+    # Build logger. Only rank 0 writes the log file.
+    if is_main_process():
+        logger_path = os.path.join(config.SYSTEM.TASK_DIR, 'log.txt')
+        logger = get_logger(path=logger_path)
+    else:
+        logger = logging.getLogger('rank{}'.format(get_rank()))
+        logger.setLevel(logging.WARNING)
     
     # Build dataloader.
     dataloader = build_dataloader(dataset, config)
     logger.info('Build dataloader done.')
     
+    # Build batched augmentation.
+    augment = build_augment(config.DATALOADER.AUGMENT)
+    
     # Build optimizer.
     config.SOLVER.OPTIM.ARGS[0].append(model.parameters())
     optimizer = build_optimizer(config.SOLVER.OPTIM)
@@ -28,18 +45,26 @@ def train_tracker(model, dataset, config):
     logger.info('Build learning scheduler done.')
     
     # If resume training from checkpoint:
-    epoch, batch = 0, 0
+    epoch, batch, scaler = 0, 0, None
     if config.SYSTEM.RESUME:
         cpath = os.path.join(config.SYSTEM.TASK_DIR, 'latest.pth')
-        checkpoint = torch.load(cpath)
+        checkpoint = torch.load(cpath, map_location=device)
         model.load_state_dict(checkpoint['model'])
         optimizer.load_state_dict(checkpoint['optimizer'])
         lr_scheduler.load_state_dict(checkpoint['lr_scheduler'])
+        scaler = checkpoint.get('scaler', None)
         epoch = checkpoint['epoch']
         batch = checkpoint['batch']
         logger.info('Resume training:'
             ' load checkpoint from {} done.'.format(cpath))
     
+    # Wrap model for distributed data parallel training.
+    if is_distributed():
+        model = DistributedDataParallel(model,
+            device_ids=[device.index] if device.type == 'cuda' else None,
+            find_unused_parameters=True)
+        logger.info('Build distributed data parallel model done.')
+    
     # Build task runner.
     runner = Runner(model, dataloader, optimizer, lr_scheduler,
         config.SOLVER.EPOCHS, epoch=epoch, batch=batch,
@@ -49,7 +74,11 @@ def train_tracker(model, dataset, config):
         log_inter=config.SYSTEM.LOG_INTERVAL,
         model_save_inter=config.SYSTEM.MODEL_SAVE_INTERVAL,
         report_inter=config.SYSTEM.REPORT_INTERVAL,
-        report_args=config.SYSTEM.REPORT_ARGS)
+        report_args=config.SYSTEM.REPORT_ARGS, augment=augment,
+        device=device, accumulated_batches=config.SOLVER.ACCUMULATED_BATCHES,
+        amp=config.SOLVER.AMP)
+    if scaler is not None:
+        runner.scaler.load_state_dict(scaler)
     logger.info('Build task runner done.')
     
     # Execute training task now.
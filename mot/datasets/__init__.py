@@ -1,5 +1,8 @@
+from .labelindex import LabelIndex, SampleIndex
 from .hotchpotch import HotchpotchDataset
 from .colloates import TrackerCollate
-from .builder import build_dataset, build_dataloader
+from .builder import build_dataset, build_dataloader, build_augment
 from .iterabledatasetbase import IterableDatasetBase
-from .dbshotchpotch import DBSHotchpotchDataset
\ No newline at end of file
+from .dbshotchpotch import DBSHotchpotchDataset
+from .shard import ShardDataset, ShardWriter
+from .batchaugment import BatchAugment
\ No newline at end of file
@@ -0,0 +1,177 @@
+import math
+import torch
+import numpy as np
+import torch.nn.functional as F
+from mot.datasets.builder import AUGMENTS
+
+@AUGMENTS.register_module()
+class BatchAugment(object):
+    '''Batched data augmentation after collation, e.g. on GPU. It does
+    what LoadImagesAndLabels does per sample in workers, so the dataset
+    only decodes and letterboxes (set its 'augment' argument to False).
+    Saturation and value jitter, random affine, left-right flip and
+    multiple scales resizing are applied to the whole batch, the affine,
+    the flip and the resizing with one grid_sample.
+
+    Param
+    -----
+    hsv       : Fraction of saturation and value jitter, 0 to disable.
+    degrees   : Rotation range in degrees.
+    translate : Translation range, fraction of width and height.
+    scale     : Scaling range.
+    shear     : Shear range in degrees.
+    flip      : Probability of left-right flip.
+    sizes     : Candidate input sizes [[height, width], ...] for multiple
+        scales training, None to keep the collated size.
+    period    : A new size is sampled every 'period' batches.
+    fill      : Border value of warped images.
+    max_value : Maximum pixel value, 255 for images without normalization.
+    '''
+    def __init__(self, hsv=0.5, degrees=(-5, 5), translate=(0.1, 0.1),
+        scale=(0.5, 1.2), shear=(-2, 2), flip=0.5, sizes=None, period=80,
+        fill=127.5, max_value=255.0):
+        self.hsv = hsv
+        self.degrees = degrees
+        self.translate = translate
+        self.scale = scale
+        self.shear = shear
+        self.flip = flip
+        self.sizes = sizes
+        self.period = period
+        self.fill = fill
+        self.max_value = max_value
+        self.count = 0
+        self.size = None
+
+    def __call__(self, images, targets, im_size=None):
+        '''Augment a batch.
+
+        Param
+        -----
+        images : (N,C,H,W) float images.
+        targets: (M,7) targets [image_id, class, identity, x, y, w, h] with
+            normalized center x, center y, width and height.
+        im_size: The collated input size tensor [height, width].
+
+        Return
+        ------
+        Augmented images, targets and the input size tensor.
+        '''
+        n, _, h, w = images.size()
+        self.count += 1
+        if self.sizes is not None:
+            if self.size is None or (self.count - 1) % self.period == 0:
+                self.size = self.sizes[np.random.randint(len(self.sizes))]
+            oh, ow = self.size
+        else:
+            oh, ow = h, w
+        if self.hsv > 0:
+            images = self.jitter(images)
+        M, angles = self.random_matrix(n, h, w, images.device)
+        images = self.warp(images, M, oh, ow)
+        targets = self.warp_targets(targets, M, angles, h, w)
+        im_size = torch.tensor([oh, ow], dtype=torch.int32,
+            device=im_size.device if im_size is not None else 'cpu')
+        return images, targets, im_size
+
+    def jitter(self, images):
+        '''Scale saturation and value of each image by random factors
+        in [1 - hsv, 1 + hsv], keeping hue.
+        '''
+        n = images.size(0)
+        a = (torch.rand(2, n, 1, 1, 1, device=images.device) * 2 - 1) * self.hsv + 1
+        value = images.max(dim=1, keepdim=True)[0]
+        # Saturation is (value - channel) / value, scale the distances to value.
+        images = value - (value - images) * a[0]
+        images = images.clamp(0, self.max_value)
+        return (images * a[1]).clamp(0, self.max_value)
+
+    def random_matrix(self, n, h, w, device):
+        '''Random affine matrices like random_affine, combined with the
+        left-right flip. Images and targets share one coordinate system in
+        which pixel i covers [i, i + 1), so the flip x -> w - x is exact
+        for both.
+
+        Return
+        ------
+        (n,3,3) matrices and (n,) rotation angles in degrees.
+        '''
+        rand = lambda lo, hi: torch.rand(n, device=device) * (hi - lo) + lo
+        a = rand(*self.degrees)
+        s = rand(*self.scale)
+        tx = rand(-1, 1) * self.translate[0] * w
+        ty = rand(-1, 1) * self.translate[1] * h
+        sx = torch.tan(rand(*self.shear) * math.pi / 180)
+        sy = torch.tan(rand(*self.shear) * math.pi / 180)
+
+        # Rotation and scale around the image center, like cv2.getRotationMatrix2D.
+        radians = a * math.pi / 180
+        alpha, beta = s * torch.cos(radians), s * torch.sin(radians)
+        cx, cy = w / 2, h / 2
+        R = torch.zeros(n, 3, 3, device=device)
+        R[:, 0, 0], R[:, 0, 1] = alpha, beta
+        R[:, 1, 0], R[:, 1, 1] = -beta, alpha
+        R[:, 0, 2] = (1 - alpha) * cx - beta * cy
+        R[:, 1, 2] = beta * cx + (1 - alpha) * cy
+        R[:, 2, 2] = 1
+        T = torch.eye(3, device=device).repeat(n, 1, 1)
+        T[:, 0, 2], T[:, 1, 2] = tx, ty
+        S = torch.eye(3, device=device).repeat(n, 1, 1)
+        S[:, 0, 1], S[:, 1, 0] = sx, sy
+        L = torch.eye(3, device=device).repeat(n, 1, 1)
+        flipped = torch.rand(n, device=device) < self.flip
+        L[flipped, 0, 0] = -1
+        L[flipped, 0, 2] = w
+        M = L @ S @ T @ R  # ORDER IS IMPORTANT HERE!!
+        return M, a
+
+    def warp(self, images, M, oh, ow):
+        '''Warp images by M and resample them to (oh, ow) at once.'''
+        n, _, h, w = images.size()
+        # Map normalized output coordinates to normalized input coordinates.
+        # With align_corners=False, -1 and 1 are the image borders 0 and w.
+        N = torch.tensor([[2 / w, 0, -1], [0, 2 / h, -1], [0, 0, 1]],
+            device=images.device)
+        theta = (N @ torch.inverse(M) @ torch.inverse(N))[:, :2]
+        grid = F.affine_grid(theta, (n, images.size(1), oh, ow), align_corners=False)
+        images = F.grid_sample(images - self.fill, grid, mode='bilinear',
+            padding_mode='zeros', align_corners=False)
+        return images + self.fill
+
+    def warp_targets(self, targets, M, angles, h, w):
+        '''Warp targets like random_affine, and reject the degenerate ones.'''
+        if targets.size(0) == 0:
+            return targets
+        m = M[targets[:, 0].long()]
+        x, y = targets[:, 3] * w, targets[:, 4] * h
+        bw, bh = targets[:, 5] * w, targets[:, 6] * h
+        x1, y1, x2, y2 = x - bw / 2, y - bh / 2, x + bw / 2, y + bh / 2
+        area0 = bw * bh
+
+        # Warp four corners of each box.
+        corners = torch.stack([torch.stack([x1, y1], 1), torch.stack([x2, y2], 1),
+            torch.stack([x1, y2], 1), torch.stack([x2, y1], 1)], 1)
+        xy = corners @ m[:, :2, :2].transpose(1, 2) + m[:, None, :2, 2]
+        x1, y1 = xy[..., 0].min(1)[0], xy[..., 1].min(1)[0]
+        x2, y2 = xy[..., 0].max(1)[0], xy[..., 1].max(1)[0]
+
+        # Apply angle-based reduction.
+        radians = angles[targets[:, 0].long()] * math.pi / 180
+        reduction = torch.max(torch.sin(radians).abs(), torch.cos(radians).abs()) ** 0.5
+        x, y = (x1 + x2) / 2, (y1 + y2) / 2
+        bw, bh = (x2 - x1) * reduction, (y2 - y1) * reduction
+        x1, x2 = (x - bw / 2).clamp(0, w), (x + bw / 2).clamp(0, w)
+        y1, y2 = (y - bh / 2).clamp(0, h), (y + bh / 2).clamp(0, h)
+
+        # Reject warped boxes outside of image.
+        bw, bh = x2 - x1, y2 - y1
+        area = bw * bh
+        ar = torch.max(bw / (bh + 1e-16), bh / (bw + 1e-16))
+        keep = (bw > 4) & (bh > 4) & (area / (area0 + 1e-16) > 0.1) & (ar < 10)
+
+        targets = targets.clone()
+        targets[:, 3] = (x1 + x2) / 2 / w
+        targets[:, 4] = (y1 + y2) / 2 / h
+        targets[:, 5] = bw / w
+        targets[:, 6] = bh / h
+        return targets[keep]
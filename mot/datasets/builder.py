@@ -1,10 +1,12 @@
 import torch
 import numpy as np
-from torch.utils.data import DataLoader
-from mot.utils import Registry, build_from_config
+from torch.utils.data import DataLoader, IterableDataset
+from torch.utils.data.distributed import DistributedSampler
+from mot.utils import Registry, build_from_config, is_distributed
 
 DATASETS = Registry('datasets')
 COLLATES = Registry('collates')
+AUGMENTS = Registry('augments')
 
 def build_dataset(config):
     return build_from_config(DATASETS, config)
@@ -12,6 +14,11 @@ def build_dataset(config):
 def build_collate(config):
     return build_from_config(COLLATES, config)
 
+def build_augment(config):
+    if not config.NAME:
+        return None
+    return build_from_config(AUGMENTS, config)
+
 def build_dataloader(dataset, config):
     collate_class = build_collate(config.DATALOADER.COLLATE)
     args, kwargs = [], {}
@@ -21,9 +28,15 @@ def build_dataloader(dataset, config):
     shared_size = torch.from_numpy(init_size).share_memory_()
     kwargs['shared_size'] = shared_size
     collate_fn = collate_class(*args, **kwargs)
+    # Every rank loads a disjoint part of the dataset. Iterable datasets
+    # shard themselves, see IterableDatasetBase.
+    sampler, shuffle = None, config.DATALOADER.SHUFFLE
+    if is_distributed() and not isinstance(dataset, IterableDataset):
+        sampler, shuffle = DistributedSampler(dataset, shuffle=shuffle), False
     dataloader = DataLoader(dataset,
-        batch_size=config.SOLVER.BATCH_SIZE,
-        shuffle=config.DATALOADER.SHUFFLE,
+        batch_size=config.SOLVER.BATCH_SIZE // config.SOLVER.ACCUMULATED_BATCHES,
+        shuffle=shuffle, sampler=sampler,
         num_workers=config.SYSTEM.NUM_WORKERS,
-        collate_fn=collate_fn, pin_memory=True, drop_last=True)
+        collate_fn=collate_fn, drop_last=True,
+        pin_memory=config.SYSTEM.PIN_MEMORY and torch.cuda.is_available())
     return dataloader
\ No newline at end of file
@@ -18,21 +18,24 @@ class TrackerCollate(object):
 
     def __call__(self, *args, **kwargs):
         """Get collate_fn"""
-        def collate(batch, shared_size=None):
-            images, targets = [], []
-            for image_id, (image, target) in enumerate(batch):
-                # Target format: image_id, class, identity, x, y, w, h
-                target[:, 0] = image_id
-                images.append(image)
-                targets.append(target)
-            images = torch.stack(tensors=images, dim=0)
-            if self._multiscale:
-                images = F.interpolate(images,
-                    size=shared_size.numpy().tolist(), mode='area')
-            targets = torch.cat(tensors=targets, dim=0)
-            return images, targets, shared_size
-        return partial(collate, *args, **kwargs)
+        # A partial of a module level function can be pickled, so it also
+        # works for workers started by spawn, e.g. in distributed training.
+        return partial(collate, self._multiscale, *args, **kwargs)
     
     @property
     def multiscale(self):
-        return self._multiscale
\ No newline at end of file
+        return self._multiscale
+
+def collate(multiscale, batch, shared_size=None):
+    images, targets = [], []
+    for image_id, (image, target) in enumerate(batch):
+        # Target format: image_id, class, identity, x, y, w, h
+        target[:, 0] = image_id
+        images.append(image)
+        targets.append(target)
+    images = torch.stack(tensors=images, dim=0)
+    if multiscale:
+        images = F.interpolate(images,
+            size=shared_size.numpy().tolist(), mode='area')
+    targets = torch.cat(tensors=targets, dim=0)
+    return images, targets, shared_size
\ No newline at end of file
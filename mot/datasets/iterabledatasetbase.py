@@ -3,6 +3,7 @@ import numpy as np
 from abc import abstractmethod
 from multiprocessing import Array
 from torch.utils.data import IterableDataset, get_worker_info
+from mot.utils import get_rank, get_world_size
 
 class IterableDatasetBase(IterableDataset):
     '''Iterable dataset for dynamic size batch loading.
@@ -18,22 +19,33 @@ class IterableDatasetBase(IterableDataset):
         self.end = end
         # Shared between multi-process
         self.indices = Array('i', range(start, end))
+        self.epoch = 0
+        self.rank = get_rank()
+        self.world_size = get_world_size()
    
+    def set_epoch(self, epoch):
+        """Ranks shuffle with the same seed in an epoch for distributed training"""
+        self.epoch = epoch
+        self.rank = get_rank()
+        self.world_size = get_world_size()
+    
     def __iter__(self):
+        # Every worker of every rank iterates a disjoint shard.
         worker_info = get_worker_info()
-        self.worker_id = worker_info.id
-        if worker_info is None: # For single process data loading
-            self.iter_start = self.start
-            self.iter_end = self.end
-        else:                   # For multi-process data loading            
-            per_worker = (self.end - self.start + \
-                worker_info.num_workers - 1) // worker_info.num_workers
-            self.iter_start = self.start + self.worker_id * per_worker
-            self.iter_end = min(self.iter_start + per_worker, self.end)
+        self.worker_id = 0 if worker_info is None else worker_info.id
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+        shard = self.rank * num_workers + self.worker_id
+        num_shards = self.world_size * num_workers
+        per_shard = (self.end - self.start + num_shards - 1) // num_shards
+        self.iter_start = self.start + shard * per_shard
+        self.iter_end = min(self.iter_start + per_shard, self.end)
         self.count = self.iter_start
         # Only shuffle once for multi-process
-        if self.iter_start == self.start:
-            np.random.shuffle(self.indices)
+        if self.worker_id == 0:
+            if self.world_size > 1:
+                np.random.RandomState(self.epoch).shuffle(self.indices)
+            else:
+                np.random.shuffle(self.indices)
         return self
     
     @abstractmethod
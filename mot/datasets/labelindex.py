@@ -0,0 +1,238 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import torch
+import numpy as np
+from collections import OrderedDict
+
+def read_dataset_lists(root, cfg):
+    '''Read image paths of each dataset listed in the configuration file,
+    and inference label paths from image paths.
+
+    Param
+    -----
+    root: The dataset root directory.
+    cfg : The dataset configuration file, one dataset list file per line,
+        e.g. ./data/mot17.train.
+
+    Return
+    ------
+    datasets   : The dataset list files.
+    image_paths: OrderedDict of {dataset name: image paths}.
+    label_paths: OrderedDict of {dataset name: label paths}.
+    '''
+    # Read dataset files from configuration file.
+    datasets = open(cfg, 'r').readlines()
+    datasets = [ds.strip() for ds in datasets]
+    datasets = list(filter(lambda x: len(x) > 0, datasets))
+
+    image_paths = OrderedDict()
+    label_paths = OrderedDict()
+    for ds in datasets:
+        ds_name = os.path.basename(ds)  # With suffix
+        ds_name = os.path.splitext(ds_name)[0]
+        with open(ds, 'r') as file:
+            paths = [path.strip() for path in file.readlines()]
+            paths = list(filter(lambda x: len(x) > 0, paths))
+            image_paths[ds_name] = [os.path.join(root, path) for path in paths]
+        label_paths[ds_name] = [label_path_of(path) for path in image_paths[ds_name]]
+    return datasets, image_paths, label_paths
+
+def label_path_of(image_path):
+    '''Inference the label path from the image path.'''
+    label_path = image_path.replace('images', 'labels_with_ids')
+    label_path = label_path.replace('.png', '.txt')
+    label_path = label_path.replace('.jpg', '.txt')
+    return label_path
+
+def _parse_label_file(path):
+    '''Parse a label file with rows of class identifier centerx centery width height.
+    A missing or empty file has no labels.
+    '''
+    if not os.path.isfile(path):
+        return np.zeros((0, 6), dtype=np.float32)
+    with open(path, 'r') as file:
+        values = file.read().split()
+    return np.array(values, dtype=np.float32).reshape(-1, 6)
+
+class LabelIndex(object):
+    '''Compiled labels of several datasets. The boxes of all label files are
+    saved in one (N,6) float32 array which is memory-mapped, so that every
+    DataLoader worker reads labels without parsing text or copying.
+
+    The index is rebuilt when a dataset list file or any label file is
+    modified, added or removed. Deleting the cache directory also forces
+    a rebuild.
+
+    Param
+    -----
+    path: The cache directory written by LabelIndex.build().
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as file:
+            meta = json.load(file)
+        self.names = meta['names']
+        self.num_ims = meta['num_ims']
+        self.num_ids = OrderedDict(zip(self.names, meta['num_ids']))
+        self.id_shifts = OrderedDict(zip(self.names, meta['id_shifts']))
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self._labels = None
+
+    def __getstate__(self):
+        # Workers map the file themselves instead of receiving a pickled copy.
+        state = self.__dict__.copy()
+        state['_labels'] = None
+        return state
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def labels(self):
+        if self._labels is None:
+            self._labels = np.load(os.path.join(self.path, 'labels.npy'), mmap_mode='r')
+        return self._labels
+
+    def get(self, index):
+        '''Labels of the image with the global index.
+
+        Return
+        ------
+        Read-only (n,6) float32 array of class identifier centerx centery width height.
+        '''
+        return self.labels[self.offsets[index] : self.offsets[index + 1]]
+
+    @staticmethod
+    def key(root, datasets, label_paths):
+        '''Cache key of the dataset lists and their label files. It changes
+        if any list is modified, or if a label file is modified, added or
+        removed, i.e. the number of existing label files or their latest
+        modification time of a list changes.
+        '''
+        items = [os.path.abspath(root)]
+        for ds, paths in zip(datasets, label_paths.values()):
+            stat = os.stat(ds)
+            count, latest = 0, 0
+            for path in paths:
+                try:
+                    latest = max(latest, os.stat(path).st_mtime_ns)
+                    count += 1
+                except OSError:     # Missing label files have no labels.
+                    pass
+            items.append([os.path.abspath(ds), stat.st_mtime_ns, stat.st_size,
+                count, latest])
+        return hashlib.sha1(json.dumps(items).encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def build(cls, root, datasets, label_paths, cache_dir):
+        '''Load the label index of the dataset lists from cache_dir, parse all
+        label files and save the index if it does not exist.
+
+        Param
+        -----
+        root       : The dataset root directory.
+        datasets   : The dataset list files, see read_dataset_lists().
+        label_paths: OrderedDict of {dataset name: label paths}.
+        cache_dir  : Directory of label index caches.
+
+        Return
+        ------
+        The LabelIndex.
+        '''
+        path = os.path.join(cache_dir, cls.key(root, datasets, label_paths))
+        if os.path.isfile(os.path.join(path, 'meta.json')):
+            return cls(path)
+
+        names, num_ims, num_ids, id_shifts = [], [], [], []
+        labels, counts = [], []
+        last_id = 0
+        for ds_name, paths in label_paths.items():
+            ds_max_id = -1
+            for label_path in paths:
+                label = _parse_label_file(label_path)
+                if len(label) > 0:
+                    ds_max_id = max(ds_max_id, int(label[:, 1].max()))
+                labels.append(label)
+                counts.append(len(label))
+            names.append(ds_name)
+            num_ims.append(len(paths))
+            # The valid identifier is begin with 0.
+            num_ids.append(ds_max_id + 1)
+            id_shifts.append(last_id)
+            last_id += ds_max_id + 1
+        labels = np.concatenate(labels) if labels else np.zeros((0, 6), np.float32)
+        offsets = np.cumsum([0] + counts).astype(np.int64)
+
+        # Write into a temporary directory and rename it, so that concurrent
+        # processes never see a partial cache.
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cache_dir)
+        np.save(os.path.join(tmp, 'labels.npy'), labels)
+        np.save(os.path.join(tmp, 'offsets.npy'), offsets)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as file:
+            json.dump({'names': names, 'num_ims': num_ims, 'num_ids': num_ids,
+                'id_shifts': id_shifts}, file)
+        try:
+            os.rename(tmp, path)
+        except OSError:     # Built by another process meanwhile.
+            shutil.rmtree(tmp, ignore_errors=True)
+        return cls(path)
+
+class SampleIndex(object):
+    '''Flat index of all samples of several datasets. Row i of the (N,4)
+    int64 table holds the dataset id, the local id in the dataset, and the
+    begin and end offsets of the image path of the sample with global index i.
+    The image paths are packed in one byte buffer. The table and the buffer
+    are shared memory tensors, so DataLoader workers neither hold per-worker
+    copies of path lists nor scan the datasets to locate a sample.
+
+    Param
+    -----
+    image_paths: OrderedDict of {dataset name: image paths}.
+    '''
+    def __init__(self, image_paths):
+        self.names = list(image_paths.keys())
+        paths = [path.encode('utf-8') for ps in image_paths.values() for path in ps]
+        num_ims = [len(ps) for ps in image_paths.values()]
+        acc_ims = np.cumsum([0] + num_ims[:-1]).astype(np.int64)
+        ends = np.cumsum([len(path) for path in paths]).astype(np.int64)
+
+        table = np.empty((len(paths), 4), dtype=np.int64)
+        table[:, 0] = np.repeat(np.arange(len(num_ims)), num_ims)
+        table[:, 1] = np.arange(len(paths)) - np.repeat(acc_ims, num_ims)
+        table[:, 2] = ends - [len(path) for path in paths]
+        table[:, 3] = ends
+        buffer = np.frombuffer(b''.join(paths), dtype=np.uint8).copy()
+        self.table = torch.from_numpy(table).share_memory_()
+        self.buffer = torch.from_numpy(buffer).share_memory_()
+        self._views = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_views'] = None
+        return state
+
+    def __len__(self):
+        return self.table.size(0)
+
+    @property
+    def views(self):
+        # Numpy views of the shared tensors, indexing them is much cheaper.
+        if self._views is None:
+            self._views = (self.table.numpy(), self.buffer.numpy())
+        return self._views
+
+    def locate(self, index):
+        '''Transform the global index to (dataset id, local id).'''
+        table = self.views[0]
+        return int(table[index, 0]), int(table[index, 1])
+
+    def image_path(self, index):
+        table, buffer = self.views
+        return buffer[table[index, 2] : table[index, 3]].tobytes().decode('utf-8')
+
+    def label_path(self, index):
+        return label_path_of(self.image_path(index))
@@ -0,0 +1,139 @@
+import os
+import json
+import torch
+import numpy as np
+from torch.utils.data import Dataset
+from mot.datasets.builder import DATASETS
+from mot.datasets.transforms import LoadImagesAndLabels
+
+class ShardWriter(object):
+    '''Write decoded images and labels into large sequential shard files.
+    Images are saved as raw HWC uint8 bytes, so reading one is a slice of a
+    memory-mapped shard instead of decoding a JPEG or PNG file.
+
+    Param
+    -----
+    path       : The output directory.
+    shard_bytes: Maximum number of bytes of a shard file.
+    '''
+    def __init__(self, path, shard_bytes=1 << 30):
+        self.path = path
+        self.shard_bytes = shard_bytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.images = []    # shard, offset, height, width
+        self.labels = []
+        self.num_shards = 0
+        self.file = None
+        self.offset = 0
+
+    def _open(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(os.path.join(self.path,
+            'shard-{:05d}.bin'.format(self.num_shards)), 'wb')
+        self.num_shards += 1
+        self.offset = 0
+
+    def write(self, image, labels):
+        '''Append an image and its labels.
+
+        Param
+        -----
+        image : HWC uint8 BGR image.
+        labels: (n,6) labels of class identifier centerx centery width height
+            normalized by the image size. The identifiers should be global.
+        '''
+        data = np.ascontiguousarray(image, dtype=np.uint8)
+        if self.file is None or self.offset + data.nbytes > self.shard_bytes:
+            self._open()
+        self.file.write(data.tobytes())
+        self.images.append([self.num_shards - 1, self.offset, data.shape[0], data.shape[1]])
+        self.labels.append(np.asarray(labels, dtype=np.float32).reshape(-1, 6))
+        self.offset += data.nbytes
+
+    def close(self, meta):
+        '''Flush the last shard and save the index.
+
+        Param
+        -----
+        meta: Dictionary saved into meta.json, e.g. names, num_ids of datasets.
+        '''
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        images = np.array(self.images, dtype=np.int64).reshape(-1, 4)
+        labels = np.concatenate(self.labels) if self.labels else \
+            np.zeros((0, 6), dtype=np.float32)
+        offsets = np.cumsum([0] + [len(l) for l in self.labels]).astype(np.int64)
+        np.save(os.path.join(self.path, 'images.npy'), images)
+        np.save(os.path.join(self.path, 'labels.npy'), labels)
+        np.save(os.path.join(self.path, 'offsets.npy'), offsets)
+        meta = dict(meta, num_ims=len(images), num_shards=self.num_shards)
+        with open(os.path.join(self.path, 'meta.json'), 'w') as file:
+            json.dump(meta, file, indent=2)
+
+@DATASETS.register_module()
+class ShardDataset(Dataset):
+    '''Dataset packed by tools/pack_dataset.py. Images are pre-resized,
+    optionally letterboxed, and memory-mapped from sequential shard files.
+    Samples have the same format as HotchpotchDataset.
+
+    Param
+    -----
+    root    : The directory written by tools/pack_dataset.py.
+    backbone: Nerual network backbone architecture, 'darknet' or 'shufflenetv2'.
+    augment : Enable data augmentation or not.
+    img_size: The network input size (height, width).
+    '''
+    def __init__(self, root, backbone='shufflenetv2', augment=True, img_size=(320, 576)):
+        self.root = root
+        self.backbone = backbone
+        with open(os.path.join(root, 'meta.json'), 'r') as file:
+            self.meta = json.load(file)
+        self.images = np.load(os.path.join(root, 'images.npy'))
+        self.offsets = np.load(os.path.join(root, 'offsets.npy'))
+        self.total_ims = len(self.images)
+        self._max_id = sum(self.meta['num_ids']) - 1
+        self._labels = None
+        self._shards = None
+
+        if backbone == 'darknet':
+            self.loader = LoadImagesAndLabels(img_size=img_size, augment=augment)
+        else:
+            self.loader = LoadImagesAndLabels(img_size=img_size, augment=augment,
+                transforms=None)
+
+    def __getstate__(self):
+        # Workers map the shards themselves instead of receiving pickled copies.
+        state = self.__dict__.copy()
+        state['_labels'] = None
+        state['_shards'] = None
+        return state
+
+    def _map(self):
+        self._labels = np.load(os.path.join(self.root, 'labels.npy'), mmap_mode='r')
+        self._shards = [np.memmap(os.path.join(self.root, 'shard-{:05d}.bin'.format(i)),
+            dtype=np.uint8, mode='r') for i in range(self.meta['num_shards'])]
+
+    def __getitem__(self, index):
+        if self._shards is None:
+            self._map()
+        shard, offset, h, w = self.images[index]
+        # Copy out of the read-only map, augmentation works in place.
+        image = np.array(self._shards[shard][offset : offset + h * w * 3]).reshape(h, w, 3)
+        labels0 = self._labels[self.offsets[index] : self.offsets[index + 1]]
+        image, labels, _, _ = self.loader.transform(image, labels0)
+
+        # Identifiers were transformed to global identifiers at pack time.
+        targets = torch.zeros(len(labels), 7)
+        if len(labels) > 0:
+            targets[:, 1:] = torch.from_numpy(np.asarray(labels, dtype=np.float32))
+        return image, targets
+
+    def __len__(self):
+        return self.total_ims
+
+    @property
+    def max_id(self):
+        return self._max_id
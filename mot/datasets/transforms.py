@@ -27,12 +27,35 @@ class LoadImagesAndLabels:  # for training
         self.transforms = transforms
         self.scale = scale
 
-    def get_data(self, img_path, label_path):
-        height = self.height
-        width = self.width
+    def get_data(self, img_path, label_path, labels0=None):
+        '''Load and augment an image and its labels.
+
+        Param
+        -----
+        img_path  : The image path.
+        label_path: The label path, it is not read if labels0 is given.
+        labels0   : (n,6) labels of class identifier centerx centery width height,
+            e.g. from mot.datasets.LabelIndex.
+        '''
         img = cv2.imread(img_path)  # BGR
         if img is None:
             raise ValueError('File corrupt {}'.format(img_path))
+        if labels0 is None and os.path.isfile(label_path):
+            labels0 = np.loadtxt(label_path, dtype=np.float32).reshape(-1, 6)
+        return self.transform(img, labels0, img_path)
+
+    def transform(self, img, labels0, img_path=''):
+        '''Letterbox and augment a decoded image and its labels.
+
+        Param
+        -----
+        img     : BGR image, it may be modified in place.
+        labels0 : (n,6) labels of class identifier centerx centery width height
+            normalized by the image size, or None if there is no label.
+        img_path: The image path, it is returned as is.
+        '''
+        height = self.height
+        width = self.width
         augment_hsv = True
         if self.augment and augment_hsv:
             # SV augmentation by 50%
@@ -59,11 +82,9 @@ class LoadImagesAndLabels:  # for training
         img, ratio, padw, padh = letterbox(img, height=height, width=width)
 
         # Load labels
-        if os.path.isfile(label_path):
-            labels0 = np.loadtxt(label_path, dtype=np.float32).reshape(-1, 6)
-
+        if labels0 is not None:
             # Normalized xywh to pixel xyxy format
-            labels = labels0.copy()
+            labels = np.array(labels0, dtype=np.float32)
             labels[:, 2] = ratio * w * (labels0[:, 2] - labels0[:, 4] / 2) + padw
             labels[:, 3] = ratio * h * (labels0[:, 3] - labels0[:, 5] / 2) + padh
             labels[:, 4] = ratio * w * (labels0[:, 2] + labels0[:, 4] / 2) + padw
@@ -1,8 +1,13 @@
-from .backbones import *
-from .blocks import *
-from .heads import *
-from .losses import *
-from .necks import *
-from .trackers import *
-from .utils import *
-from .builder import *
\ No newline at end of file
+from .builder import *
+from mot.utils import lazy_exports
+
+# Submodules are imported on first access. Registered classes are imported
+# by the registries when configurations reference them, see builder.py.
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.backbones': ['ShuffleNetV2BuildBlock', 'ShuffleNetV2', 'AG', 'SOSBlock', 'SOSNet'],
+    '.blocks': ['Merge'],
+    '.heads': ['JDEHead'],
+    '.losses': ['DIOULoss'],
+    '.necks': ['FPN'],
+    '.trackers': ['JDE'],
+    '.utils': []})
@@ -1,2 +1,5 @@
-from .shufflenetv2 import (ShuffleNetV2BuildBlock, ShuffleNetV2)
-from .sosnet import (AG, SOSBlock, SOSNet)
\ No newline at end of file
+from mot.utils import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.shufflenetv2': ['ShuffleNetV2BuildBlock', 'ShuffleNetV2'],
+    '.sosnet': ['AG', 'SOSBlock', 'SOSNet']})
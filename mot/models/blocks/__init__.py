@@ -1,2 +1,5 @@
-from .merge import Merge
-from .convolution import *
\ No newline at end of file
+from mot.utils import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.merge': ['Merge'],
+    '.convolution': []})
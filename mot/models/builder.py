@@ -8,6 +8,19 @@ LOSSES = Registry('losses')
 TRACKERS = Registry('trackers')
 BLOCKS = Registry('blocks')
 
+# Modules are imported the first time a configuration references them.
+BACKBONES.register_lazy('ShuffleNetV2', 'mot.models.backbones.shufflenetv2')
+BACKBONES.register_lazy('SOSNet', 'mot.models.backbones.sosnet')
+NECKS.register_lazy('FPN', 'mot.models.necks.fpn')
+HEADS.register_lazy('JDEHead', 'mot.models.heads.jde')
+LOSSES.register_lazy('DIOULoss', 'mot.models.losses.iou')
+TRACKERS.register_lazy('JDE', 'mot.models.trackers.jde')
+BLOCKS.register_lazy('ShuffleNetV2BuildBlock', 'mot.models.backbones.shufflenetv2')
+BLOCKS.register_lazy('AG', 'mot.models.backbones.sosnet')
+BLOCKS.register_lazy('SOSBlock', 'mot.models.backbones.sosnet')
+BLOCKS.register_lazy('Merge', 'mot.models.blocks.merge')
+BLOCKS.register_lazy('Conv2d', 'mot.models.blocks.convolution')
+
 def build(register, config):
     '''Build module from yaml format configurations.
     
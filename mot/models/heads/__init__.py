@@ -1 +1,3 @@
-from .jde import JDEHead
\ No newline at end of file
+from mot.utils import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {'.jde': ['JDEHead']})
\ No newline at end of file
@@ -31,6 +31,14 @@ class JDEHead(nn.Module):
     s_cls       : Weight for the classification task.
     s_ide       : Weight for the identifier classification task.
     im_size     : Neural network input size.
+    compact     : If True, evaluation mode returns detections, per-cell
+                  embeddings and the detection to cell index separately
+                  instead of repeating embeddings for every anchor.
+                  Default: False.
+    score_thresh: If not None, evaluation mode only decodes the anchors
+                  whose objectness is greater than score_thresh, and
+                  returns a list of per-image detection tensors.
+                  Default: None.
     '''
     def __init__(self,
         build_block='ShuffleNetV2BuildBlock',
@@ -49,7 +57,9 @@ class JDEHead(nn.Module):
         s_box=[0, 0, 0],
         s_cls=[0, 0, 0],
         s_ide=[0, 0, 0],
-        im_size=[320, 576]):
+        im_size=[320, 576],
+        compact=False,
+        score_thresh=None):
         super(JDEHead, self).__init__()
         
         self.box_dim = 4
@@ -89,6 +99,10 @@ class JDEHead(nn.Module):
         self.s_cls = nn.Parameter(torch.FloatTensor(s_cls))
         self.s_ide = nn.Parameter(torch.FloatTensor(s_ide))
         self.im_size = im_size
+        self.compact = compact
+        self.score_thresh = score_thresh
+        self._grids = {}
+        self._anchor_boxes = {}
         
     def forward(self, input, target=None, im_size=None):
         '''JDEHead forward.
@@ -155,7 +169,7 @@ class JDEHead(nn.Module):
         '''
         self.im_size = im_size
         loss_box, loss_cls, loss_ide = [], [], []
-        for inp, anchor in zip(input, self.anchor):
+        for scale, (inp, anchor) in enumerate(zip(input, self.anchor)):
             n, c, h, w = inp.size()
             stride = im_size[0] / h
             anc = (anchor / stride).type(inp.type()) # Scale anchors to match grid size
@@ -175,7 +189,7 @@ class JDEHead(nn.Module):
             ide = F.normalize(ide).permute(0, 2, 3, 1).contiguous() # NHWC
 
             # Build ground truth based on target.
-            gt_box, gt_cls, gt_ide = self._build_ground_truth(inp, target, im_size, anc)
+            gt_box, gt_cls, gt_ide = self._build_ground_truth(inp, target, im_size, anc, scale)
 
             # Bounding boxes loss.
             obj_mask = gt_cls > 0                   # NAHW
@@ -232,14 +246,92 @@ class JDEHead(nn.Module):
         N is the batch size, and M is the total number of detection outputs.
         For example, if input tensor shapes are (N,152,10,18), (N,152,20,36),
         and (N,152,40,72), embd_dim is 128, M will be (10*18+20*36+40*72)*4.
+        
+        In compact mode, a tuple (det, ide, index) is returned instead. det
+        is the (N, M, box_dim+class_dim) detection tensor, ide is the
+        (N, K, embd_dim) embedding tensor of K grid cells, and index is the
+        (M,) tensor mapping every detection output to its grid cell, i.e.
+        the embedding of det[:, j] is ide[:, index[j]].
+        
+        In sparse mode, i.e. score_thresh is not None, a list of N tensors
+        is returned. The i-th tensor has shape (K_i, box_dim+class_dim+
+        embd_dim) and only contains the outputs of image i whose objectness
+        is greater than score_thresh, in the same order as the dense output.
         '''
-        output = []
+        if self.score_thresh is not None:
+            return self._forward_eval_sparse(input)
+        if self.compact:
+            return self._forward_eval_compact(input)
+        n = input[0].size(0)
+        sizes = [anc.size(0) * inp.size(2) * inp.size(3)
+            for inp, anc in zip(input, self.anchor)]
+        dim = self.box_dim + self.class_dim
+        output = input[0].new_empty(n, sum(sizes), dim + self.embd_dim)
+        offset = 0
+        for inp, anc, size in zip(input, self.anchor, sizes):
+            n, c, h, w = inp.size()
+            num_anchor = anc.size(0)
+            out = output[:, offset : offset + size].view(n, num_anchor, h, w, -1)
+            out[..., :dim] = self._decode_det(inp, anc)
+            # Broadcast along the anchor dimension without repeating.
+            out[..., dim:] = self._decode_ide(inp, anc).unsqueeze(1)
+            offset += size
+        return output.detach().cpu()
+    
+    def _forward_eval_compact(self, input):
+        '''Compact JDEcoder forward propagation. See _forward_eval.'''
+        dim = self.box_dim + self.class_dim
+        det, ide, index = [], [], []
+        offset = 0
         for inp, anc in zip(input, self.anchor):
-            output.append(self._decode(inp, anc))
-        return torch.cat(output, dim=1).detach().cpu()
+            n, c, h, w = inp.size()
+            num_anchor = anc.size(0)
+            det.append(self._decode_det(inp, anc).view(n, -1, dim))
+            ide.append(self._decode_ide(inp, anc).view(n, -1, self.embd_dim))
+            cell = torch.arange(offset, offset + h * w, device=inp.device)
+            index.append(cell.repeat(num_anchor))
+            offset += h * w
+        det = torch.cat(det, dim=1).detach().cpu()
+        ide = torch.cat(ide, dim=1).detach().cpu()
+        index = torch.cat(index).cpu()
+        return det, ide, index
+    
+    def _forward_eval_sparse(self, input):
+        '''Sparse JDEcoder forward propagation. See _forward_eval.'''
+        dim = self.box_dim + self.class_dim
+        n = input[0].size(0)
+        output = [[] for _ in range(n)]
+        for inp, anc in zip(input, self.anchor):
+            n, c, h, w = inp.size()
+            num_anchor = anc.size(0)
+            det_dim = num_anchor * dim
+            det = inp[:, : det_dim, ...].view(n, num_anchor, dim, h, w)
+            
+            # Select candidates by objectness before decoding anything else.
+            prob = det[:, :, self.box_dim:, ...].permute(0, 1, 3, 4, 2).contiguous()
+            prob = torch.softmax(prob, dim=-1)                              # NAHWC
+            b, a, y, x = torch.nonzero(prob[..., 1] > self.score_thresh, as_tuple=True)
+            
+            # Decode boxes and gather embeddings of candidates only.
+            aw, ah, ox, oy = self._grid(anc, w, h, inp)
+            box = det[b, a, : self.box_dim, y, x]
+            box = torch.stack([
+                box[:, 0] * aw[0, a, 0, 0] + ox[0, 0, y, x],
+                box[:, 1] * ah[0, a, 0, 0] + oy[0, 0, y, x],
+                torch.exp(box[:, 2]) * aw[0, a, 0, 0],
+                torch.exp(box[:, 3]) * ah[0, a, 0, 0]], dim=1)
+            cls = prob[b, a, y, x][:, [1, 0]]
+            cls[:, 1] = 0
+            ide = F.normalize(inp[b, det_dim :, y, x])
+            cand = torch.cat([box, cls, ide], dim=1).detach().cpu()
+            
+            counts = torch.bincount(b, minlength=n).cpu().tolist()
+            for i, ci in enumerate(torch.split(cand, counts)):
+                output[i].append(ci)
+        return [torch.cat(o, dim=0) for o in output]
     
-    def _decode(self, input, anchor):
-        '''Decode JDE output.
+    def _decode_det(self, input, anchor):
+        '''Decode JDE detection output.
         
         Param
         -----
@@ -248,13 +340,11 @@ class JDEHead(nn.Module):
         
         Return
         ------
-        Decoded output.
+        Decoded detection tensor with shape (N, A, H, W, box_dim+class_dim).
         '''
         n, c, h, w = input.size()
         num_anchor = anchor.size(0)
         det_dim = num_anchor * (self.box_dim + self.class_dim)
-        
-        # Decode object detection output.
         det = input[:, : det_dim, ...]
         det = det.view(n, num_anchor, self.box_dim + self.class_dim, h, w)
         det = det.permute(0, 1, 3, 4, 2).contiguous()
@@ -262,16 +352,54 @@ class JDEHead(nn.Module):
         det[..., self.box_dim:] = torch.softmax(det[..., self.box_dim:], dim=-1)
         det[..., self.box_dim:] = det[..., self.box_dim:][..., [1, 0]]
         det[..., self.box_dim + 1] = 0
-        det = det.view(n, -1, self.box_dim + self.class_dim)
+        return det
+    
+    def _decode_ide(self, input, anchor):
+        '''Decode JDE identity embedding output.
         
-        # Decode identity embedding output
+        Param
+        -----
+        input : Encoded input tensor.
+        anchor: Anchors with format [[width, height], ...].
+        
+        Return
+        ------
+        Normalized embedding tensor with shape (N, H, W, embd_dim).
+        '''
+        det_dim = anchor.size(0) * (self.box_dim + self.class_dim)
         ide = input[:, det_dim :, ...]
         ide = F.normalize(ide)
-        ide = ide.unsqueeze(1).repeat(1, num_anchor, 1, 1, 1)
-        ide = ide.permute(0, 1, 3, 4, 2).contiguous()
-        ide = ide.view(n, -1, self.embd_dim)
-
-        return torch.cat([det, ide], dim=-1)
+        return ide.permute(0, 2, 3, 1)
+    
+    def _grid(self, anchor, gw, gh, like):
+        '''Get the cached anchor sizes and grid offsets for box decoding.
+        
+        Param
+        -----
+        anchor: Anchor boxes with format [[w, h], ...].
+        gw    : Feature tensor grid width.
+        gh    : Feature tensor grid height.
+        like  : Tensor whose device and data type the grid should have.
+        
+        Return
+        ------
+        Anchor widths and heights with shape (1, A, 1, 1), and grid offsets
+        in the input image along x and y axes with shape (1, 1, H, W).
+        '''
+        key = (tuple(anchor.flatten().tolist()), gw, gh, tuple(self.im_size),
+            like.device, like.dtype)
+        grid = self._grids.get(key)
+        if grid is None:
+            num_anchor = anchor.size(0)
+            anchor = anchor.to(like.device, like.dtype)
+            aw = anchor[:, 0].view(1, num_anchor, 1, 1)
+            ah = anchor[:, 1].view(1, num_anchor, 1, 1)
+            gy, gx = torch.meshgrid(torch.arange(gh), torch.arange(gw))
+            gy = gy.view(1, 1, gh, gw).to(like.device, like.dtype)
+            gx = gx.view(1, 1, gh, gw).to(like.device, like.dtype)
+            grid = (aw, ah, gx * self.im_size[1] / gw, gy * self.im_size[0] / gh)
+            self._grids[key] = grid
+        return grid
     
     def _decode_box(self, box, anchor, gw, gh):
         '''Decode boxes with following equations:
@@ -296,19 +424,14 @@ class JDEHead(nn.Module):
         ------
         Decoded boxes.
         '''
-        num_anchor = anchor.size(0)
-        aw = anchor[:, 0].view(1, num_anchor, 1, 1).type(box.type())
-        ah = anchor[:, 1].view(1, num_anchor, 1, 1).type(box.type())
-        gy, gx = torch.meshgrid(torch.arange(gh), torch.arange(gw))
-        gy = gy.view(1, 1, gy.size(0), gy.size(1)).type(box.type())
-        gx = gx.view(1, 1, gx.size(0), gx.size(1)).type(box.type())
-        box[..., 0] = box[..., 0] * aw + gx * self.im_size[1] / gw  # x
-        box[..., 1] = box[..., 1] * ah + gy * self.im_size[0] / gh  # y
+        aw, ah, ox, oy = self._grid(anchor, gw, gh, box)
+        box[..., 0] = box[..., 0] * aw + ox                         # x
+        box[..., 1] = box[..., 1] * ah + oy                         # y
         box[..., 2] = torch.exp(box[..., 2]) * aw                   # w
         box[..., 3] = torch.exp(box[..., 3]) * ah                   # h        
         return box
     
-    def _build_ground_truth(self, input, target, im_size, anchor):
+    def _build_ground_truth(self, input, target, im_size, anchor, scale=None):
         '''Build ground truth.
         
         Param
@@ -318,6 +441,7 @@ class JDEHead(nn.Module):
                  [[image id, class id, identity, x, y, w, h], ...].
         im_size: Neural network input image size with format [height, width].
         anchor : Anchor parameters with format [[w, h], ...].
+        scale  : Index of the anchor set, see _make_anchor_box.
         
         Return
         ------
@@ -338,13 +462,16 @@ class JDEHead(nn.Module):
         if target.size(0) == 0:
             return box, cls, ide
 
-        # Make target and anchor boxes and calculate IOU matrix between them.
+        # Make target and anchor boxes, and calculate IOUs between targets
+        # and the anchors around them only.
         tg_box = self._make_target_box(target[:, 3:], w, h)                 # T4
-        ac_box = self._make_anchor_box(anchor, w, h)                        # [AHW]4
-        iou = self._iou_xywh(tg_box, ac_box)                                # T[AHW]
-        val, ind = self._iou_max(iou, im_id, n, dim=0)                      # [AHW],[AHW],...
-        max_iou = torch.stack([v.view(a, h, w) for v in val])               # NAHW
-        tg_id = torch.stack([i.view(a, h, w) for i in ind])                 # NAHW
+        ac_box = self._make_anchor_box(anchor, w, h, scale)                 # [AHW]4
+        tg_ind, ac_ind = self._neighbourhood(tg_box, anchor, w, h)          # K,K
+        iou = self._iou_xywh(tg_box[tg_ind], ac_box[ac_ind])                # K
+        cell = im_id[tg_ind] * ac_box.size(0) + ac_ind                      # K
+        max_iou, tg_id = self._iou_max(iou, tg_ind, cell, n * ac_box.size(0))
+        max_iou = max_iou.view(n, a, h, w)                                  # NAHW
+        tg_id = tg_id.view(n, a, h, w)                                      # NAHW
         
         # Calculate ground truth masks based on IOU.
         ide_mask = max_iou > self.ide_thresh                                # NAHW
@@ -355,12 +482,8 @@ class JDEHead(nn.Module):
         # Mask box ground truth.
         tg_box_left = tg_box[tg_id[obj_mask]]
         if isinstance(self.lf_box, nn.SmoothL1Loss):
-            ac_box = ac_box.view(a, h, w, self.box_dim)                     # AHW4
-            ac_box_left = []
-            for i in range(n):
-                ac_box_left.append(ac_box[obj_mask[i]])
-            ac_box_left = torch.cat(ac_box_left, dim=0)
-            box[obj_mask] = self._encode_box(tg_box_left, ac_box_left)
+            ac_box = ac_box.view(1, a, h, w, self.box_dim).expand(n, -1, -1, -1, -1)
+            box[obj_mask] = self._encode_box(tg_box_left, ac_box[obj_mask])
         else:
             box[obj_mask] = tg_box_left * im_size[0] / h
         
@@ -392,29 +515,83 @@ class JDEHead(nn.Module):
         h = norm_box[:, 3] * grid_h
         return torch.stack([x, y, w, h], dim=-1)
     
-    def _make_anchor_box(self, anchor, grid_w, grid_h):
-        '''Make anchor boxes.
+    def _make_anchor_box(self, anchor, grid_w, grid_h, scale=None):
+        '''Make anchor boxes. They are cached for each scale and grid size.
         
         Param
         -----
         anchor: Anchor parameters with format [[w, h], ...].
         grid_w: Feature tensor grid width.
         grid_h: Feature tensor grid height.
+        scale : Index of the anchor set, which identifies the anchors in the
+                cache without reading them back from the device. If it is
+                None, the anchor values are used instead.
         
         Return
         ------
         The anchor box matrix with format [[x, y, w, h], ...].
         '''
-        a = anchor.size(0)
-        y, x = torch.meshgrid(torch.arange(grid_h), torch.arange(grid_w))       # HW
-        x = x.unsqueeze(0).repeat(a, 1, 1).unsqueeze(-1).type(anchor.type())    # AHW1
-        y = y.unsqueeze(0).repeat(a, 1, 1).unsqueeze(-1).type(anchor.type())    # AHW1
-        wh = anchor.unsqueeze(-1).unsqueeze(-1).repeat(1, 1, grid_h, grid_w)    # A2HW
-        wh = wh.permute(0, 2, 3, 1).contiguous()                                # AHW2
-        return torch.cat([x, y, wh], dim=-1).view(-1, self.box_dim)
+        if scale is None:
+            scale = tuple(anchor.flatten().tolist())
+        key = (scale, grid_w, grid_h, anchor.device, anchor.dtype)
+        box = self._anchor_boxes.get(key)
+        if box is None:
+            a = anchor.size(0)
+            y, x = torch.meshgrid(torch.arange(grid_h), torch.arange(grid_w))       # HW
+            x = x.unsqueeze(0).repeat(a, 1, 1).unsqueeze(-1).type(anchor.type())    # AHW1
+            y = y.unsqueeze(0).repeat(a, 1, 1).unsqueeze(-1).type(anchor.type())    # AHW1
+            wh = anchor.unsqueeze(-1).unsqueeze(-1).repeat(1, 1, grid_h, grid_w)    # A2HW
+            wh = wh.permute(0, 2, 3, 1).contiguous()                                # AHW2
+            box = torch.cat([x, y, wh], dim=-1).view(-1, self.box_dim)
+            self._anchor_boxes[key] = box
+        return box
+    
+    def _neighbourhood(self, tg_box, anchor, grid_w, grid_h):
+        '''Find the anchors around each target box. An anchor at cell
+        (x, y) can only overlap a target centered at (cx, cy) if
+        |x - cx| < rx and |y - cy| < ry, where rx and ry are half the sums
+        of the target and anchor widths and heights. The neighbourhood is
+        the cells from floor(cx - rx) to ceil(cx + rx) and from
+        floor(cy - ry) to ceil(cy + ry), clipped to the grid.
+        
+        Param
+        -----
+        tg_box: Target boxes with format [[x, y, w, h], ...].
+        anchor: Anchor parameters with format [[w, h], ...].
+        grid_w: Feature tensor grid width.
+        grid_h: Feature tensor grid height.
+        
+        Return
+        ------
+        Target indices and anchor indices in the anchor box matrix of
+        all target and anchor pairs in the neighbourhoods.
+        '''
+        t, a = tg_box.size(0), anchor.size(0)
+        device = tg_box.device
+        anchor = anchor.to(device, tg_box.dtype)
+        tg = tg_box.unsqueeze(1)                                            # T14
+        rx = (tg[..., 2] + anchor[:, 0]) / 2                                # TA
+        ry = (tg[..., 3] + anchor[:, 1]) / 2                                # TA
+        x0 = torch.clamp(torch.floor(tg[..., 0] - rx), min=0, max=grid_w-1).long()
+        x1 = torch.clamp(torch.ceil(tg[..., 0] + rx), min=0, max=grid_w-1).long()
+        y0 = torch.clamp(torch.floor(tg[..., 1] - ry), min=0, max=grid_h-1).long()
+        y1 = torch.clamp(torch.ceil(tg[..., 1] + ry), min=0, max=grid_h-1).long()
+        nx = (x1 - x0 + 1).view(-1)
+        ny = (y1 - y0 + 1).view(-1)
+        
+        # Enumerate the cells of all windows at once.
+        count = nx * ny                                                     # [TA]
+        pair = torch.repeat_interleave(torch.arange(t * a, device=device), count)
+        begin = torch.cumsum(count, dim=0) - count
+        k = torch.arange(pair.size(0), device=device) - begin[pair]        # K
+        x = x0.view(-1)[pair] + k % nx[pair]
+        y = y0.view(-1)[pair] + k // nx[pair]
+        tg_ind = pair // a
+        ac_ind = ((pair % a) * grid_h + y) * grid_w + x
+        return tg_ind, ac_ind
     
     def _iou_xywh(self, A, B, eps=1e-10):
-        '''Calculate IOU matrix between boxes A and boxes B.
+        '''Calculate IOUs between boxes A and boxes B pairwise.
         
         Param
         -----
@@ -423,52 +600,45 @@ class JDEHead(nn.Module):
         
         Return
         ------
-        The IOU matrix. If the number of boxes A and B is M and N
-        respectively, the IOU matrix shape will be [M, N].
+        The IOU vector. The number of boxes A and B should be the same.
         '''
-        m, n = A.size(0), B.size(0)
         t1, l1 = A[:, 0] - A[:, 2] / 2, A[:, 1] - A[:, 3] / 2
         b1, r1 = A[:, 0] + A[:, 2] / 2, A[:, 1] + A[:, 3] / 2
         t2, l2 = B[:, 0] - B[:, 2] / 2, B[:, 1] - B[:, 3] / 2
         b2, r2 = B[:, 0] + B[:, 2] / 2, B[:, 1] + B[:, 3] / 2
-        area1 = (A[:, 2] * A[:, 3]).view(-1, 1).expand(m, n)
-        area2 = (B[:, 2] * B[:, 3]).view(1, -1).expand(m, n)
+        area1 = A[:, 2] * A[:, 3]
+        area2 = B[:, 2] * B[:, 3]
         
-        ti, li = torch.max(t1.unsqueeze(1), t2), torch.max(l1.unsqueeze(1), l2)
-        bi, ri = torch.min(b1.unsqueeze(1), b2), torch.min(r1.unsqueeze(1), r2)
+        ti, li = torch.max(t1, t2), torch.max(l1, l2)
+        bi, ri = torch.min(b1, b2), torch.min(r1, r2)
         wi, hi = torch.clamp(ri - li, 0), torch.clamp(bi - ti, 0)
         inter = wi * hi
         
         return inter / (area1 + area2 - inter + eps)
     
-    def _iou_max(self, iou, im_id, batch_size, dim=0):
-        '''Find the maximum IOUs between target and anchor boxes.
+    def _iou_max(self, iou, tg_ind, cell, size):
+        '''Find the maximum IOUs between target and anchor boxes of all
+        images in the batch at once.
         
         Param
         -----
-        iou       : IOU matrix between target and anchor boxes.
-        im_id     : Image indices of target boxes.
-        batch_size: Batch size.
-        dim       : The dimension looking for the maximum IOUs.
+        iou   : IOUs of target and anchor pairs.
+        tg_ind: Target indices of the pairs.
+        cell  : Indices of the anchors of the pairs in the batch, that is
+                image id * number of anchor boxes + anchor index.
+        size  : Number of anchor boxes in the batch.
         
         Return
         ------
-        The maximum IOUs and corresponding indices
-        along dimension /dim/.
+        The maximum IOU of each anchor box and the index of the target
+        giving it. The lowest index is taken if several targets give it.
+        Anchor boxes overlapping no target have zero IOU and index 0.
         '''
-        val, ind = [], []
-        last_ind = 0
-        for i in range(batch_size):
-            iou_i = iou[im_id == i]
-            if iou_i.size(0) > 0:
-                val_i, ind_i = iou_i.max(dim)
-                ind_i += last_ind   # Transform index in image to index in batch.
-            else:   # No object in current image.
-                val_i = torch.FloatTensor(iou_i.size(1),).fill_(0).to(iou.device)
-                ind_i = torch.LongTensor(iou_i.size(1),).fill_(False).to(iou.device)
-            val.append(val_i)
-            ind.append(ind_i)
-            last_ind += iou_i.size(0)
+        val = iou.new_zeros(size).scatter_reduce(0, cell, iou, 'amax')
+        best = (iou == val[cell]) & (iou > 0)
+        ind = torch.full((size,), tg_ind.numel(), dtype=torch.long, device=iou.device)
+        ind = ind.scatter_reduce(0, cell[best], tg_ind[best], 'amin')
+        ind[val == 0] = 0
         return val, ind
 
     def _encode_box(self, tg_box, ac_box):
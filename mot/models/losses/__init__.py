@@ -1 +1,3 @@
-from .iou import DIOULoss
\ No newline at end of file
+from mot.utils import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {'.iou': ['DIOULoss']})
\ No newline at end of file
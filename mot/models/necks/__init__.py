@@ -1 +1,3 @@
-from .fpn import FPN
\ No newline at end of file
+from mot.utils import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {'.fpn': ['FPN']})
\ No newline at end of file
@@ -1 +1,3 @@
-from .jde import JDE
\ No newline at end of file
+from mot.utils import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {'.jde': ['JDE']})
\ No newline at end of file
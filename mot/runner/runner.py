@@ -3,8 +3,11 @@ import torch
 import numpy as np
 import os.path as osp
 from functools import wraps
+from contextlib import nullcontext
 from collections import defaultdict
-from mot.utils import move_tensors_to_gpu
+from torch.nn.parallel import DistributedDataParallel
+from mot.utils import move_tensors_to_gpu, move_tensors_to_device
+from mot.utils import is_main_process, reduce_metrics, even_batches
 from mot.utils import build_excel, append_excel
 from mot.datasets import HotchpotchDataset, DBSHotchpotchDataset
 
@@ -22,6 +25,16 @@ def Trigger(unit):
         return wrapper
     return decorator
 
+def average_metrics(metrics):
+    """Average float metrics of micro-batches, keep the last str metrics"""
+    averaged = {}
+    for k, v in metrics[-1].items():
+        if isinstance(v, float):
+            averaged[k] = sum(m[k] for m in metrics) / len(metrics)
+        else:
+            averaged[k] = v
+    return averaged
+
 class Runner(object):
     '''Simple runner for training and validation.
     
@@ -42,12 +55,24 @@ class Runner(object):
     log_inter   : Logger working period. Unit: batch.
     model_save_inter: Model saving period. Unit: epoch.
     report_inter: E-mail reporting period. Unit: epoch.
+    augment     : Batched augmentation applied to the data on GPU,
+                  e.g. mot.datasets.BatchAugment. None to disable.
+    device      : The training device. Defaults to the current CUDA device.
+    accumulated_batches: Number of micro-batches whose gradients are
+                  accumulated for one optimizer step. Batch counting,
+                  warmup and metrics are per accumulated batch.
+    amp         : Enable automatic mixed precision, float16 with gradient
+                  scaling on GPU, bfloat16 on CPU.
+    
+    For distributed training the model is a DistributedDataParallel,
+    metrics are averaged over ranks, and only rank 0 logs and saves.
     '''
     def __init__(self, model, dataloader, optimizer, lr_scheduler,
         total_epochs, epoch=0, batch=0, warmup=1000,
         work_flow=[('train', 1), ('val', 0)], logger=None,
         task_dir=os.getcwd(), log_inter=40, model_save_inter=2,
-        report_inter=10, report_args=''):
+        report_inter=10, report_args='', augment=None, device=None,
+        accumulated_batches=1, amp=False):
         self.model = model
         self.dataloader = dataloader
         self.optimizer = optimizer
@@ -69,21 +94,59 @@ class Runner(object):
         self.rm_metrics = defaultdict(float)
         self.xlspath = os.path.join(task_dir, 'log.xls')
         self.report_args = report_args
+        self.augment = augment
+        self.device = device
+        self.accumulated_batches = accumulated_batches
+        self.amp = amp
+        self.device_type = 'cuda' if device is None else torch.device(device).type
+        self.amp_dtype = torch.float16 if self.device_type == 'cuda' else torch.bfloat16
+        self.scaler = torch.amp.GradScaler(self.device_type,
+            enabled=amp and self.device_type == 'cuda')
 
     def train(self, **kwargs):
         """Training mode"""
         self._epoch += 1
         self.model.train()
         self.optimizer.zero_grad()
-        for i, data in enumerate(self.dataloader):
+        # Reshuffle the shards of every rank consistently.
+        for obj in (self.dataloader.sampler, self.dataloader.dataset):
+            if hasattr(obj, 'set_epoch'):
+                obj.set_epoch(self._epoch)
+        micro_metrics = []
+        for i, data in enumerate(even_batches(self.dataloader)):
+            if self.device is None:
+                data = move_tensors_to_gpu(data)
+            else:
+                data = move_tensors_to_device(data, self.device, non_blocking=True)
+            if self.augment is not None:
+                data = list(self.augment(*data))
+            
+            # Gradients are only synchronized between ranks at the last
+            # micro-batch of an accumulated batch.
+            last = (i + 1) % self.accumulated_batches == 0
+            if not last and isinstance(self.model, DistributedDataParallel):
+                context = self.model.no_sync()
+            else:
+                context = nullcontext()
+            with context:
+                with torch.autocast(self.device_type, dtype=self.amp_dtype,
+                    enabled=self.amp):
+                    loss, metrics = self.model(*data)
+                self.scaler.scale(loss / self.accumulated_batches).backward()
+            micro_metrics.append(metrics)
+            if not last:
+                continue
+            
             self._batch += 1
             self.lr_warmup()
-            data = move_tensors_to_gpu(data)
-            loss, metrics = self.model(*data)
-            loss.backward()
-            self.optimizer.step()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
             self.optimizer.zero_grad()
-            self.smooth_metrics(metrics, i + 1)
+            self.smooth_metrics(average_metrics(micro_metrics),
+                (i + 1) // self.accumulated_batches)
+            micro_metrics = []
+        # Drop the gradients of an incomplete accumulated batch.
+        self.optimizer.zero_grad()
         self.lr_scheduler.step()
         self.save_checkpoint()
         self.report_email()
@@ -120,6 +183,8 @@ class Runner(object):
     @Trigger('BATCH')
     def log_metrics(self, batch_id):
         """Log metrics in file"""
+        if not is_main_process():
+            return
         # For simplify, only supported str and float
         # type metrics return by model.
         npg = len(self.optimizer.param_groups)
@@ -134,9 +199,9 @@ class Runner(object):
         
         # DataLoader with IterableDataset has no method 'len'
         if isinstance(self.dataloader.dataset, HotchpotchDataset):
-            nbatch_per_epoch = len(self.dataloader)
+            nbatch_per_epoch = len(self.dataloader) // self.accumulated_batches
         else:
-            nbatch_per_epoch = np.Inf
+            nbatch_per_epoch = np.inf
         
         mval = [('%g/%g') % (self._epoch, self._total_epochs),
             ('%g/%g') % (batch_id, nbatch_per_epoch)] + \
@@ -159,6 +224,7 @@ class Runner(object):
         """Calculate running mean of all metrics"""
         # For simplify, only supported str and float
         # type metrics return by model.
+        metrics = reduce_metrics(metrics)
         for k, v in metrics.items():
             if isinstance(v, str):
                 self.rm_metrics[k] = v
@@ -173,28 +239,42 @@ class Runner(object):
     @Trigger('EPOCH')
     def save_model(self):
         """Save model only"""
-        mname = type(self.model).__name__
+        if not is_main_process():
+            return
+        mname = type(self.bare_model).__name__
         mname = '%s-%03d.pth' % (mname, self._epoch)
-        torch.save(self.model.state_dict(),
+        torch.save(self.bare_model.state_dict(),
             os.path.join(self.task_dir, mname))
     
     def save_checkpoint(self):
         """Save everything for resume training"""
+        if not is_main_process():
+            return
         cname = os.path.join(self.task_dir, 'latest.pth')
-        torch.save({'model': self.model.state_dict(),
+        torch.save({'model': self.bare_model.state_dict(),
             'optimizer': self.optimizer.state_dict(),
             'lr_scheduler': self.lr_scheduler.state_dict(),
+            'scaler': self.scaler.state_dict(),
             'epoch': self._epoch, 'batch': self._batch}, cname)
         self.save_model()
     
     @Trigger('EPOCH')
     def report_email(self):
+        if not is_main_process():
+            return
         cwd = os.getcwd()
         cmd = 'python ' + osp.join(cwd, 'tools', 'emailsender.py') + \
             self.report_args + ' -e ' + osp.join(cwd,
             self.task_dir, 'log.xls')
         os.system(cmd)
     
+    @property
+    def bare_model(self):
+        """Get the model without DistributedDataParallel wrapper"""
+        if isinstance(self.model, DistributedDataParallel):
+            return self.model.module
+        return self.model
+    
     @property
     def epoch(self):
         """Get current epoch number"""
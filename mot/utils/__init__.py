@@ -1,6 +1,10 @@
 from .config import _C as config
 from .registry import Registry, build_from_config
+from .lazy import lazy_exports
 from .logger import get_logger
 from .path import mkdirs
-from .tensor import move_tensors_to_gpu
-from .excel import build_excel, append_excel
\ No newline at end of file
+from .tensor import move_tensors_to_gpu, move_tensors_to_device
+from .excel import build_excel, append_excel, read_excel_head
+from .distributed import (init_distributed, is_distributed, get_rank,
+    get_world_size, get_local_rank, is_main_process, reduce_metrics,
+    even_batches)
\ No newline at end of file
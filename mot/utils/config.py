@@ -6,7 +6,9 @@ _C.COPYRIGHT = CN()
 _C.COPYRIGHT.AUTHOR = "Zhiwei Tseng"
 
 _C.SYSTEM = CN()
-_C.SYSTEM.NUM_GPUS = 1
+_C.SYSTEM.NUM_GPUS = 1     # Number of training processes per node
+_C.SYSTEM.DIST_BACKEND = 'gloo'
+_C.SYSTEM.DIST_URL = 'env://'
 _C.SYSTEM.NUM_WORKERS = 8
 _C.SYSTEM.PIN_MEMORY = True
 _C.SYSTEM.TASK_DIR = './tasks/'
@@ -26,6 +28,11 @@ _C.DATALOADER.COLLATE = CN()
 _C.DATALOADER.COLLATE.NAME = "TrackerCollate"
 _C.DATALOADER.COLLATE.ARGS = [[], {'multiscale': False}]
 _C.DATALOADER.SHUFFLE = True
+# Batched augmentation after collation, e.g. 'BatchAugment'. Set the
+# dataset 'augment' argument to False if it is enabled.
+_C.DATALOADER.AUGMENT = CN()
+_C.DATALOADER.AUGMENT.NAME = ""
+_C.DATALOADER.AUGMENT.ARGS = [[], {}]
 
 _C.MODEL = CN()
 _C.MODEL.NAME = "JDE"
@@ -71,7 +78,9 @@ _C.MODEL.ARGS.HEAD.ARGS = [[], {
 
 _C.SOLVER = CN()
 _C.SOLVER.BATCH_SIZE = 64
+# BATCH_SIZE is split into ACCUMULATED_BATCHES micro-batches.
 _C.SOLVER.ACCUMULATED_BATCHES = 1
+_C.SOLVER.AMP = False
 _C.SOLVER.WARMUP = 1000
 _C.SOLVER.EPOCHS = 100
 _C.SOLVER.WORK_FLOW = [('train', 1), ('val', 0)]
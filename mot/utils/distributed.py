@@ -0,0 +1,82 @@
+import os
+import torch
+import torch.distributed as dist
+
+def init_distributed(rank, world_size, backend='gloo', init_method='env://'):
+    '''Initialize the default process group.
+
+    Param
+    -----
+    rank       : Rank of the current process.
+    world_size : Number of processes.
+    backend    : 'gloo' works on CPU and GPU, 'nccl' on GPU only.
+    init_method: URL specifying how to initialize the process group. For
+                 'env://', MASTER_ADDR and MASTER_PORT default to a local
+                 address if they are not set, e.g. by torchrun.
+    '''
+    if init_method == 'env://':
+        os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+        os.environ.setdefault('MASTER_PORT', '29500')
+    dist.init_process_group(backend, init_method=init_method,
+        rank=rank, world_size=world_size)
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+def get_local_rank():
+    '''Rank of the current process on its node.'''
+    return int(os.environ.get('LOCAL_RANK', get_rank()))
+
+def is_main_process():
+    return get_rank() == 0
+
+def reduce_metrics(metrics):
+    '''Average float metrics over all processes. Other types are kept.
+
+    Param
+    -----
+    metrics: Dictionary of metrics.
+
+    Return
+    ------
+    Dictionary of reduced metrics.
+    '''
+    if get_world_size() == 1:
+        return metrics
+    names = [k for k, v in metrics.items() if isinstance(v, float)]
+    device = 'cuda' if dist.get_backend() == 'nccl' else 'cpu'
+    values = torch.tensor([metrics[k] for k in names], dtype=torch.float64,
+        device=device)
+    dist.all_reduce(values)
+    values /= get_world_size()
+    reduced = dict(metrics)
+    reduced.update(zip(names, values.tolist()))
+    return reduced
+
+def even_batches(iterable):
+    '''Iterate in lockstep with the other processes and stop as soon as any
+    of them is exhausted, so that no process waits forever in a collective
+    operation. Datasets with dynamic batch sizes give uneven batch counts.
+
+    Param
+    -----
+    iterable: The iterable of this process, e.g. a DataLoader.
+    '''
+    if get_world_size() == 1:
+        yield from iterable
+        return
+    device = 'cuda' if dist.get_backend() == 'nccl' else 'cpu'
+    iterator = iter(iterable)
+    while True:
+        item = next(iterator, None)
+        alive = torch.tensor([0 if item is None else 1], device=device)
+        dist.all_reduce(alive, op=dist.ReduceOp.MIN)
+        if alive.item() == 0:
+            return
+        yield item
@@ -0,0 +1,302 @@
+import os
+import lap
+import numpy as np
+import os.path as osp
+from multiprocessing import Pool
+
+# Same order as the summary line printed by the MOTChallenge devkit.
+METRICS = ['MOTA', 'MOTP', 'IDF1', 'IDP', 'IDR', 'Rcll', 'Prcn',
+    'TP', 'FP', 'FN', 'MTR', 'PTR', 'MLR', 'MT', 'PT', 'ML', 'FAR',
+    'FM', 'FMR', 'IDSW', 'IDSWR']
+
+# MOT16/17 classes. Results matched to distractors are neither false positives
+# nor true positives, they are removed before evaluation like the devkit does.
+PEDESTRIAN = 1
+DISTRACTORS = (2, 7, 8, 12)
+
+def load_mot_file(path):
+    '''Load a MOTChallenge gt or result file.
+
+    Param
+    -----
+    path: Path to a text file with rows of
+        frame,id,left,top,width,height,conf/flag,class,visibility.
+
+    Return
+    ------
+    Float64 array of N rows and 9 columns, sorted by frame. Missing columns
+    of result files are filled with -1.
+    '''
+    data = np.zeros((0, 9))
+    if osp.isfile(path) and osp.getsize(path) > 0:
+        rows = np.loadtxt(path, delimiter=',', ndmin=2)
+        data = np.full((len(rows), 9), -1, dtype=np.float64)
+        data[:, :min(9, rows.shape[1])] = rows[:, :9]
+    return data[np.argsort(data[:, 0], kind='stable')]
+
+def iou_matrix(a, b):
+    '''Vectorized IoU between two sets of [left,top,width,height] boxes.
+
+    Return
+    ------
+    IoU matrix of len(a) rows and len(b) columns.
+    '''
+    a = a[:, None, :]
+    b = b[None, :, :]
+    w = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - \
+        np.maximum(a[..., 0], b[..., 0])
+    h = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - \
+        np.maximum(a[..., 1], b[..., 1])
+    inter = np.clip(w, 0, None) * np.clip(h, 0, None)
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - inter
+    return inter / np.maximum(union, 1e-12)
+
+def _assign(ious, thresh):
+    '''Maximum IoU bipartite matching, pairs with IoU below thresh are
+    never matched.
+
+    Return
+    ------
+    Row indices and column indices of the matched pairs.
+    '''
+    if ious.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    costs = np.where(ious >= thresh, 1 - ious, 1e5)
+    _, x, _ = lap.lapjv(costs, extend_cost=True, cost_limit=1 - thresh + 1e-9)
+    rows = np.where(x >= 0)[0]
+    return rows, x[rows]
+
+def _split_frames(data):
+    '''Split rows sorted by frame into a dictionary {frame: rows}.'''
+    frames, starts = np.unique(data[:, 0].astype(np.int64), return_index=True)
+    ends = np.append(starts[1:], len(data))
+    return {f: data[s : e] for f, s, e in zip(frames, starts, ends)}
+
+def preprocess(gt, res, thresh=0.5, min_visibility=0):
+    '''Remove results matched to distractors and keep the considered
+    pedestrians of the ground truth only.
+
+    Param
+    -----
+    gt            : Ground truth loaded by load_mot_file().
+    res           : Tracking result loaded by load_mot_file().
+    thresh        : IoU threshold of matching.
+    min_visibility: Ground truth with lower visibility is ignored.
+
+    Return
+    ------
+    Filtered ground truth and result.
+    '''
+    has_class = gt[:, 7] >= 0
+    if not has_class.any():     # Files without class, e.g. 2D MOT 2015.
+        return gt[gt[:, 6] != 0], res
+    gt_frames = _split_frames(gt)
+    keep = np.ones(len(res), dtype=bool)
+    offset = 0
+    for frame, rows in _split_frames(res).items():
+        if frame in gt_frames:
+            gts = gt_frames[frame]
+            i, j = _assign(iou_matrix(gts[:, 2:6], rows[:, 2:6]), thresh)
+            distractor = np.isin(gts[i, 7], DISTRACTORS)
+            distractor |= (gts[i, 7] == PEDESTRIAN) & (gts[i, 8] < min_visibility)
+            keep[offset + j[distractor]] = False
+        offset += len(rows)
+    valid = (gt[:, 6] != 0) & (gt[:, 7] == PEDESTRIAN) & (gt[:, 8] >= min_visibility)
+    return gt[valid], res[keep]
+
+def evaluate_sequence(gt, res, thresh=0.5):
+    '''Accumulate CLEAR MOT and identity counts of a sequence.
+
+    Param
+    -----
+    gt    : Preprocessed ground truth.
+    res   : Preprocessed tracking result.
+    thresh: IoU threshold of matching.
+
+    Return
+    ------
+    Dictionary of raw counts, they can be summed over sequences and
+    turned into metrics by compute_metrics().
+    '''
+    gt_ids, gt_index = np.unique(gt[:, 1].astype(np.int64), return_inverse=True)
+    res_ids, res_index = np.unique(res[:, 1].astype(np.int64), return_inverse=True)
+    gt = np.column_stack([gt, gt_index])
+    res = np.column_stack([res, res_index])
+    gt_frames = _split_frames(gt)
+    res_frames = _split_frames(res)
+    frames = sorted(set(gt_frames.keys()) | set(res_frames.keys()))
+    empty = np.zeros((0, gt.shape[1]))
+
+    num_gt_ids, num_res_ids = len(gt_ids), len(res_ids)
+    mapping = np.full(num_gt_ids, -1, dtype=np.int64)     # last matched result
+    tracked = np.zeros(num_gt_ids, dtype=np.int64)        # matched frames
+    lifespan = np.zeros(num_gt_ids, dtype=np.int64)
+    last_status = np.zeros(num_gt_ids, dtype=np.int8)     # 0: never, 1: tracked, 2: missed
+    fragments = np.zeros(num_gt_ids, dtype=np.int64)
+    pair_keys = []
+    tp = fp = fn = idsw = 0
+    overlap = 0.0
+    for frame in frames:
+        gts = gt_frames.get(frame, empty)
+        ress = res_frames.get(frame, empty)
+        gi = gts[:, -1].astype(np.int64)
+        ri = ress[:, -1].astype(np.int64)
+        ious = iou_matrix(gts[:, 2:6], ress[:, 2:6])
+
+        # Identity measures count every pair above the threshold.
+        pi, pj = np.nonzero(ious >= thresh)
+        pair_keys.append(gi[pi] * num_res_ids + ri[pj])
+
+        # Keep correspondences of the previous frames if still valid.
+        matched_rows = np.zeros(len(gi), dtype=bool)
+        matched_cols = np.zeros(len(ri), dtype=bool)
+        rows, cols = [], []
+        if len(gi) > 0 and len(ri) > 0:
+            prev = mapping[gi]
+            same = prev[:, None] == ri[None, :]
+            same &= prev[:, None] >= 0
+            same &= ious >= thresh
+            r, c = np.nonzero(same)
+            c, first = np.unique(c, return_index=True)
+            r = r[first]
+            rows.append(r)
+            cols.append(c)
+            matched_rows[r] = True
+            matched_cols[c] = True
+
+        # Hungarian matching of the remaining boxes.
+        free_rows = np.where(~matched_rows)[0]
+        free_cols = np.where(~matched_cols)[0]
+        r, c = _assign(ious[free_rows][:, free_cols], thresh)
+        r, c = free_rows[r], free_cols[c]
+        switched = (mapping[gi[r]] >= 0) & (mapping[gi[r]] != ri[c])
+        idsw += int(switched.sum())
+        rows.append(r)
+        cols.append(c)
+        rows = np.concatenate(rows).astype(np.int64)
+        cols = np.concatenate(cols).astype(np.int64)
+
+        mapping[gi[rows]] = ri[cols]
+        hit = np.zeros(len(gi), dtype=bool)
+        hit[rows] = True
+        lifespan[gi] += 1
+        tracked[gi[hit]] += 1
+        fragments[gi[hit & (last_status[gi] == 2)]] += 1
+        last_status[gi[hit]] = 1
+        last_status[gi[~hit & (last_status[gi] != 0)]] = 2
+
+        tp += len(rows)
+        fn += len(gi) - len(rows)
+        fp += len(ri) - len(rows)
+        overlap += float(ious[rows, cols].sum())
+
+    # Global bipartite matching between ground truth and result trajectories.
+    idtp = 0
+    if num_gt_ids > 0 and num_res_ids > 0:
+        keys, counts = np.unique(np.concatenate(pair_keys), return_counts=True)
+        shared = np.zeros((num_gt_ids, num_res_ids))
+        shared[keys // num_res_ids, keys % num_res_ids] = counts
+        _, x, _ = lap.lapjv(-shared, extend_cost=True)
+        rows = np.where(x >= 0)[0]
+        idtp = int(shared[rows, x[rows]].sum())
+
+    ratio = tracked / np.maximum(lifespan, 1)
+    return {
+        'frames': len(frames), 'num_gt': len(gt), 'num_res': len(res),
+        'TP': tp, 'FP': fp, 'FN': fn, 'IDSW': idsw, 'FM': int(fragments.sum()),
+        'overlap': overlap, 'IDTP': idtp,
+        'MT': int((ratio >= 0.8).sum()), 'ML': int((ratio < 0.2).sum()),
+        'PT': int(((ratio >= 0.2) & (ratio < 0.8)).sum()), 'num_gt_ids': num_gt_ids}
+
+def compute_metrics(counts):
+    '''Turn raw counts of evaluate_sequence() into the METRICS.
+
+    Return
+    ------
+    Dictionary of metrics. Ratios are percentages like the devkit.
+    '''
+    c = counts
+    div = lambda a, b: a / b if b > 0 else 0.0
+    recall = div(c['TP'], c['num_gt'])
+    metrics = {
+        'MOTA': 100 * (1 - div(c['FN'] + c['FP'] + c['IDSW'], c['num_gt'])),
+        'MOTP': 100 * div(c['overlap'], c['TP']),
+        'IDF1': 100 * div(2 * c['IDTP'], c['num_gt'] + c['num_res']),
+        'IDP': 100 * div(c['IDTP'], c['num_res']),
+        'IDR': 100 * div(c['IDTP'], c['num_gt']),
+        'Rcll': 100 * recall,
+        'Prcn': 100 * div(c['TP'], c['TP'] + c['FP']),
+        'TP': c['TP'], 'FP': c['FP'], 'FN': c['FN'],
+        'MTR': 100 * div(c['MT'], c['num_gt_ids']),
+        'PTR': 100 * div(c['PT'], c['num_gt_ids']),
+        'MLR': 100 * div(c['ML'], c['num_gt_ids']),
+        'MT': c['MT'], 'PT': c['PT'], 'ML': c['ML'],
+        'FAR': div(c['FP'], c['frames']),
+        'FM': c['FM'], 'FMR': div(c['FM'], recall),
+        'IDSW': c['IDSW'], 'IDSWR': div(c['IDSW'], recall)}
+    return metrics
+
+def sum_counts(counts):
+    '''Sum raw counts of several sequences.'''
+    total = {}
+    for c in counts:
+        for k, v in c.items():
+            total[k] = total.get(k, 0) + v
+    return total
+
+def _evaluate_task(task):
+    gt_path, res_path, thresh, min_visibility = task
+    gt, res = preprocess(load_mot_file(gt_path), load_mot_file(res_path),
+        thresh, min_visibility)
+    return evaluate_sequence(gt, res, thresh)
+
+def evaluate_mot(gt_root, result_dirs, sequences=None, thresh=0.5,
+    min_visibility=0, workers=None):
+    '''Evaluate tracking results of several models concurrently. Every
+    (model, sequence) pair is evaluated in a worker process.
+
+    Param
+    -----
+    gt_root       : MOTChallenge data root, e.g. MOT16/train. The ground
+        truth of sequence S is gt_root/S/gt/gt.txt.
+    result_dirs   : List of directories, one per model, with the result
+        file S.txt of every sequence.
+    sequences     : Sequence names. The default is all sequences in gt_root.
+    thresh        : IoU threshold of matching.
+    min_visibility: Ground truth with lower visibility is ignored.
+    workers       : Number of worker processes. The default is os.cpu_count().
+
+    Return
+    ------
+    List of dictionaries {sequence: metrics}, one per result directory.
+    The key 'OVERALL' holds the metrics of all sequences.
+    '''
+    if sequences is None:
+        sequences = sorted(s for s in os.listdir(gt_root)
+            if osp.isfile(osp.join(gt_root, s, 'gt', 'gt.txt')))
+    tasks = [(osp.join(gt_root, s, 'gt', 'gt.txt'), osp.join(d, '{}.txt'.format(s)),
+        thresh, min_visibility) for d in result_dirs for s in sequences]
+    if workers == 1:
+        counts = list(map(_evaluate_task, tasks))
+    else:
+        with Pool(workers) as pool:
+            counts = pool.map(_evaluate_task, tasks, chunksize=1)
+
+    results = []
+    for i in range(len(result_dirs)):
+        seq_counts = counts[i * len(sequences) : (i + 1) * len(sequences)]
+        metrics = {s: compute_metrics(c) for s, c in zip(sequences, seq_counts)}
+        metrics['OVERALL'] = compute_metrics(sum_counts(seq_counts))
+        results.append(metrics)
+    return results
+
+def format_metrics(metrics):
+    '''Format {sequence: metrics} as a table like the devkit.'''
+    lines = [' '.join(['{:>12}'.format('')] + ['{:>7}'.format(m) for m in METRICS])]
+    for name, values in metrics.items():
+        words = ['{:>12}'.format(name[:12])]
+        for m in METRICS:
+            v = values[m]
+            words.append('{:>7}'.format(v) if isinstance(v, int) else '{:>7.2f}'.format(v))
+        lines.append(' '.join(words))
+    return '\n'.join(lines)
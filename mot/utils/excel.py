@@ -23,6 +23,22 @@ def build_excel(filename, head, sheetname, override=True):
         sh.write(0, i, h)
     wb.save(filename)
 
+def read_excel_head(filename):
+    '''Read the table head of a exists .xls file.
+    
+    Param
+    -----
+    filename: A exists .xls filename.
+    
+    Return
+    ------
+    List of values in the first row of the first sheet.
+    '''
+    sheet = open_workbook(filename).sheets()[0]
+    if sheet.nrows == 0:
+        return []
+    return [sheet.cell_value(0, i) for i in range(sheet.ncols)]
+
 def append_excel(filename, values):
     '''Append one or multiple rows to a exists .xls file.
     
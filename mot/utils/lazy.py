@@ -0,0 +1,38 @@
+import importlib
+
+def lazy_exports(package, exports):
+    '''Make the attributes of a package import their modules on first
+    access (PEP 562), so that importing the package is cheap.
+
+    Param
+    -----
+    package: Name of the package, i.e. __name__ of its __init__ module.
+    exports: Dictionary of {module path: [attribute names]}. Relative module
+        paths are resolved against the package. The module itself is also
+        exported under its last name, e.g. '.heads' as 'heads'.
+
+    Return
+    ------
+    The module level __getattr__ and __dir__ functions of the package.
+    '''
+    attributes = dict()
+    for path, names in exports.items():
+        attributes[path.rsplit('.', 1)[-1]] = (path, None)
+        for name in names:
+            attributes[name] = (path, name)
+
+    def __getattr__(name):
+        if name not in attributes:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(
+                package, name))
+        path, attr = attributes[name]
+        module = importlib.import_module(path, package)
+        value = module if attr is None else getattr(module, attr)
+        # Cache in the package, later accesses do not come here again.
+        setattr(importlib.import_module(package), name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(importlib.import_module(package))) | set(attributes))
+
+    return __getattr__, __dir__
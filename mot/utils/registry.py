@@ -1,9 +1,13 @@
 import inspect
+import importlib
 from yacs.config import CfgNode as CN
 
 class Registry:
     '''This class is used to map module name to class.
     
+    Classes can also be registered lazily by the path of the module
+    defining them, which is imported when the class is first looked up.
+    
     Param
     -----
     name: class registered name
@@ -11,9 +15,10 @@ class Registry:
     def __init__(self, name):
         self._name = name
         self._module_dict = dict()
+        self._lazy_dict = dict()
     
     def __len__(self):
-        return len(self._module_dict)
+        return len(set(self._module_dict) | set(self._lazy_dict))
     
     def __contains__(self, module_name):
         return self.get(module_name) is not None
@@ -30,6 +35,10 @@ class Registry:
     def module_dict(self):
         return self._module_dict
     
+    @property
+    def lazy_dict(self):
+        return self._lazy_dict
+    
     def get(self, module_name):
         '''Get class by its registered name.
         
@@ -41,6 +50,10 @@ class Registry:
         ------
         The corresponding class.
         '''
+        if module_name not in self._module_dict and module_name in self._lazy_dict:
+            # Importing the module registers the class.
+            importlib.import_module(self._lazy_dict[module_name])
+            self._lazy_dict.pop(module_name)
         return self._module_dict.get(module_name, None)
     
     def _register_module(self, module_class, module_name=None, force=False):
@@ -87,6 +100,23 @@ class Registry:
             return _module_class
         
         return _register
+    
+    def register_lazy(self, module_name, module_path):
+        '''Register a class module by the path of the module defining it.
+        The module is imported the first time the class is looked up, and
+        it should register the class with the same name.
+        
+        Param
+        -----
+        module_name: The name of class need to be registered.
+        module_path: The absolute module path, e.g. 'mot.models.necks.fpn'.
+        '''
+        if not isinstance(module_name, str) or not isinstance(module_path, str):
+            raise TypeError('module_name and module_path must be strings,'
+                ' but got {} and {}'.format(type(module_name), type(module_path)))
+        if module_name in self._module_dict or module_name in self._lazy_dict:
+            raise KeyError('{} has already been registered'.format(module_name))
+        self._lazy_dict[module_name] = module_path
 
 def build_from_config(register, config):
     '''Build module from yaml format configurations.
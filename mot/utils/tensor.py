@@ -18,4 +18,22 @@ def move_tensors_to_gpu(tensors, device=None, non_blocking=False):
         if not isinstance(tensor, torch.Tensor):
             raise TypeError('expect torch.Tensor, but got {}'.format(type(tensor)))
         gpu_tensors.append(tensor.cuda(device=device, non_blocking=non_blocking))
-    return gpu_tensors
\ No newline at end of file
+    return gpu_tensors
+
+def move_tensors_to_device(tensors, device, non_blocking=False):
+    '''Move tensors to the device, e.g. a GPU or the CPU.
+    
+    Param
+    -----
+    tensors     : List or tuple of torch.Tensor tensors.
+    device      : The destination device.
+    non_blocking: See move_tensors_to_gpu.
+    '''
+    if not isinstance(tensors, (list, tuple)):
+        raise TypeError('expect list or tuple, but got {}'.format(type(tensors)))
+    moved = []
+    for tensor in tensors:
+        if not isinstance(tensor, torch.Tensor):
+            raise TypeError('expect torch.Tensor, but got {}'.format(type(tensor)))
+        moved.append(tensor.to(device=device, non_blocking=non_blocking))
+    return moved
\ No newline at end of file
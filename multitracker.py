@@ -0,0 +1,166 @@
+import os
+import re
+import cv2
+import sys
+import torch
+import argparse
+import numpy as np
+
+import dataset
+import trackernew
+sys.path.append(os.getcwd())
+from mot.utils import config
+from mot.models import build_tracker
+
+def parse_args():
+    '''解析命令行参数
+    '''
+    parser = argparse.ArgumentParser(
+        description='multiple stream single class multiple object tracking')
+    parser.add_argument('--config', type=str, default='',
+        help='training configuration file path')
+    parser.add_argument('--inputs', '-inp', type=str, nargs='+',
+        help='paths to videos or image directories, one per stream')
+    parser.add_argument('--model', type=str, help='path to tracking model')
+    parser.add_argument('--insize', type=str, default='320x576',
+        help='network input size, default=320x576, other options are'
+        ' 480x864 and 608x1088')
+    parser.add_argument('--score-thresh', type=float, default=0.5,
+        help='nms score threshold, default=0.5, it must be in [0,1]')
+    parser.add_argument('--iou-thresh', type=float, default=0.4,
+        help='nms iou threshold, default=0.4, it must be in [0,1]')
+    parser.add_argument('--workspace', type=str, default='workspace',
+        help='workspace path')
+    return parser.parse_args()
+
+class MultiStreamTracker(object):
+    '''多路视频流跟踪器. 每次从各路数据流各取一帧, 拼成一个批次只做一次前向推理,
+        再按数据流拆分NMS的输出, 分别送入每路数据流自己的JDETracker.
+        所有数据流共享同一个模型.
+
+    Args:
+        model (torch.nn.Module): 跟踪模型, 推理模式下输出解码后的检测结果
+        num_streams (int): 数据流的数量
+        insize (tuple of int): 神经网络输入大小, insize=(height, width)
+        score_thresh (float, optional): NMS置信度阈值
+        iou_thresh (float, optional): NMS交并比阈值
+        decoder (torch.nn.Module, optional): 模型输出的解码器, 例如jde.JDEcoder,
+            模型自己解码时为None
+        device (torch.device, optional): 推理设备, 缺省时使用模型所在的设备
+    '''
+    def __init__(self, model, num_streams, insize=(320, 576), score_thresh=0.5,
+        iou_thresh=0.4, decoder=None, device=None):
+        self.model = model
+        self.insize = insize
+        self.score_thresh = score_thresh
+        self.iou_thresh = iou_thresh
+        self.decoder = decoder
+        if device is None:
+            device = next(model.parameters()).device
+        self.device = device
+        self.trackers = [trackernew.JDETracker() for _ in range(num_streams)]
+
+    def update(self, streams, images, lb_ims):
+        '''用一个批次的图像更新对应数据流的跟踪器
+
+        Args:
+            streams (list of int): 每幅图像所属的数据流编号, 不能重复
+            images (list of numpy.ndarray): 原始BGR格式图像
+            lb_ims (list of numpy.ndarray): letterbox后的CHW格式神经网络输入
+        Returns:
+            trajectories (list of list of Trajectory): 每幅图像跟踪到的轨迹.
+                没有检测到目标的图像不更新跟踪器, 返回空列表
+        '''
+        input = torch.from_numpy(np.stack(lb_ims)).to(self.device)
+        with torch.no_grad():
+            outputs = self.model(input)
+        if self.decoder is not None:
+            outputs = self.decoder(outputs)
+        outputs, batch = trackernew.batched_nonmax_suppression(outputs,
+            self.score_thresh, self.iou_thresh)
+        outputs = outputs.cpu()
+        counts = torch.bincount(batch, minlength=len(streams)).tolist()
+
+        trajectories = []
+        start = 0
+        for stream, im, count in zip(streams, images, counts):
+            if count == 0:
+                trajectories.append([])
+                continue
+            dets = outputs[start : start + count]
+            start += count
+            dets[:, :4] = trackernew.ltrb_net2img(dets[:, :4], self.insize, im.shape[:2])
+            trajectories.append(self.trackers[stream].update(dets.numpy()))
+        return trajectories
+
+    def run(self, loaders):
+        '''同步遍历各路数据流并跟踪. 某路数据流结束后, 批次中只剩其余的数据流
+
+        Args:
+            loaders (list): 与跟踪器一一对应的dataset.ImagesLoader或dataset.VideoLoader
+        Returns:
+            生成器, 每次生成(数据流编号, 图像路径, 原始图像, 轨迹列表)
+        '''
+        iters = [iter(loader) for loader in loaders]
+        alive = list(range(len(iters)))
+        while len(alive) > 0:
+            batch = []
+            for stream in list(alive):
+                try:
+                    path, im, lb_im = next(iters[stream])
+                except StopIteration:
+                    alive.remove(stream)
+                    continue
+                batch.append((stream, path, im, lb_im))
+            if len(batch) == 0:
+                break
+            streams, paths, images, lb_ims = zip(*batch)
+            trajectories = self.update(streams, images, lb_ims)
+            for stream, path, im, trajectory in zip(streams, paths, images, trajectories):
+                yield stream, path, im, trajectory
+
+def main(args):
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if os.path.isfile(args.config):
+        config.merge_from_file(args.config)
+    config.freeze()
+
+    model = build_tracker(config.MODEL)
+    if os.path.isfile(args.model):
+        model.load_state_dict(torch.load(args.model, map_location='cpu'))
+    model.to(device).eval()
+
+    h, w = [int(s) for s in args.insize.split('x')]
+    loaders, names = [], []
+    for path in args.inputs:
+        if os.path.isfile(path):
+            loaders.append(dataset.VideoLoader(path, (h,w,3), ring=1))
+            names.append(os.path.splitext(os.path.basename(path))[0])
+        else:
+            loaders.append(dataset.ImagesLoader(path, (h,w,3), formats=['*.jpg', '*.png'],
+                ring=1))
+            names.append(re.split(r'[\\, /]', os.path.normpath(path))[-2])
+
+    imgpaths, writers, frame_ids = [], [], []
+    for name in names:
+        imgpaths.append(os.path.join(args.workspace, 'result', name, 'img'))
+        trackernew.mkdir(imgpaths[-1])
+        writers.append(trackernew.MOTWriter(os.path.join(args.workspace,
+            'result', '{}.txt'.format(name))))
+        frame_ids.append(0)
+
+    tracker = MultiStreamTracker(model, len(loaders), (h, w),
+        args.score_thresh, args.iou_thresh, device=device)
+    for stream, path, im, trajectories in tracker.run(loaders):
+        frame_ids[stream] += 1
+        print('{} {} {}'.format(names[stream], path, len(trajectories)))
+        result = trackernew.overlap_trajectory(trajectories, im)
+        writers[stream].write(trajectories, frame_ids[stream])
+        segments = re.split(r'[\\, /]', path)
+        cv2.imwrite(os.path.join(imgpaths[stream], segments[-1]), result)
+    for writer in writers:
+        writer.close()
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
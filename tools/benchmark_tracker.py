@@ -0,0 +1,186 @@
+# Run from the repository root as a module, e.g.
+#   python -m tools.benchmark_tracker --frames 500 --tracks 80
+# so that tools/profile.py does not shadow the standard library profile module.
+import os
+import sys
+import time
+import argparse
+import importlib
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='benchmark JDETracker association with recorded or synthetic detections')
+    parser.add_argument('--detections', type=str, default='',
+        help='.npz file with recorded detections, see save_detections(),'
+        ' or a detection cache directory written by tracker.py --cache')
+    parser.add_argument('--trackers', type=str, nargs='+',
+        default=['tracker', 'trackernew'],
+        help='modules whose JDETracker will be benchmarked')
+    parser.add_argument('--frames', type=int, default=500,
+        help='number of synthetic frames, default is 500')
+    parser.add_argument('--tracks', type=int, default=50,
+        help='average number of visible targets per synthetic frame, default is 50')
+    parser.add_argument('--dim', type=int, default=128,
+        help='synthetic embedding dimension, default is 128')
+    parser.add_argument('--size', type=int, nargs=2, default=[1920, 1080],
+        help='synthetic scene width and height, default is 1920 1080')
+    parser.add_argument('--miss', type=float, default=0.05,
+        help='probability that a target is not detected, default is 0.05')
+    parser.add_argument('--clutter', type=float, default=2,
+        help='average number of false positives per frame, default is 2')
+    parser.add_argument('--seed', type=int, default=0,
+        help='random seed of the synthetic crowd')
+    parser.add_argument('--save', type=str, default='',
+        help='save the synthetic detections to this .npz file')
+    parser.add_argument('--warmup', type=int, default=10,
+        help='frames excluded from statistics, default is 10')
+    parser.add_argument('--repeat', type=int, default=1,
+        help='replay the sequence this many times, default is 1')
+    parser.add_argument('--assignment', type=str, default='dense',
+        choices=['dense', 'sparse'],
+        help='JDETracker linear assignment method, default is dense')
+    return parser.parse_args()
+
+def save_detections(path, frames):
+    '''Save per-frame detections as one concatenated array and frame offsets.
+
+    Param
+    -----
+    path  : The .npz file path.
+    frames: List of detection arrays with layout [l,t,r,b,score,class,embedding].
+    '''
+    dim = frames[0].shape[1] if len(frames) > 0 else 6
+    dets = np.concatenate(frames) if len(frames) > 0 else np.zeros((0, dim))
+    offsets = np.cumsum([0] + [len(f) for f in frames])
+    np.savez(path, dets=dets.astype(np.float32), offsets=offsets.astype(np.int64))
+
+def load_detections(path):
+    '''Load detections saved by save_detections(), or a detection cache
+    directory written by tracker.py --cache.
+
+    Return
+    ------
+    List of per-frame detection arrays.
+    '''
+    if os.path.isdir(path):
+        dets = np.load(os.path.join(path, 'dets.npy'), mmap_mode='r')
+        offsets = np.load(os.path.join(path, 'offsets.npy'))
+    else:
+        data = np.load(path)
+        dets, offsets = data['dets'], data['offsets']
+    return [dets[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+def synthesize_crowd(num_frames=500, num_tracks=50, dim=128, size=(1920, 1080),
+    miss=0.05, clutter=2, seed=0):
+    '''Synthesize detections of a crowd walking in a scene.
+
+    Param
+    -----
+    num_frames: Number of frames.
+    num_tracks: Average number of visible targets per frame.
+    dim       : Embedding dimension.
+    size      : Scene width and height.
+    miss      : Probability that a target is not detected in a frame.
+    clutter   : Average number of false positives per frame.
+    seed      : Random seed.
+
+    Return
+    ------
+    List of per-frame detection arrays with layout [l,t,r,b,score,class,embedding].
+    '''
+    rng = np.random.RandomState(seed)
+    w, h = size
+    min_life, max_life = 30, 300
+    birth_rate = num_tracks / ((min_life + max_life) / 2)
+
+    def spawn(n):
+        return {
+            'pos': rng.uniform([0, 0], [w, h], size=(n, 2)),
+            'vel': rng.normal(0, 2, size=(n, 2)),
+            'height': rng.uniform(60, 300, size=n),
+            'embedding': rng.normal(size=(n, dim)),
+            'life': rng.randint(min_life, max_life, size=n)}
+
+    targets = spawn(num_tracks)
+    frames = []
+    for f in range(num_frames):
+        born = spawn(rng.poisson(birth_rate))
+        targets = {k: np.concatenate([targets[k], born[k]]) for k in targets}
+        targets['pos'] += targets['vel']
+        targets['life'] -= 1
+        alive = targets['life'] > 0
+        targets = {k: v[alive] for k, v in targets.items()}
+
+        n = len(targets['life'])
+        seen = rng.rand(n) > miss
+        center = targets['pos'][seen] + rng.normal(0, 2, size=(seen.sum(), 2))
+        height = targets['height'][seen] * (1 + rng.normal(0, 0.02, size=seen.sum()))
+        embedding = targets['embedding'][seen] + rng.normal(0, 0.3, size=(seen.sum(), dim))
+
+        nfp = rng.poisson(clutter)
+        center = np.concatenate([center, rng.uniform([0, 0], [w, h], size=(nfp, 2))])
+        height = np.concatenate([height, rng.uniform(60, 300, size=nfp)])
+        embedding = np.concatenate([embedding, rng.normal(size=(nfp, dim))])
+
+        width = 0.4 * height
+        dets = np.empty((len(height), 6 + dim), dtype=np.float32)
+        dets[:, 0] = center[:, 0] - width / 2
+        dets[:, 1] = center[:, 1] - height / 2
+        dets[:, 2] = center[:, 0] + width / 2
+        dets[:, 3] = center[:, 1] + height / 2
+        dets[:, 4] = rng.uniform(0.5, 1, size=len(height))
+        dets[:, 5] = 0
+        dets[:, 6:] = embedding
+        frames.append(dets)
+    return frames
+
+def benchmark(module, frames, warmup=10, repeat=1, **params):
+    '''Replay detections through JDETracker of the given module.
+
+    Return
+    ------
+    Per-frame latencies in seconds, excluding warmup frames. params are
+    passed to JDETracker.
+    '''
+    latencies = []
+    for r in range(repeat):
+        tracker = module.JDETracker(**params)
+        for i, dets in enumerate(frames):
+            start = time.perf_counter()
+            tracker.update(dets.copy())
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                latencies.append(elapsed)
+    return np.array(latencies)
+
+def report(name, latencies):
+    ms = 1000 * latencies
+    print('{:<12}{:>8}{:>10.1f}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+        name, len(ms), len(ms) / max(latencies.sum(), 1e-12), ms.mean(),
+        np.percentile(ms, 50), np.percentile(ms, 90), np.percentile(ms, 99), ms.max()))
+
+def main():
+    args = parse_args()
+    if args.detections:
+        frames = load_detections(args.detections)
+    else:
+        frames = synthesize_crowd(args.frames, args.tracks, args.dim, args.size,
+            args.miss, args.clutter, args.seed)
+        if args.save:
+            save_detections(args.save, frames)
+    ndets = np.array([len(f) for f in frames])
+    print('{} frames, {:.1f} detections per frame, max {}'.format(
+        len(frames), ndets.mean(), ndets.max()))
+
+    print('{:<12}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}'.format('tracker',
+        'frames', 'fps', 'mean(ms)', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'max(ms)'))
+    for name in args.trackers:
+        module = importlib.import_module(name)
+        report(name, benchmark(module, frames, args.warmup, args.repeat,
+            assignment=args.assignment))
+
+if __name__ == '__main__':
+    main()
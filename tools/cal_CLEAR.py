@@ -1,14 +1,13 @@
 import os
 import sys
-import glob
-import xlwt
 import time
 import argparse
 import os.path as osp
 sys.path.append(os.getcwd())
 from mot.utils import mkdirs
 from mot.utils import get_logger
-from mot.utils import build_excel, append_excel
+from mot.utils import build_excel, append_excel, read_excel_head
+from mot.utils.evaluation import METRICS, evaluate_mot, format_metrics
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -23,14 +22,16 @@ def parse_args():
     parser.add_argument('-dir', type=str,
         default='/home/image/tseng/project/JDE/tasks/evals',
         help='Models directory on server')
-    parser.add_argument('--mot-path', '-mp', type=str,
-        default='/d/Tseng/project/thirdparty/MOTChallengeEvalKit/',
-        help='path to the MOT devkit')
+    parser.add_argument('--gt-root', '-gr', type=str,
+        default='/d/Tseng/dataset/jde/MOT16/train',
+        help='MOTChallenge data root with <sequence>/gt/gt.txt')
     parser.add_argument('--save-path', '-sp', type=str,
         default='/c/Users/SH0095/Downloads/evals/',
         help='path to the result')
     parser.add_argument('--num-model', '-nm', type=int,
         help='number of models to evaluation')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+        help='number of worker processes, each evaluates one sequence of one model')
     return parser.parse_args()
 
 if __name__ == '__main__':
@@ -39,10 +40,16 @@ if __name__ == '__main__':
     # args.dir = args.dir.split('msys64')[1]
     mkdirs(args.save_path)
     logger = get_logger(path=osp.join(args.save_path, 'log.txt'))    
-    head = ['MOTA', 'MOTP', 'IDF1', 'IDP', 'IDR', 'Rcll', 'Prcn',
-        'TP', 'FP', 'FN', 'MTR', 'PTR', 'MLR', 'MT', 'PT', 'ML', 'FAR',
-        'FM', 'FMR', 'IDSW', 'IDSWR']
+    head = ['model'] + METRICS
     xlspath = osp.join(args.save_path, 'mot_results.xls')
+    # Keep results of an older table layout, append to a new file instead.
+    count = 0
+    while osp.isfile(xlspath) and read_excel_head(xlspath) != head:
+        count += 1
+        xlspath = osp.join(args.save_path, 'mot_results_{}.xls'.format(count))
+    if count > 0:
+        logger.warning('The table head of mot_results.xls differs,'
+            ' results are saved in {}'.format(xlspath))
     build_excel(xlspath, head, 'CLEAR', override=False)
     done = []
     while True:
@@ -67,10 +74,8 @@ if __name__ == '__main__':
         folders = [f for f in folders if not '*' in f]
         logger.info('File read result:\n{}'.format(folders))
 
+        folders = [f for f in folders if f not in done]
         for folder in folders:
-            if folder in done:
-                continue
-            
             # Make sure that the folder have been prepared by server.
             time.sleep(1)
             
@@ -81,34 +86,13 @@ if __name__ == '__main__':
             logger.info('Download command: {}'.format(cmd))
             os.system(cmd)
 
-            # Copy files to MOTChallengeEvalKit\res\MOT16res
-            dpath = osp.join(args.mot_path, 'res', 'MOT16res/').replace('\\', '/')
-            cmd = 'cp {} {}'.format(
-                osp.join(args.save_path, folder, '*.txt').replace('\\', '/'),
-                dpath)
-            logger.info('copy command: {}'.format(cmd))
-            os.system(cmd)
-          
-            # Excute MOT\evalMOT.py
-            cmd = 'sh tools/evalMOT.sh {}'.format(args.mot_path)
-            logger.info('MOT run command: {}'.format(cmd))
-            with os.popen(cmd) as fd:
-                text = fd.read()
-            
-            # Write result to excel.
-            lines = text.split(sep='\n')
-            lines = [line.strip() for line in lines]
-            lines = list(filter(lambda x: len(x) > 0, lines))
-            if len(lines) == 0:
-                logger.info('Whoops! No inference output for current model!')
-                words = ['NULL', 'NULL']
-            else:
-                words = lines[-1].split()   # Overall performance
-            append_excel(xlspath, [words[1:]])
-            done.append(folder)
-            
-            cmd = 'rm -f ' + osp.join(dpath, '*.txt').replace('\\', '/')
-            logger.info('clean command: {}'.format(cmd))
-            os.system(cmd)
+        # Evaluate all new models concurrently and write results to excel.
+        if len(folders) > 0:
+            results = evaluate_mot(args.gt_root,
+                [osp.join(args.save_path, f) for f in folders], workers=args.workers)
+            for folder, metrics in zip(folders, results):
+                logger.info('{}\n{}'.format(folder, format_metrics(metrics)))
+                append_excel(xlspath, [[folder] + [metrics['OVERALL'][m] for m in METRICS]])
+                done.append(folder)
         logger.info('waiting for data ...')
         time.sleep(10)
\ No newline at end of file
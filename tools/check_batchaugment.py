@@ -0,0 +1,49 @@
+# Run from the repository root as a module, e.g.
+#   python -m tools.check_batchaugment
+# so that tools/profile.py does not shadow the standard library profile module.
+import os
+import sys
+import argparse
+import torch
+
+sys.path.append(os.getcwd())
+from mot.datasets import BatchAugment
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='check that BatchAugment warps images and targets consistently')
+    parser.add_argument('--size', type=int, nargs=2, default=[320, 576],
+        help='image height and width, default is 320 576')
+    parser.add_argument('--batch-size', type=int, default=4,
+        help='number of images, default is 4')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='maximum absolute pixel error of 0-255 images, default is 0.1')
+    return parser.parse_args()
+
+def check_flip(h, w, n, tolerance):
+    '''A flip-only warp must equal images.flip(-1), and the flipped targets
+    must be x -> 1 - x.
+    '''
+    augment = BatchAugment(hsv=0, degrees=(0, 0), translate=(0, 0),
+        scale=(1, 1), shear=(0, 0), flip=1)
+    images = torch.rand(n, 3, h, w) * 255
+    targets = torch.zeros(n, 7)
+    targets[:, 0] = torch.arange(n)
+    targets[:, 3:5] = torch.rand(n, 2) * 0.5 + 0.25
+    targets[:, 5:7] = 0.1
+    warped, flipped, _ = augment(images, targets)
+    image_error = (warped - images.flip(-1)).abs().max().item()
+    target_error = (flipped[:, 3] - (1 - targets[:, 3])).abs().max().item()
+    print('flip: max image error {:.6f}, max target error {:.6f}'.format(
+        image_error, target_error))
+    return image_error <= tolerance and target_error <= 1e-5
+
+def main(args):
+    h, w = args.size
+    if not check_flip(h, w, args.batch_size, args.tolerance):
+        print('FAILED')
+        sys.exit(1)
+    print('OK')
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,82 @@
+# Run from the repository root as a module, e.g.
+#   python -m tools.importtime --module tracker
+#   python -m tools.importtime --config config.yaml
+# so that tools/profile.py does not shadow the standard library profile module.
+import os
+import sys
+import argparse
+import subprocess
+import collections
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='report module import times like python -X importtime')
+    parser.add_argument('--module', type=str, default='tracker',
+        help='module to import, default is tracker')
+    parser.add_argument('--config', type=str, default='',
+        help='also build the tracker model of this configuration file,'
+        ' which imports the modules referenced by it')
+    parser.add_argument('--top', type=int, default=25,
+        help='number of the slowest modules to print, default is 25')
+    parser.add_argument('--runs', type=int, default=3,
+        help='number of fresh interpreters, the fastest time of each module'
+        ' is reported, default is 3')
+    return parser.parse_args()
+
+def statement(module, config=''):
+    code = 'import {}'.format(module)
+    if config:
+        code += '; from mot.utils import config' \
+            '; from mot.models import build_tracker' \
+            '; config.merge_from_file({!r})' \
+            '; build_tracker(config.MODEL)'.format(config)
+    return code
+
+def measure(code):
+    '''Execute the code in a fresh interpreter with -X importtime.
+
+    Return
+    ------
+    List of (module, self microseconds, cumulative microseconds, depth)
+    in the order of the report, children before their parents.
+    '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+        cwd=os.getcwd(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError('{} failed:\n{}'.format(code, proc.stderr))
+    records = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        records.append((name.strip(), int(own), int(cumulative), depth))
+    return records
+
+def main(args):
+    code = statement(args.module, args.config)
+    best = collections.OrderedDict()
+    for _ in range(args.runs):
+        for name, own, cumulative, depth in measure(code):
+            if name not in best or cumulative < best[name][1]:
+                best[name] = (own, cumulative, depth)
+
+    total = sum(cumulative for own, cumulative, depth in best.values() if depth == 0)
+    print('{}\ntotal import time {:.1f} ms, {} modules\n'.format(code,
+        total / 1000, len(best)))
+    print('{:>10}{:>10}  {}'.format('self(ms)', 'cum(ms)', 'module'))
+    slowest = sorted(best.items(), key=lambda item: -item[1][1])[:args.top]
+    for name, (own, cumulative, depth) in slowest:
+        print('{:>10.1f}{:>10.1f}  {}'.format(own / 1000, cumulative / 1000, name))
+
+    # Self time summed by top level package.
+    packages = collections.Counter()
+    for name, (own, cumulative, depth) in best.items():
+        packages[name.split('.')[0]] += own
+    print('\n{:>10}  {}'.format('self(ms)', 'package'))
+    for name, own in packages.most_common(args.top):
+        print('{:>10.1f}  {}'.format(own / 1000, name))
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -1,42 +1,41 @@
 import os
-import glob
-import xlwt
+import sys
 import argparse
+sys.path.append(os.getcwd())
+from mot.utils import build_excel, append_excel
+from mot.utils.evaluation import METRICS, evaluate_mot, format_metrics
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--data-path', '-rp', type=str,
-    help='path to the data')
-parser.add_argument('--mot-path', '-mp', type=str,
-    help='path to the MOT devkit')
-parser.add_argument('--save-path', '-sp', type=str,
-    help='path to the result')
-args = parser.parse_args()
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-path', '-rp', type=str,
+        help='path to the data, one sub-directory of result files per model')
+    parser.add_argument('--gt-root', '-gr', type=str,
+        default='/data/tseng/dataset/jde/MOT16/train',
+        help='MOTChallenge data root with <sequence>/gt/gt.txt')
+    parser.add_argument('--save-path', '-sp', type=str,
+        help='path to the result')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+        help='number of worker processes, each evaluates one sequence of one model')
+    parser.add_argument('--min-visibility', type=float, default=0,
+        help='ground truth with lower visibility is ignored')
+    return parser.parse_args()
 
-paths = sorted(os.listdir(args.data_path))
-wb = xlwt.Workbook()
-sh = wb.add_sheet('mot16 performance')
+def main(args):
+    paths = sorted(os.listdir(args.data_path))
+    paths = [p for p in paths if os.path.isdir(os.path.join(args.data_path, p))
+        and any(f.endswith('.txt') for f in os.listdir(os.path.join(args.data_path, p)))]
+    results = evaluate_mot(args.gt_root, [os.path.join(args.data_path, p) for p in paths],
+        min_visibility=args.min_visibility, workers=args.workers)
 
-indicators = ['MOTA', 'MOTP', 'IDF1', 'IDP', 'IDR', 'Rcll', 'Prcn',
-    'TP', 'FP', 'FN', 'MTR', 'PTR', 'MLR', 'MT', 'PT', 'ML', 'FAR',
-    'FM', 'FMR', 'IDSW', 'IDSWR']
-for i, indicator in enumerate(indicators):
-    sh.write(0, i, indicator)
+    xlspath = os.path.join(args.save_path, 'mot_results.xls')
+    build_excel(xlspath, ['model'] + METRICS, 'mot16 performance')
+    rows = []
+    for path, metrics in zip(paths, results):
+        print(path)
+        print(format_metrics(metrics))
+        rows.append([path] + [metrics['OVERALL'][m] for m in METRICS])
+    append_excel(xlspath, rows)
 
-for i, path in enumerate(paths):
-    os.system('copy {} {}'.format(os.path.join(args.data_path, path, '*.txt'),
-        os.path.join(args.mot_path, 'res', 'MOT16res')))
-    cmd = 'cd {} && python {}'.format(args.mot_path,
-        os.path.join('MOT', 'evalMOT.py'))
-    print(cmd)
-    with os.popen(cmd) as fd:
-        text = fd.read()
-    
-    lines = text.split(sep='\n')
-    lines = [line.strip() for line in lines]
-    lines = list(filter(lambda x: len(x) > 0, lines))
-    words = lines[-1].split()   # Overall performance
-    print(words)
-    for j in range(1, len(words)):
-        sh.write(i + 1, j - 1, float(words[j]))
-
-wb.save(os.path.join(args.save_path, 'mot_results.xls'))
\ No newline at end of file
+if __name__ == '__main__':
+    # Worker processes started by spawn, e.g. on Windows, import this script.
+    main(parse_args())
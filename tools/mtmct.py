@@ -20,6 +20,7 @@ sys.path.append(os.getcwd())
 
 import dataset
 import trackernew
+import multitracker
 from mot.utils import (config, mkdirs)
 from mot.models import build_tracker
 
@@ -111,7 +112,6 @@ class Datastore(Thread):
     def run(self):
         print('start thread {} ...'.format(self.tid))
         for path, im, lb_im in self.dataset:
-            lb_im = torch.from_numpy(lb_im).unsqueeze(0).cuda()
             data = {'path': path, 'raw_img': im, 'lb_im': lb_im}
             self.images.put(data)
             time.sleep(0.04)
@@ -128,8 +128,11 @@ class Tracklet:
         self.location = location       # ground plane location
 
 class MTSCT(Thread):
+    '''Track all cameras with one shared model. Each round takes at most one
+       frame from every image queue and runs them through the model as a batch.
+    '''
     def __init__(self, tid, images, tracklets, exit, model,
-        locator=None, insize=(320, 576)):
+        locators=None, insize=(320, 576)):
         super(MTSCT, self).__init__(name=tid)
         self.tid = tid
         self.images = images
@@ -137,51 +140,54 @@ class MTSCT(Thread):
         self.exit = exit
         self.model = model.cuda()
         self.model.eval()
-        self.locator = locator
+        self.locators = locators
         self.insize = insize
         self.score_thresh = 0.5
         self.iou_thresh = 0.4
-        self.tracker = trackernew.JDETracker()
-        self.save_dir = osp.join('tasks', 'mtsct_{}'.format(self.tid))
-        mkdirs(self.save_dir)
+        self.tracker = multitracker.MultiStreamTracker(self.model, len(images),
+            insize, self.score_thresh, self.iou_thresh)
+        self.save_dirs = []
+        for chan in range(len(images)):
+            self.save_dirs.append(osp.join('tasks', 'mtsct_{}'.format(chan)))
+            mkdirs(self.save_dirs[-1])
+        self.counters = [0] * len(images)
     
     def run(self):
         print('start thread {} ...'.format(self.tid))
-        counter = 0
         while self.exit.value == 0:
-            # Fetch original image.
-            try:
-                data = self.images.get(timeout=1)
-            except:
+            # Fetch one original image from each camera.
+            batch = []
+            for chan, images in enumerate(self.images):
+                try:
+                    data = images.get_nowait()
+                except:
+                    continue
+                batch.append((chan, data))
+            if len(batch) == 0:
+                time.sleep(0.005)
                 continue
-            path = data['path']
-            raw_img = data['raw_img']
-            input = data['lb_im']
-            # Track local tracklets.
-            with torch.no_grad():
-                outputs = self.model(input)
-            outputs = trackernew.nonmax_suppression(outputs,
-                self.score_thresh, self.iou_thresh)[0]
-            tracklets = []  # for alignment, even empty tracklets is necessary.
-            resimg = raw_img
-            if outputs is not None:
-                outputs[:, :4] = trackernew.ltrb_net2img(
-                    outputs[:, :4], self.insize, raw_img.shape[:2])
-                tracks = self.tracker.update(outputs.numpy())
+            chans = [chan for chan, _ in batch]
+            raw_imgs = [data['raw_img'] for _, data in batch]
+            inputs = [data['lb_im'] for _, data in batch]
+            # Track local tracklets of all cameras in one batch.
+            tracks = self.tracker.update(chans, raw_imgs, inputs)
+            for chan, raw_img, ctracks in zip(chans, raw_imgs, tracks):
                 # Package local tracklets.
-                for i, track in enumerate(tracks):
+                tracklets = []  # for alignment, even empty tracklets is necessary.
+                for track in ctracks:
                     im = self.clip(track.ltrb, raw_img)
                     xf = (track.ltrb[0] + track.ltrb[2]) / 2
                     yf = track.ltrb[3]
-                    location = self.locator((xf, yf))
-                    tracklet = Tracklet(self.tid, track.id, track.ltrb, im, location)
+                    location = self.locators[chan]((xf, yf))
+                    tracklet = Tracklet(chan, track.id, track.ltrb, im, location)
                     tracklets.append(tracklet)
-                resimg = trackernew.overlap_trajectory(tracks, raw_img)
-            # Update tracklet queue.
-            self.tracklets.put(tracklets)
-            cv2.imwrite(osp.join(self.save_dir, '%06d.jpg' % counter), resimg)
-            self.images.task_done()
-            counter += 1
+                resimg = trackernew.overlap_trajectory(ctracks, raw_img)
+                # Update tracklet queue.
+                self.tracklets[chan].put(tracklets)
+                cv2.imwrite(osp.join(self.save_dirs[chan],
+                    '%06d.jpg' % self.counters[chan]), resimg)
+                self.images[chan].task_done()
+                self.counters[chan] += 1
         print('exit thread {}.'.format(self.tid))
     
     def clip(self, ltrb, im):
@@ -386,12 +392,13 @@ def main():
         # Datastore thread.
         tid += 1
         threads.append(Datastore(tid, args.inputs[i], images[i]))
-        # MTSCT thread.
-        tid += 1
-        model = build_tracker(config.MODEL)
-        model.load_state_dict(torch.load(args.tracker, map_location='cpu'))
-        locator = ImageToWorldTsai(calibs[i])
-        threads.append(MTSCT(tid, images[i], tracklets[i], exit, model, locator))
+    datastores = threads[:]
+    # MTSCT thread shared by all cameras.
+    tid += 1
+    model = build_tracker(config.MODEL)
+    model.load_state_dict(torch.load(args.tracker, map_location='cpu'))
+    locators = [ImageToWorldTsai(calib) for calib in calibs]
+    threads.append(MTSCT(tid, images, tracklets, exit, model, locators))
     # MTMCT thread.
     tid += 1
     threads.append(MTMCT(tid, tracklets, trajectories, exit, extractor))
@@ -403,7 +410,7 @@ def main():
     # Waiting for Datastore finish.
     ndead = 0
     while ndead != ncamera:
-        ndead = sum([int(not t.is_alive()) for t in threads[0::2]])
+        ndead = sum([int(not t.is_alive()) for t in datastores])
         time.sleep(1)
     print('Datastore done.')
     
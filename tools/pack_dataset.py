@@ -0,0 +1,89 @@
+# Run from the repository root as a module, e.g.
+#   python -m tools.pack_dataset --root /data/tseng/dataset/jde \
+#       --cfg ./data/train.txt --output /data/tseng/dataset/jde/packed --letterbox
+# so that tools/profile.py does not shadow the standard library profile module.
+import os
+import sys
+import cv2
+import argparse
+import numpy as np
+from multiprocessing import Pool
+
+sys.path.append(os.getcwd())
+from mot.datasets import LabelIndex, ShardWriter
+from mot.datasets.labelindex import read_dataset_lists
+from mot.datasets.transforms import letterbox
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='pack training images and labels into sequential shard files')
+    parser.add_argument('--root', type=str, default='/data/tseng/dataset/jde',
+        help='dataset root directory')
+    parser.add_argument('--cfg', type=str, default='./data/train.txt',
+        help='dataset configuration file, one dataset list file per line')
+    parser.add_argument('--output', type=str,
+        help='output directory of shards')
+    parser.add_argument('--insize', type=str, default='608x1088',
+        help='largest training input size, images are shrunk to fit it,'
+        ' default is 608x1088')
+    parser.add_argument('--letterbox', action='store_true',
+        help='letterbox images to exactly the input size')
+    parser.add_argument('--shard-size', type=int, default=1024,
+        help='maximum shard file size in MB, default is 1024')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+        help='number of decoding and resizing processes')
+    return parser.parse_args()
+
+def prepare(task):
+    '''Decode and resize one image, and transform its labels accordingly.'''
+    path, labels, (height, width), boxed = task
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError('File corrupt {}'.format(path))
+    labels = np.array(labels, dtype=np.float32).reshape(-1, 6)
+    h, w = image.shape[:2]
+    if boxed:
+        image, ratio, padw, padh = letterbox(image, height=height, width=width)
+        labels[:, 2] = (ratio * w * labels[:, 2] + padw) / width
+        labels[:, 3] = (ratio * h * labels[:, 3] + padh) / height
+        labels[:, 4] *= ratio * w / width
+        labels[:, 5] *= ratio * h / height
+    else:
+        # Normalized labels do not change if the aspect ratio is kept.
+        ratio = min(height / h, width / w)
+        if ratio < 1:
+            size = (round(w * ratio), round(h * ratio))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image, labels
+
+def main():
+    args = parse_args()
+    insize = tuple(int(s) for s in args.insize.split('x'))
+    datasets, image_paths, label_paths = read_dataset_lists(args.root, args.cfg)
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(args.cfg)), '.cache')
+    label_index = LabelIndex.build(args.root, datasets, label_paths, cache_dir)
+
+    # Transform local identifiers to global identifiers once.
+    shifts = np.repeat(list(label_index.id_shifts.values()),
+        np.diff(label_index.offsets[np.cumsum([0] + label_index.num_ims)]))
+    labels = np.array(label_index.labels)
+    valid = labels[:, 1] > -1
+    labels[valid, 1] += shifts[valid]
+
+    paths = [path for ps in image_paths.values() for path in ps]
+    tasks = ((path, labels[label_index.offsets[i] : label_index.offsets[i + 1]],
+        insize, args.letterbox) for i, path in enumerate(paths))
+    writer = ShardWriter(args.output, args.shard_size << 20)
+    with Pool(args.workers) as pool:
+        for i, (image, label) in enumerate(pool.imap(prepare, tasks, chunksize=16)):
+            writer.write(image, label)
+            if (i + 1) % 1000 == 0 or i + 1 == len(paths):
+                print('packed {}/{}'.format(i + 1, len(paths)))
+    writer.close({'names': label_index.names, 'num_ids': list(label_index.num_ids.values()),
+        'id_shifts': list(label_index.id_shifts.values()), 'insize': insize,
+        'letterbox': args.letterbox})
+    print('{} images in {} shards saved to {}'.format(len(paths), writer.num_shards,
+        args.output))
+
+if __name__ == '__main__':
+    main()
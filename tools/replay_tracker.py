@@ -0,0 +1,137 @@
+# Run from the repository root as a module, e.g.
+#   python -m tools.replay_tracker --caches workspace/cache/* \
+#       --param max_lost_time=30,60 --param lamb=0.9,0.98 --workers 8 \
+#       --gt-root MOT16/train
+# so that tools/profile.py does not shadow the standard library profile module.
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import importlib
+import collections
+from multiprocessing import Pool
+
+sys.path.append(os.getcwd())
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='replay cached detections through JDETracker with many parameter settings')
+    parser.add_argument('--caches', type=str, nargs='+',
+        help='detection cache directories written by tracker.py --cache, one per sequence')
+    parser.add_argument('--param', type=str, action='append', default=[],
+        help='JDETracker parameter and candidate values, e.g. lamb=0.9,0.98.'
+        ' It can be given several times, all combinations will be replayed')
+    parser.add_argument('--tracker', type=str, default='tracker',
+        help='module providing JDETracker, tracker or trackernew')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+        help='number of worker processes')
+    parser.add_argument('--workspace', type=str, default='workspace',
+        help='workspace path, results are saved in workspace/sweep')
+    parser.add_argument('--gt-root', type=str, default='',
+        help='MOTChallenge data root with S/gt/gt.txt for every cached sequence S,'
+        ' if given every setting is evaluated and ranked by IDF1')
+    return parser.parse_args()
+
+def parse_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+def parse_grid(params):
+    '''Parse ['name=v1,v2', ...] into a list of parameter dictionaries,
+    one for each combination.
+    '''
+    names, values = [], []
+    for param in params:
+        name, candidates = param.split('=', 1)
+        names.append(name.strip())
+        values.append([parse_value(v.strip()) for v in candidates.split(',')])
+    return [collections.OrderedDict(zip(names, combo))
+        for combo in itertools.product(*values)]
+
+def setting_name(params):
+    if len(params) == 0:
+        return 'default'
+    return '_'.join('{}-{}'.format(k, v) for k, v in params.items())
+
+def replay(task):
+    '''Replay one sequence with one parameter setting in a worker process.'''
+    module_name, cache, params, result_path = task
+    module = importlib.import_module(module_name)
+    frames = module.load_detection_cache(cache)
+    tracker = module.JDETracker(**params)
+    writer = module.MOTWriter(result_path)
+    start = time.perf_counter()
+    for i, dets in enumerate(frames):
+        if len(dets) == 0:  # tracker.main skips frames without detections
+            continue
+        trajectories = tracker.update(dets.copy())
+        writer.write(trajectories, i + 1)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return {'sequence': os.path.basename(os.path.normpath(cache)),
+        'params': params, 'result': result_path, 'frames': len(frames),
+        'fps': len(frames) / max(elapsed, 1e-12)}
+
+def evaluate(gt_root, results, workers=None):
+    '''Evaluate the results of every setting against the ground truth, and
+    add the metrics of each sequence and of all sequences to the summary.
+    '''
+    # Imported here, the replay workers do not need it.
+    from mot.utils.evaluation import evaluate_mot
+    names = list(results.keys())
+    sequences = sorted(set(r['sequence'] for name in names
+        for r in results[name]['sequences']))
+    result_dirs = [os.path.dirname(results[name]['sequences'][0]['result'])
+        for name in names]
+    metrics = evaluate_mot(gt_root, result_dirs, sequences, workers=workers)
+    for name, seq_metrics in zip(names, metrics):
+        for result in results[name]['sequences']:
+            result['metrics'] = seq_metrics[result['sequence']]
+        results[name]['metrics'] = seq_metrics['OVERALL']
+    return results
+
+def main():
+    args = parse_args()
+    settings = parse_grid(args.param)
+    tasks = []
+    for params in settings:
+        result_dir = os.path.join(args.workspace, 'sweep', setting_name(params))
+        if not os.path.exists(result_dir):
+            os.makedirs(result_dir)
+        for cache in args.caches:
+            sequence = os.path.basename(os.path.normpath(cache))
+            tasks.append((args.tracker, cache, dict(params),
+                os.path.join(result_dir, '{}.txt'.format(sequence))))
+
+    print('{} settings x {} sequences'.format(len(settings), len(args.caches)))
+    results = collections.OrderedDict((setting_name(params),
+        {'params': params, 'sequences': []}) for params in settings)
+    with Pool(args.workers) as pool:
+        for result in pool.imap_unordered(replay, tasks):
+            name = setting_name(result['params'])
+            results[name]['sequences'].append(result)
+            print('{} {} {:.1f}fps'.format(name, result['sequence'], result['fps']))
+
+    if args.gt_root:
+        results = evaluate(args.gt_root, results, args.workers)
+        ranking = sorted(results.items(), key=lambda item: (-item[1]['metrics']['IDF1'],
+            -item[1]['metrics']['MOTA']))
+        print('{:>8}{:>8}  {}'.format('IDF1', 'MOTA', 'setting'))
+        for name, result in ranking:
+            print('{:>8.2f}{:>8.2f}  {}'.format(result['metrics']['IDF1'],
+                result['metrics']['MOTA'], name))
+        results = collections.OrderedDict(ranking)
+
+    summary = os.path.join(args.workspace, 'sweep', 'summary.json')
+    with open(summary, 'w') as file:
+        json.dump(results, file, indent=2)
+    print('summary saved to {}'.format(summary))
+
+if __name__ == '__main__':
+    main()
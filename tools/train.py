@@ -2,8 +2,9 @@ import os
 import sys
 import torch
 import argparse
+import torch.multiprocessing as mp
 sys.path.append(os.getcwd())
-from mot.utils import config, mkdirs
+from mot.utils import config, mkdirs, init_distributed
 from mot.models import build_tracker
 from mot.datasets import build_dataset
 from mot.apis import train_tracker
@@ -17,13 +18,17 @@ def parse_args():
         help='modify configuration in command line')
     return parser.parse_args()
 
-def main():
+def worker(rank, world_size, args):
     # Parse configurations.
-    args = parse_args()
     if os.path.isfile(args.config):
         config.merge_from_file(args.config)
     config.merge_from_list(args.opts)
     
+    # Initialize the process group for distributed training.
+    if world_size > 1:
+        init_distributed(rank, world_size, config.SYSTEM.DIST_BACKEND,
+            config.SYSTEM.DIST_URL)
+    
     torch.backends.cudnn.benchmark = True
     mkdirs(config.SYSTEM.TASK_DIR)
     
@@ -37,6 +42,23 @@ def main():
    
     # Train tracker now.
     train_tracker(model, dataset, config)
+
+def main():
+    args = parse_args()
+    if 'RANK' in os.environ:
+        # Launched by torchrun, one process per device on every node.
+        worker(int(os.environ['RANK']), int(os.environ['WORLD_SIZE']), args)
+        return
+    
+    # Otherwise spawn SYSTEM.NUM_GPUS processes on this node.
+    if os.path.isfile(args.config):
+        config.merge_from_file(args.config)
+    config.merge_from_list(args.opts)
+    world_size = config.SYSTEM.NUM_GPUS
+    if world_size > 1:
+        mp.spawn(worker, args=(world_size, args), nprocs=world_size)
+    else:
+        worker(0, 1, args)
     
 if __name__ == '__main__':
     main()
\ No newline at end of file
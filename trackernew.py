@@ -1,22 +1,20 @@
 import os
 import re
+import time
+import json
 import cv2
 import lap
 import torch
 import argparse
+import threading
+import subprocess
 import collections
 import numpy as np
+from queue import Queue
 from enum import IntEnum
-from torchvision.ops import nms
-from cython_bbox import bbox_overlaps
-from scipy.spatial.distance import cdist
 
-import jde
 import kalman
-import yolov3
-import darknet
-import dataset
-import shufflenetv2
+import embedding
 import sys
 sys.path.append(os.getcwd())
 from mot.utils import config
@@ -48,6 +46,29 @@ def parse_args():
         help='embedding dimension, default is 128')
     parser.add_argument('--workspace', type=str, default='workspace',
         help='workspace path')
+    parser.add_argument('--pipeline', action='store_true',
+        help='run decoding, inference, tracking and writing as overlapped stages')
+    parser.add_argument('--queue-size', type=int, default=4,
+        help='capacity of the queues between pipeline stages, default is 4')
+    parser.add_argument('--video', type=str, default='images',
+        choices=['images', 'opencv', 'ffmpeg', 'none'],
+        help='how to save rendered frames, default is images, i.e. jpeg files'
+        ' encoded by ffmpeg at the end. opencv and ffmpeg encode the video directly')
+    parser.add_argument('--fps', type=float, default=25,
+        help='frame rate of the result video, default is 25')
+    parser.add_argument('--npz', action='store_true',
+        help='also save trajectories as a columnar .npz log')
+    parser.add_argument('--flush-every', type=int, default=100,
+        help='flush the result file every n frames, 0 flushes only at the end,'
+        ' default is 100')
+    parser.add_argument('--cache', type=str, default='',
+        help='save post-nms detections and embeddings under this directory'
+        ' for replaying the association stage')
+    parser.add_argument('--profile', type=str, default='',
+        help='save per-frame tracker profiling data to this path')
+    parser.add_argument('--profile-format', type=str, default='chrome',
+        choices=['chrome', 'jsonl'],
+        help='profiling data format, chrome trace json or json lines, default is chrome')
     return parser.parse_args()
 
 def mkdir(path):
@@ -110,26 +131,76 @@ def nonmax_suppression(dets, score_thresh=0.5, iou_thresh=0.4):
     '''检测器输出的非最大值抑制
     
     Args:
-        dets (torch.Tensor): 检测器输出, dets.size()=[batch_size,
+        dets (torch.Tensor, tuple or list): 检测器输出, dets.size()=[batch_size,
             #proposals, #dim], 其中#proposals是所有尺度输出的建议
-            框数量, #dim是每个建议框的属性维度
+            框数量, #dim是每个建议框的属性维度. 也可以是JDEHead紧凑模式的
+            输出(det, ide, index), 此时只为NMS后保留的建议框拼接嵌入;
+            或者JDEHead稀疏模式输出的每幅图像的建议框列表
         score_thresh (float): 置信度阈值, score_thresh∈[0,1]
         iou_thresh (float): 重叠建议框的叫并面积比阈值, iou_thresh∈[0,1]
     Returns:
         nms_dets (torch.Tensor): 经NMS的检测器输出
     '''
-    nms_dets = [None for _ in range(dets.size(0))]
+    # torchvision is imported when needed, it slows down the startup noticeably.
+    from torchvision.ops import nms
+    ides = None
+    if isinstance(dets, tuple):
+        dets, ides, index = dets
+    nms_dets = [None for _ in range(len(dets))]
     for i, det in enumerate(dets):
         keep = det[:,4] > score_thresh
+        if ides is not None:
+            keep = torch.nonzero(keep).view(-1)
         det = det[keep]
         if not det.size(0):
             continue
         det[:, :4] = xywh2ltrb(det[:, :4])
-        keep = nms(det[:, :4], det[:, 4], iou_thresh)
-        det = det[keep]
+        nms_keep = nms(det[:, :4], det[:, 4], iou_thresh)
+        det = det[nms_keep]
+        if ides is not None:
+            det = torch.cat([det, ides[i][index[keep[nms_keep]]]], dim=1)
         nms_dets[i] = det
     return nms_dets
 
+def batched_nonmax_suppression(dets, score_thresh=0.5, iou_thresh=0.4):
+    '''整个批次的检测器输出一次完成非最大值抑制
+    
+    Args:
+        dets (torch.Tensor, tuple or list): 检测器输出, 格式同nonmax_suppression
+        score_thresh (float): 置信度阈值, score_thresh∈[0,1]
+        iou_thresh (float): 重叠建议框的叫并面积比阈值, iou_thresh∈[0,1]
+    Returns:
+        nms_dets (torch.Tensor): 经NMS的检测器输出, 按图像序号排序, 同一图像
+            内按置信度降序排列
+        batch (torch.Tensor): nms_dets中每个建议框所属的图像序号
+    '''
+    from torchvision.ops import batched_nms
+    ides = None
+    if isinstance(dets, tuple):
+        dets, ides, index = dets
+    if isinstance(dets, list):
+        batch = torch.cat([torch.full((det.size(0),), i, dtype=torch.int64)
+            for i, det in enumerate(dets)])
+        dets = torch.cat(dets, dim=0)
+    else:
+        n, m = dets.size()[:2]
+        batch = torch.arange(n).view(-1, 1).expand(n, m).reshape(-1)
+        dets = dets.view(n * m, -1)
+    batch = batch.to(dets.device)
+    keep = torch.nonzero(dets[:, 4] > score_thresh).view(-1)
+    det = dets[keep]
+    batch = batch[keep]
+    det[:, :4] = xywh2ltrb(det[:, :4])
+    nms_keep = batched_nms(det[:, :4], det[:, 4], batch, iou_thresh)
+    # batched_nms按置信度全局降序返回, 稳定排序后同一图像的结果连续存放
+    order = torch.sort(batch[nms_keep], stable=True)[1]
+    nms_keep = nms_keep[order]
+    det = det[nms_keep]
+    batch = batch[nms_keep]
+    if ides is not None:
+        det = torch.cat([det, ides[batch, index[keep[nms_keep] % m]]], dim=1)
+    return det, batch
+
 def ltrb_net2img(boxes, net_size, img_size):
     '''将神经网络坐标系下的建议框投影到图像坐标系下
     
@@ -205,51 +276,101 @@ class TrajectoryState(IntEnum):
     Lost = 2
     Removed = 3
 
-class Trajectory(kalman.KalmanFilter):
-    '''轨迹
+class Trajectory(object):
+    '''轨迹. 卡尔曼滤波器的状态保存在kalman_bank中, 激活后的平滑表观嵌入
+        保存在embedding_bank中, 轨迹只持有其中一行的索引
+    
+    Args:
+        ltrb (numpy.ndarray): [l,t,r,b]格式的建议框
+        score (float): 检测置信度
+        embedding (numpy.ndarray): 表观嵌入
+        kalman_bank (kalman.KalmanFilterBank, optional): 卡尔曼滤波器组,
+            通常由JDETracker统一创建, 缺省时使用独立的滤波器组
+        embedding_bank (embedding.EmbeddingBank, optional): 表观嵌入库,
+            通常由JDETracker统一创建, 缺省时嵌入保存在轨迹自身
+        eta (float, optional): 表观嵌入的平滑系数
     '''
     count = 0
-    def __init__(self, ltrb, score, embedding):
-        super(Trajectory, self).__init__()
+    def __init__(self, ltrb, score, embedding, kalman_bank=None, embedding_bank=None,
+        eta=0.9):
+        self.kalman = kalman_bank if kalman_bank is not None \
+            else kalman.KalmanFilterBank(capacity=1)
+        self.kid = -1
+        self.embeddings = embedding_bank
+        self.eid = -1
         self.ltrb = ltrb
         self.xyah = ltrb2xyah(ltrb)
         self.score = score
-        self.smooth_embedding = None
+        self._smooth_embedding = None
         self.id = 0
         self.is_activated = False
-        self.eta = 0.9
+        self.eta = eta
         self.timestamp = 0
         self.length = 0
         self.starttime = 0
         self.update_embedding(embedding)
     
+    @property
+    def smooth_embedding(self):
+        if self.eid >= 0:
+            return self.embeddings.matrix[self.eid]
+        return self._smooth_embedding
+    
     def update_embedding(self, embedding):
         self.current_embedding = embedding / np.linalg.norm(embedding)
-        if self.smooth_embedding is None:
-            self.smooth_embedding = self.current_embedding
+        if self.eid >= 0:
+            self.embeddings.update(self.eid, self.current_embedding, self.eta)
+        elif self._smooth_embedding is None:
+            self._smooth_embedding = self.current_embedding
+            self._smooth_embedding /= np.linalg.norm(self._smooth_embedding)
         else:
-            self.smooth_embedding = self.eta * self.smooth_embedding + \
+            self._smooth_embedding = self.eta * self._smooth_embedding + \
                 (1 - self.eta) * self.current_embedding
-        self.smooth_embedding /= np.linalg.norm(self.smooth_embedding)
+            self._smooth_embedding /= np.linalg.norm(self._smooth_embedding)
     
     @staticmethod
     def next_id():
         Trajectory.count += 1
         return Trajectory.count
     
-    def predict(self, *args, **kwargs):
-        if self.state != TrajectoryState.Tracked:
-            self.kf.statePost[7] = 0
-        return super().predict(*args, **kwargs)
+    def predict(self):
+        multi_predict([self])
     
-    def update(self, trajectory, timestamp, update_embedding=True):
+    def correct(self, xyah):
+        '''用测量更新卡尔曼滤波器, 并同步轨迹的建议框
+        
+        Args:
+            xyah (numpy.ndarray): [x,y,a,h]格式的测量
+        '''
+        self.kalman.correct([self.kid], xyah)
+        self.sync_state()
+    
+    def sync_state(self):
+        '''从卡尔曼滤波器组同步轨迹的建议框
+        '''
+        self.xyah = self.kalman.mean[self.kid, :4].copy()
+        self.ltrb = xyah2ltrb(self.xyah)
+    
+    def gating_distance(self, measurement, only_position=False, metric='maha'):
+        return self.kalman.gating_distance([self.kid], measurement, only_position, metric)[0]
+    
+    def update(self, trajectory, timestamp, update_embedding=True, corrected=False):
+        '''融合候选轨迹
+        
+        Args:
+            trajectory (Trajectory): 候选轨迹
+            timestamp (int): 当前时间戳
+            update_embedding (bool, optional): 是否更新表观嵌入
+            corrected (bool, optional): 卡尔曼滤波器是否已经批量更新, 见multi_correct
+        '''
         self.timestamp = timestamp
         self.length += 1
         # self.ltrb = trajectory.ltrb
         # self.xyah = trajectory.xyah
-        mean = super().correct(trajectory.xyah)
-        self.xyah = mean[:4].copy()
-        self.ltrb = xyah2ltrb(self.xyah)
+        if corrected:
+            self.sync_state()
+        else:
+            self.correct(trajectory.xyah)
         self.state = TrajectoryState.Tracked
         self.is_activated = True
         self.score = trajectory.score
@@ -258,16 +379,19 @@ class Trajectory(kalman.KalmanFilter):
     
     def activate(self, timestamp):
         self.id = self.next_id()
-        super().initialize(self.xyah)
+        self.kid = self.kalman.allocate(self.xyah)
+        if self.embeddings is not None:
+            self.eid = self.embeddings.allocate(self._smooth_embedding)
         self.length = 0
         self.state = TrajectoryState.Tracked
         self.timestamp = timestamp
         self.starttime = timestamp
     
-    def reactivate(self, trajectory, timestamp, newid=False):
-        mean = super().correct(trajectory.xyah)
-        self.xyah = mean[:4].copy()
-        self.ltrb = xyah2ltrb(self.xyah)
+    def reactivate(self, trajectory, timestamp, newid=False, corrected=False):
+        if corrected:
+            self.sync_state()
+        else:
+            self.correct(trajectory.xyah)
         self.update_embedding(trajectory.current_embedding)
         self.length = 0
         self.state = TrajectoryState.Tracked
@@ -285,23 +409,49 @@ class Trajectory(kalman.KalmanFilter):
     def timestamp(self):
         return self.timestamp
 
+def multi_predict(trajectories):
+    '''批量预测轨迹在当前帧的状态
+    
+    Args:
+        trajectories (list of Trajectory): 共享同一个卡尔曼滤波器组的轨迹
+    '''
+    if len(trajectories) == 0:
+        return
+    kalman_bank = trajectories[0].kalman
+    indices = np.array([t.kid for t in trajectories], dtype=np.int64)
+    untracked = np.array([t.state != TrajectoryState.Tracked for t in trajectories])
+    # 非跟踪状态的轨迹不再预测高度变化
+    kalman_bank.mean[indices[untracked], 7] = 0
+    kalman_bank.predict(indices)
+
+def multi_correct(trajectories, candidates):
+    '''用候选轨迹的测量批量更新轨迹的卡尔曼滤波器
+    
+    Args:
+        trajectories (list of Trajectory): 共享同一个卡尔曼滤波器组的轨迹
+        candidates (list of Trajectory): 与trajectories一一对应的候选轨迹
+    '''
+    if len(trajectories) == 0:
+        return
+    kalman_bank = trajectories[0].kalman
+    indices = [t.kid for t in trajectories]
+    measurements = np.asarray([c.xyah for c in candidates])
+    kalman_bank.correct(indices, measurements)
+
 def joint_trajectories(A, B):
     '''合并两个轨迹组
     
     Args:
         A (list of Trajectory): 轨迹组A
-        B (list of Trajectory): 轨迹组B
+        B (iterable of Trajectory): 轨迹组B
     Returns:
         C (list of Trajectory): 合并后的轨迹组
     '''
-    exists = {}
-    C = []
-    for t in A:
-        exists[t.id] = 1
-        C.append(t)
+    exists = set(t.id for t in A)
+    C = list(A)
     for t in B:
-        if not exists.get(t.id, 0):
-            exists[t.id] = 1
+        if t.id not in exists:
+            exists.add(t.id)
             C.append(t)
     return C
 
@@ -310,54 +460,152 @@ def exclude_trajectories(A, B):
     
     Args:
         A (list of Trajectory): 轨迹组A
-        B (list of Trajectory): 轨迹组B
+        B (iterable of Trajectory or dict): 轨迹组B, 或者以轨迹编号为键的字典
     Returns:
         C (list of Trajectory): 排除共同轨迹之后的轨迹组A
     '''
-    exists = {}
-    C = []
-    for t in B:
-        exists[t.id] = 1
-    for t in A:
-        if not exists.get(t.id, 0):
-            C.append(t)
-    return C
+    exists = B if isinstance(B, dict) else set(t.id for t in B)
+    return [t for t in A if t.id not in exists]
+
+class TrajectoryStore(object):
+    '''按轨迹编号索引的轨迹库. 跟踪(含不确定状态), 跟丢和已移除的轨迹分别保存
+        在按插入顺序排列的字典中, 状态切换都是O(1)的字典操作. 已移除的轨迹只保留
+        最近的max_removed条, 因此内存和每帧的开销只和存活的轨迹数量有关.
+    
+    Args:
+        max_removed (int, optional): 保留的已移除轨迹数量, 为None时不限制
+    '''
+    def __init__(self, max_removed=1000):
+        self.tracked = collections.OrderedDict()
+        self.lost    = collections.OrderedDict()
+        self.removed = collections.OrderedDict()
+        self.recently_removed = collections.OrderedDict()
+        self.max_removed = max_removed
+    
+    def __len__(self):
+        return len(self.tracked) + len(self.lost)
+    
+    @staticmethod
+    def add(group, trajectories):
+        '''加入轨迹, 已经存在的轨迹保持原来的位置
+        
+        Args:
+            group (collections.OrderedDict): 轨迹组
+            trajectories (iterable of Trajectory): 待加入的轨迹
+        '''
+        for t in trajectories:
+            if t.id not in group:
+                group[t.id] = t
+    
+    @staticmethod
+    def discard(group, exclusion):
+        '''从轨迹组中删除那些编号在exclusion中的轨迹, 开销和轨迹组大小成正比
+        
+        Args:
+            group (collections.OrderedDict): 轨迹组
+            exclusion (dict or set): 需要删除的轨迹编号
+        '''
+        for id in [id for id in group if id in exclusion]:
+            del group[id]
+    
+    def remove(self, trajectories):
+        '''记录已移除的轨迹, 超出保留数量时丢弃最早移除的轨迹. 最近一次移除的
+            轨迹另外保存在recently_removed中, 不受保留数量的限制
+        
+        Args:
+            trajectories (iterable of Trajectory): 已移除的轨迹
+        '''
+        self.recently_removed = collections.OrderedDict()
+        for t in trajectories:
+            self.recently_removed[t.id] = t
+            self.removed.pop(t.id, None)
+            self.removed[t.id] = t
+        if self.max_removed is not None:
+            while len(self.removed) > self.max_removed:
+                self.removed.popitem(last=False)
+    
+    def reset(self, tracked, lost):
+        '''用新的轨迹列表重建跟踪和跟丢的轨迹组
+        
+        Args:
+            tracked (list of Trajectory): 跟踪的轨迹
+            lost (list of Trajectory): 跟丢的轨迹
+        '''
+        self.tracked = collections.OrderedDict((t.id, t) for t in tracked)
+        self.lost = collections.OrderedDict((t.id, t) for t in lost)
 
-def embedding_distance(A, B):
+def embedding_distance(A, B, metric='euclidean', dtype=np.float32, out=None):
     '''计算表观嵌入之间的代价矩阵
     
     Args:
-        A (list of Trajectory): 轨迹组A
-        B (list of Trajectory): 轨迹组B
+        A (list of Trajectory): 轨迹组A, 使用平滑嵌入
+        B (list of Trajectory): 轨迹组B, 使用当前嵌入
+        metric (str, optional): 'euclidean'或'cosine'
+        dtype (numpy.dtype, optional): 计算精度, np.float32或np.float16
+        out (numpy.ndarray, optional): 写入代价的(len(A),len(B))连续float32矩阵,
+            例如AssociationWorkspace的缓冲区, 缺省时新分配
     Returns:
         costs (numpy.ndarray): 代价矩阵
     '''
-    costs = np.zeros((len(A), len(B)))
+    if len(A) == 0 or len(B) == 0:
+        return out if out is not None else np.zeros((len(A), len(B)))
+    XB = np.asarray([trajectory.current_embedding for trajectory in B])
+    bank = A[0].embeddings
+    if bank is not None and all(t.embeddings is bank and t.eid >= 0 for t in A):
+        return bank.distance([t.eid for t in A], XB, metric, dtype, out)
+    XA = np.asarray([trajectory.smooth_embedding for trajectory in A])
+    return embedding.pairwise_distance(XA, XB, metric, dtype, out)
+
+def ltrb_iou_distance(BA, BB, out=None, scratch=None):
+    '''计算两组[l,t,r,b]建议框之间的IOU距离. 边长按像素计数(加1),
+        与cython_bbox.bbox_overlaps的结果一致
+    
+    Args:
+        BA (array like): 建议框组A
+        BB (array like): 建议框组B
+        out (numpy.ndarray, optional): 写入代价的(len(BA),len(BB))连续float64矩阵,
+            缺省时新分配
+        scratch (numpy.ndarray, optional): 与out形状相同的临时矩阵, 缺省时新分配
+    Returns:
+        costs (numpy.ndarray): 代价矩阵
+    '''
+    BA = np.asarray(BA, dtype=np.float64).reshape(-1, 4)
+    BB = np.asarray(BB, dtype=np.float64).reshape(-1, 4)
+    costs = out if out is not None else np.empty((len(BA), len(BB)))
     if costs.size == 0:
         return costs
-    XA = np.asarray([trajectory.smooth_embedding for trajectory in A])
-    XB = np.asarray([trajectory.current_embedding for trajectory in B])
-    costs = np.maximum(0, cdist(XA, XB))
-    return costs
+    temp = scratch if scratch is not None else np.empty_like(costs)
+    area_a = (BA[:, 2] - BA[:, 0] + 1) * (BA[:, 3] - BA[:, 1] + 1)
+    area_b = (BB[:, 2] - BB[:, 0] + 1) * (BB[:, 3] - BB[:, 1] + 1)
+    # 交集宽度
+    np.minimum(BA[:, 2:3], BB[:, 2], out=costs)
+    costs -= np.maximum(BA[:, 0:1], BB[:, 0], out=temp)
+    costs += 1
+    np.maximum(costs, 0, out=costs)
+    # 交集高度
+    np.minimum(BA[:, 3:4], BB[:, 3], out=temp)
+    temp -= np.maximum(BA[:, 1:2], BB[:, 1])
+    temp += 1
+    np.maximum(temp, 0, out=temp)
+    costs *= temp
+    # 交集/并集
+    np.add(area_a[:, None], area_b, out=temp)
+    temp -= costs
+    costs /= temp
+    return np.subtract(1, costs, out=costs)
 
-def iou_distance(A, B):
+def iou_distance(A, B, out=None, scratch=None):
     '''计算轨迹之间的IOU距离
     
     Args:
         A (list of Trajectory): 轨迹组A
         B (list of Trajectory): 轨迹组B
+        out (numpy.ndarray, optional): 写入代价的矩阵, 见ltrb_iou_distance
+        scratch (numpy.ndarray, optional): 临时矩阵, 见ltrb_iou_distance
     Returns:
         costs (numpy.ndarray): 代价矩阵
     '''
-    BA = [a.ltrb for a in A]
-    BB = [b.ltrb for b in B]
-    ious = np.zeros((len(A), len(B)), dtype=np.float)
-    if ious.size == 0:
-        return ious   
-    ious = bbox_overlaps(np.ascontiguousarray(BA, dtype=np.float),
-        np.ascontiguousarray(BB, dtype=np.float))
-    costs = 1 - ious
-    return costs
+    return ltrb_iou_distance([a.ltrb for a in A], [b.ltrb for b in B], out, scratch)
 
 def remove_duplicate_trajectories(A, B, thresh=0.15):
     '''从轨迹组A和轨迹组B中那些重叠的轨迹
@@ -382,65 +630,407 @@ def remove_duplicate_trajectories(A, B, thresh=0.15):
     B = [b for i,b in enumerate(B) if not i in DB]
     return A, B
 
-def merge_mahalanobis_distance(trajectory_pool, candidates, dists, lamb=0.98):
-    '''融合表观嵌入距离和马氏距离
+def merge_mahalanobis_distance(trajectory_pool, candidates, dists, lamb=0.98,
+    only_position=False, scratch=None):
+    '''融合表观嵌入距离和马氏距离, 原地修改dists
     
     Args:
         trajectory_pool (list of Trajectory): 轨迹池
         candidates (list of Trajectory): 候选轨迹
         dists (numpy.ndarray): 轨迹池和候选轨迹之间的代价矩阵
         lamb (float, optional): 融合两种距离的权重系数
+        only_position (bool, optional): 仅使用建议框的中心坐标计算马氏距离
+        scratch (numpy.ndarray, optional): 写入马氏距离的float64临时矩阵,
+            形状与dists相同, 缺省时新分配
     Returns:
         dists (numpy.ndarray): 轨迹池和候选轨迹之间的代价矩阵
     '''
     if dists.size == 0:
         return dists
-    gate_thresh = kalman.chi2inv95[4]
+    gate_thresh = kalman.chi2inv95[2 if only_position else 4]
     measurements = np.asarray([candidate.xyah for candidate in candidates])
-    for i,trajectory in enumerate(trajectory_pool):
-        gdist = trajectory.gating_distance(measurements)
-        dists[i, gdist > gate_thresh] = np.inf
-        dists[i] = lamb * dists[i] + (1 - lamb) * gdist
+    kalman_bank = trajectory_pool[0].kalman
+    gdists = kalman_bank.gating_distance([t.kid for t in trajectory_pool],
+        measurements, only_position, out=scratch)
+    gated = gdists > gate_thresh
+    gdists *= 1 - lamb
+    dists *= lamb
+    dists += gdists
+    dists[gated] = np.inf
     return dists
 
-def linear_assignment(cost, cost_limit):
+def linear_assignment(cost, cost_limit, method='dense'):
     '''线性分配
     
     Args:
         cost (numpy.ndarray): 代价矩阵
         cost_limit (float): 线性分配代价上限
+        method (str, optional): 'dense'在整个代价矩阵上求解, 'sparse'按连通分量
+            分别求解, 总代价相同, 见sparse_linear_assignment
     Returns:
         matches (numpy.ndarray): 一个N*2的匹配索引矩阵, N为匹配对数
             matches[i,j]表示第j个候选轨迹分配给第i个轨迹池轨迹
         mismatch_row (numpy.ndarray): 没有分配的行(轨迹池中的轨迹)
         mismatch_col (numpy.ndarray): 没有分配的列(候选集中的轨迹)
     '''
-    matches = np.empty((0, 2), dtype=int)
-    mismatch_row = np.arange(cost.shape[0], dtype=int)
-    mismatch_col = np.arange(cost.shape[1], dtype=int)
+    rows, cols, mismatch_row, mismatch_col = assignment_indices(cost, cost_limit, method)
+    return np.stack([rows, cols], axis=1), mismatch_row, mismatch_col
+
+def assignment_indices(cost, cost_limit, method='dense'):
+    '''线性分配, 匹配结果以索引数组的形式返回
+    
+    Args:
+        cost (numpy.ndarray): 代价矩阵
+        cost_limit (float): 线性分配代价上限
+        method (str, optional): 见linear_assignment
+    Returns:
+        rows (numpy.ndarray): 分配到的行
+        cols (numpy.ndarray): 与rows一一对应的列, 第cols[i]列分配给第rows[i]行
+        mismatch_row (numpy.ndarray): 没有分配的行(轨迹池中的轨迹)
+        mismatch_col (numpy.ndarray): 没有分配的列(候选集中的轨迹)
+    '''
     if cost.size == 0:
-        return matches, mismatch_row, mismatch_col
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), \
+            np.arange(cost.shape[0], dtype=np.int64), np.arange(cost.shape[1], dtype=np.int64)
+    
+    if method == 'sparse':
+        x, y = sparse_linear_assignment(cost, cost_limit)
+    elif method == 'dense':
+        opt, x, y = lap.lapjv(cost, extend_cost=True, cost_limit=cost_limit)
+    else:
+        raise ValueError('unknown assignment method {}'.format(method))
+    rows = np.flatnonzero(x >= 0)
+    return rows, x[rows], np.flatnonzero(x < 0), np.flatnonzero(y < 0)
+
+def sparse_linear_assignment(cost, cost_limit):
+    '''按连通分量求解线性分配. 代价不小于cost_limit的边不会被分配, 去掉这些边后
+        的二部图分解为若干连通分量, 各分量的最优分配互不影响. 只有一行或一列的
+        分量直接取代价最小的边, 其余分量在各自的子矩阵上用LAPJV求解.
+        人群规模很大而门限内的边很少时, 比在整个代价矩阵上求解快得多.
+        得到的匹配数和总代价与在整个代价矩阵上求解相同, 但存在代价相等的
+        多个最优分配时, 两种方法选中的分配可能不同
+    
+    Args:
+        cost (numpy.ndarray): 代价矩阵
+        cost_limit (float): 线性分配代价上限
+    Returns:
+        x (numpy.ndarray): 每一行分配到的列, 没有分配时为-1
+        y (numpy.ndarray): 每一列分配到的行, 没有分配时为-1
+    '''
+    # scipy is imported when needed, it slows down the startup noticeably.
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    m, n = cost.shape
+    x = np.full(m, -1, dtype=np.int64)
+    y = np.full(n, -1, dtype=np.int64)
+    rows, cols = np.nonzero(cost < cost_limit)
+    if len(rows) == 0:
+        return x, y
+    
+    # 行结点编号为0~m-1, 列结点编号为m~m+n-1
+    graph = coo_matrix((np.ones(len(rows)), (rows, cols + m)), shape=(m + n, m + n))
+    count, labels = connected_components(graph, directed=False)
+    num_rows = np.bincount(labels[:m], minlength=count)
+    num_cols = np.bincount(labels[m:], minlength=count)
     
-    matches = []
-    opt, x, y = lap.lapjv(cost, extend_cost=True, cost_limit=cost_limit)
-    for i,xi in enumerate(x):
-        if xi >= 0:
-            matches.append([i, xi])
+    # 一行或一列的分量: 取各分量中代价最小的边
+    edge_labels = labels[rows]
+    simple = (num_rows[edge_labels] == 1) | (num_cols[edge_labels] == 1)
+    order = np.lexsort((cost[rows[simple], cols[simple]], edge_labels[simple]))
+    _, first = np.unique(edge_labels[simple][order], return_index=True)
+    best = np.where(simple)[0][order[first]]
+    x[rows[best]] = cols[best]
+    y[cols[best]] = rows[best]
     
-    matches = np.asarray(matches)
-    mismatch_row = np.where(x < 0)[0]
-    mismatch_col = np.where(y < 0)[0]
-    return matches, mismatch_row, mismatch_col
+    # 其余分量: 在子矩阵上用LAPJV求解
+    others = np.unique(edge_labels[~simple])
+    if len(others) > 0:
+        nodes = np.argsort(labels, kind='stable')
+        bounds = np.cumsum(np.bincount(labels, minlength=count))
+        for label in others:
+            component = nodes[bounds[label] - num_rows[label] - num_cols[label] : bounds[label]]
+            r, c = component[:num_rows[label]], component[num_rows[label]:] - m
+            opt, xc, yc = lap.lapjv(cost[np.ix_(r, c)], extend_cost=True,
+                cost_limit=cost_limit)
+            x[r[xc >= 0]] = c[xc[xc >= 0]]
+            y[c[yc >= 0]] = r[yc[yc >= 0]]
+    return x, y
+
+class AssociationWorkspace(object):
+    '''数据关联的工作区. 关联直接作用于轨迹和检测的数组: 代价矩阵写入预先分配的
+        连续float64缓冲区, 门限原地施加, 求解线性分配后返回匹配的索引数组.
+        缓冲区容量不足时按倍数增长, 避免每帧为级联关联的每一步重新分配矩阵
+    
+    Args:
+        capacity (int, optional): 每个缓冲区的初始容量(元素个数)
+        profiler (TrackerProfiler, optional): 性能剖析器, 缺省时不剖析
+    '''
+    def __init__(self, capacity=4096, profiler=None):
+        self.capacity = capacity
+        self.buffers = {}
+        self.profiler = profiler if profiler is not None \
+            else TrackerProfiler(enabled=False)
+    
+    def matrix(self, name, rows, cols, dtype=np.float64):
+        '''取得一个缓冲区上的连续矩阵视图, 同名缓冲区的内容会被下一次调用覆盖
+        
+        Args:
+            name (str): 缓冲区名称
+            rows (int): 行数
+            cols (int): 列数
+            dtype (numpy.dtype, optional): 数据类型
+        Returns:
+            matrix (numpy.ndarray): (rows,cols)的矩阵, 内容未初始化
+        '''
+        size = rows * cols
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            capacity = self.capacity if buffer is None else buffer.size
+            while capacity < size:
+                capacity *= 2
+            buffer = np.empty(capacity, dtype=dtype)
+            self.buffers[name] = buffer
+        return buffer[:size].reshape(rows, cols)
+    
+    def embedding_association(self, kalman_bank, kids, track_embeddings, measurements,
+        det_embeddings, cost_limit, metric='euclidean', dtype=np.float32, lamb=0.98,
+        only_position=False, method='dense'):
+        '''融合表观嵌入距离和马氏距离关联轨迹和检测. 表观嵌入距离由一次矩阵乘法
+            写入工作区的float64代价矩阵, 马氏距离的加权和门限在其上原地进行,
+            线性分配也直接在这个矩阵上求解
+        
+        Args:
+            kalman_bank (kalman.KalmanFilterBank): 轨迹的卡尔曼滤波器组
+            kids (numpy.ndarray): 轨迹在kalman_bank中的行索引
+            track_embeddings (numpy.ndarray): (M,dim)的轨迹平滑嵌入
+            measurements (numpy.ndarray): (N,4)的检测测量, [x,y,a,h]格式
+            det_embeddings (numpy.ndarray): (N,dim)的检测嵌入, 每行L2范数为1
+            cost_limit (float): 线性分配代价上限
+            metric (str, optional): 'euclidean'或'cosine'
+            dtype (numpy.dtype, optional): 嵌入参与计算前舍入到的精度,
+                np.float32或np.float16, 矩阵乘法和代价都是float64
+            lamb, only_position: 见merge_mahalanobis_distance
+            method (str, optional): 见linear_assignment
+        Returns:
+            rows, cols, mismatch_row, mismatch_col: 见assignment_indices
+        '''
+        profiler = self.profiler
+        m, n = len(kids), len(measurements)
+        costs = self.matrix('cost', m, n)
+        if costs.size > 0:
+            dim = track_embeddings.shape[1]
+            XA = self.matrix('track_embeddings', m, dim)
+            XB = self.matrix('det_embeddings', n, dim)
+            np.copyto(XA, track_embeddings.astype(dtype, copy=False))
+            np.copyto(XB, det_embeddings.astype(dtype, copy=False))
+            embedding.pairwise_distance(XA, XB, metric, np.float64, costs)
+        profiler.lap('embedding_distance')
+        
+        if costs.size > 0:
+            gdists = kalman_bank.gating_distance(kids, measurements, only_position,
+                out=self.matrix('scratch', m, n))
+            gated = np.greater(gdists, kalman.chi2inv95[2 if only_position else 4],
+                out=self.matrix('gated', m, n, np.bool_))
+            gdists *= 1 - lamb
+            costs *= lamb
+            costs += gdists
+            np.copyto(costs, np.inf, where=gated)
+        profiler.lap('mahalanobis_distance')
+        if profiler.enabled:
+            profiler.cost('embedding', costs)
+        
+        matches = assignment_indices(costs, cost_limit, method)
+        profiler.lap('linear_assignment')
+        return matches
+    
+    def iou_association(self, A, B, cost_limit, method='dense', name='iou'):
+        '''根据IOU距离关联两组建议框
+        
+        Args:
+            A (numpy.ndarray): (M,4)的[l,t,r,b]格式建议框
+            B (numpy.ndarray): (N,4)的[l,t,r,b]格式建议框
+            cost_limit (float): 线性分配代价上限
+            method (str, optional): 见linear_assignment
+            name (str, optional): 剖析记录中代价矩阵的名称
+        Returns:
+            rows, cols, mismatch_row, mismatch_col: 见assignment_indices
+        '''
+        profiler = self.profiler
+        m, n = len(A), len(B)
+        costs = ltrb_iou_distance(A, B, self.matrix('cost', m, n), self.matrix('scratch', m, n))
+        profiler.lap('iou_distance')
+        if profiler.enabled:
+            profiler.cost(name, costs)
+        matches = assignment_indices(costs, cost_limit, method)
+        profiler.lap('linear_assignment')
+        return matches
+
+class TrackerProfiler(object):
+    '''跟踪器的逐帧性能剖析器. 记录每个处理阶段的耗时, 各状态轨迹的数量和
+        代价矩阵的大小. 禁用时各方法直接返回, 开销可以忽略. 需要先计算参数的
+        记录(count, cost)由调用者检查enabled, 禁用时连参数也不构造.
+    
+    Args:
+        enabled (bool, optional): 是否启用
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.frames = []
+        self.current = None
+        self.origin = time.perf_counter()
+        self.last = self.origin
+    
+    def begin(self, timestamp):
+        '''开始记录一帧
+        
+        Args:
+            timestamp (int): 跟踪器的时间戳
+        '''
+        if not self.enabled:
+            return
+        self.last = time.perf_counter()
+        self.current = {'frame': timestamp, 'start': self.last,
+            'stages': [], 'counts': {}, 'costs': {}}
+    
+    def lap(self, stage):
+        '''结束一个处理阶段, 阶段的耗时从上一个阶段结束时开始计算
+        
+        Args:
+            stage (str): 阶段名称, 同一帧中可以重复
+        '''
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.current['stages'].append((stage, self.last, now - self.last))
+        self.last = now
+    
+    def count(self, **counts):
+        '''记录计数器, 例如各状态轨迹的数量
+        '''
+        if not self.enabled:
+            return
+        self.current['counts'].update(counts)
+    
+    def cost(self, name, costs):
+        '''记录代价矩阵的大小
+        
+        Args:
+            name (str): 代价矩阵名称
+            costs (numpy.ndarray): 代价矩阵
+        '''
+        if not self.enabled:
+            return
+        self.current['costs'][name] = list(costs.shape)
+    
+    def end(self):
+        '''结束记录一帧
+        '''
+        if not self.enabled:
+            return
+        self.current['duration'] = time.perf_counter() - self.current['start']
+        self.frames.append(self.current)
+        self.current = None
+    
+    def records(self):
+        '''返回结构化的逐帧记录, 时间单位为毫秒
+        '''
+        records = []
+        for frame in self.frames:
+            stages = collections.OrderedDict()
+            for stage, start, elapsed in frame['stages']:
+                stages[stage] = stages.get(stage, 0) + 1000 * elapsed
+            records.append({'frame': frame['frame'],
+                'duration': 1000 * frame['duration'], 'stages': stages,
+                'counts': frame['counts'], 'costs': frame['costs']})
+        return records
+    
+    def summary(self):
+        '''返回每个阶段的平均耗时(毫秒)
+        '''
+        total = collections.OrderedDict()
+        for record in self.records():
+            for stage, elapsed in record['stages'].items():
+                total[stage] = total.get(stage, 0) + elapsed
+        return {stage: elapsed / max(len(self.frames), 1) for stage, elapsed in total.items()}
+    
+    def save(self, path, format='chrome'):
+        '''保存剖析结果
+        
+        Args:
+            path (str): 文件路径
+            format (str, optional): 'chrome'保存为可以用chrome://tracing或
+                Perfetto打开的Chrome trace JSON, 'jsonl'保存为每行一帧的结构化日志
+        '''
+        if format == 'jsonl':
+            with open(path, 'w') as file:
+                for record in self.records():
+                    file.write(json.dumps(record) + '\n')
+            return
+        if format != 'chrome':
+            raise ValueError('unknown profile format {}'.format(format))
+        events = []
+        for frame in self.frames:
+            start = 1e6 * (frame['start'] - self.origin)
+            events.append({'name': 'frame {}'.format(frame['frame']), 'ph': 'X',
+                'ts': start, 'dur': 1e6 * frame['duration'], 'pid': 0, 'tid': 0,
+                'args': {'costs': frame['costs']}})
+            for stage, begin, elapsed in frame['stages']:
+                events.append({'name': stage, 'ph': 'X', 'ts': 1e6 * (begin - self.origin),
+                    'dur': 1e6 * elapsed, 'pid': 0, 'tid': 0})
+            events.append({'name': 'trajectories', 'ph': 'C', 'ts': start,
+                'pid': 0, 'args': frame['counts']})
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
 
 class JDETracker(object):
     '''联合检测和嵌入的目标跟踪器
+    
+    Args:
+        max_removed (int, optional): 保留的已移除轨迹数量, 为None时不限制
+        metric (str, optional): 表观嵌入的距离度量, 'euclidean'或'cosine'
+        precision (numpy.dtype, optional): 表观嵌入距离的计算精度,
+            np.float32或np.float16
+        profiler (TrackerProfiler, optional): 性能剖析器, 缺省时不剖析
+        max_lost_time (int, optional): 跟丢超过这么多帧的轨迹被移除
+        embedding_cost_limit (float, optional): 表观嵌入关联的代价上限
+        iou_cost_limit (float, optional): 跟踪中轨迹IoU关联的代价上限
+        unconfirmed_cost_limit (float, optional): 不确定轨迹IoU关联的代价上限
+        lamb (float, optional): 融合马氏距离时表观嵌入代价的权重
+        eta (float, optional): 轨迹表观嵌入的平滑系数
+        assignment (str, optional): 线性分配方法, 'dense'或'sparse',
+            见linear_assignment. 数百人以上的场景用'sparse'更快
     '''
-    def __init__(self):
+    def __init__(self, max_removed=1000, metric='euclidean', precision=np.float32,
+        profiler=None, max_lost_time=30, embedding_cost_limit=0.7, iou_cost_limit=0.5,
+        unconfirmed_cost_limit=0.7, lamb=0.98, eta=0.9, assignment='dense'):
         self.timestamp = 0
-        self.tracked_trajectories = []
-        self.lost_trajectories    = []
-        self.removed_trajectories = []
-        self.max_lost_time = 30
+        self.store = TrajectoryStore(max_removed)
+        self.max_lost_time = max_lost_time
+        self.embedding_cost_limit = embedding_cost_limit
+        self.iou_cost_limit = iou_cost_limit
+        self.unconfirmed_cost_limit = unconfirmed_cost_limit
+        self.lamb = lamb
+        self.eta = eta
+        self.assignment = assignment
+        self.kalman = kalman.KalmanFilterBank()
+        self.embeddings = embedding.EmbeddingBank()
+        self.metric = metric
+        self.precision = precision
+        self.profiler = profiler if profiler is not None \
+            else TrackerProfiler(enabled=False)
+        self.workspace = AssociationWorkspace(profiler=self.profiler)
+    
+    @property
+    def tracked_trajectories(self):
+        return list(self.store.tracked.values())
+    
+    @property
+    def lost_trajectories(self):
+        return list(self.store.lost.values())
+    
+    @property
+    def removed_trajectories(self):
+        return list(self.store.removed.values())
     
     def update(self, dets):
         '''根据检测结果更新跟踪器
@@ -451,80 +1041,87 @@ class JDETracker(object):
         '''
         
         self.timestamp += 1
+        profiler = self.profiler
+        profiler.begin(self.timestamp)
         
         # 用检测结果初始化候选轨迹, 候选轨迹要么融入轨迹池中已有轨迹,
-        # 要么成为新的轨迹加入轨迹池
+        # 要么成为新的轨迹加入轨迹池. 关联的每一步都按索引从检测结果的数组中取值
+        dets = np.asarray(dets)
         candidates = []
         for det in dets:
-            candidates += [Trajectory(det[:4], det[4], det[6:])]
+            candidates += [Trajectory(det[:4], det[4], det[6:], self.kalman,
+                self.embeddings, self.eta)]
+        det_ltrb = dets[:, :4]
+        det_xyah = ltrb2xyah(det_ltrb)
+        det_embeddings = dets[:, 6:] / np.linalg.norm(dets[:, 6:], axis=1, keepdims=True)
+        profiler.lap('candidates')
         
         # 构造轨迹池
         tracked_trajectories = []
         unconfirmed_trajectories = []
-        for trajectory in self.tracked_trajectories:
+        for trajectory in self.store.tracked.values():
             if trajectory.is_activated:
                 tracked_trajectories.append(trajectory)
             else:
                 unconfirmed_trajectories.append(trajectory)
         
-        trajectory_pool = joint_trajectories(tracked_trajectories, self.lost_trajectories)
+        trajectory_pool = joint_trajectories(tracked_trajectories, self.store.lost.values())
+        pool_kids = np.array([t.kid for t in trajectory_pool], dtype=np.int64)
+        pool_eids = np.array([t.eid for t in trajectory_pool], dtype=np.int64)
+        pool_ltrb = np.array([t.ltrb for t in trajectory_pool]).reshape(-1, 4)
+        pool_tracked = np.array([t.state == TrajectoryState.Tracked \
+            for t in trajectory_pool], dtype=bool)
+        if profiler.enabled:
+            profiler.count(candidates=len(candidates), tracked=len(tracked_trajectories),
+                unconfirmed=len(unconfirmed_trajectories), lost=len(self.store.lost),
+                removed=len(self.store.removed))
+        profiler.lap('pool')
         
-        # 预测轨迹池中轨迹在当前帧的状态
-        for trajectory in trajectory_pool:
-            trajectory.predict()
+        # 预测轨迹池中轨迹在当前帧的状态, 非跟踪状态的轨迹不再预测高度变化
+        if len(pool_kids) > 0:
+            self.kalman.mean[pool_kids[~pool_tracked], 7] = 0
+            self.kalman.predict(pool_kids)
+        profiler.lap('predict')
         
         # 根据表观嵌入和马氏距离关联候选轨迹和池轨迹
-        dists = embedding_distance(trajectory_pool, candidates)
-        dists = merge_mahalanobis_distance(trajectory_pool, candidates, dists)
-        matches, mismatch_row, mismatch_col = linear_assignment(dists, cost_limit=0.7)
+        rows, cols, mismatch_row, mismatch_col = self.workspace.embedding_association(
+            self.kalman, pool_kids, self.embeddings.matrix[pool_eids], det_xyah,
+            det_embeddings, self.embedding_cost_limit, self.metric, self.precision,
+            self.lamb, method=self.assignment)
         
         activated_trajectories = []
         retrieved_trajectories = []
-        for pid, cid in matches:
-            pool_trajectory = trajectory_pool[pid]
-            cand_trajectory = candidates[cid]
-            if pool_trajectory.state == TrajectoryState.Tracked:
-                # 如果池中的轨迹已激活, 将候选轨迹融入轨迹池
-                pool_trajectory.update(cand_trajectory, self.timestamp)
-                activated_trajectories.append(pool_trajectory)
-            else:
-                # 如果池中的轨迹处于休眠状态, 重新激活它
-                pool_trajectory.reactivate(cand_trajectory, self.timestamp)
-                retrieved_trajectories.append(pool_trajectory)
-        
-        # 根据IoU关联候选轨迹和轨迹池
-        candidates = [candidates[i] for i in mismatch_col]
-        # 轨迹池中一直跟踪到上一帧, 但当前帧没有匹配轨迹的那些轨迹
-        mismatch_tracked_pool_trajectories = [trajectory_pool[i] \
-            for i in mismatch_row if trajectory_pool[i].state == TrajectoryState.Tracked]
-        dists = iou_distance(mismatch_tracked_pool_trajectories, candidates)
-        matches, mismatch_row, mismatch_col = linear_assignment(dists, cost_limit=0.5)
-        
-        for pid, cid in matches:
-            pool_trajectory = mismatch_tracked_pool_trajectories[pid]
-            cand_trajectory = candidates[cid]
-            if pool_trajectory.state == TrajectoryState.Tracked:
-                pool_trajectory.update(cand_trajectory, self.timestamp)
-                activated_trajectories.append(pool_trajectory)
-            else:
-                pool_trajectory.reactivate(cand_trajectory, self.timestamp)
-                retrieved_trajectories.append(pool_trajectory)
+        self._merge(trajectory_pool, pool_kids, rows, candidates, det_xyah, cols,
+            activated_trajectories, retrieved_trajectories)
+        profiler.lap('correct')
+        
+        # 根据IoU关联候选轨迹和轨迹池中一直跟踪到上一帧, 但当前帧没有匹配上的轨迹
+        pids = mismatch_row[pool_tracked[mismatch_row]]
+        cids = mismatch_col
+        rows, cols, mismatch_row, mismatch_col = self.workspace.iou_association(
+            pool_ltrb[pids], det_ltrb[cids], self.iou_cost_limit, self.assignment)
+        self._merge(trajectory_pool, pool_kids, pids[rows], candidates, det_xyah,
+            cids[cols], activated_trajectories, retrieved_trajectories)
+        profiler.lap('correct')
         
         # 轨迹池中跟丢的轨迹
         lost_trajectories = []
-        for i in mismatch_row:
-            pool_trajectory = mismatch_tracked_pool_trajectories[i]
+        for i in pids[mismatch_row]:
+            pool_trajectory = trajectory_pool[i]
             if not pool_trajectory.state == TrajectoryState.Lost:
                 pool_trajectory.mark_lost()
                 lost_trajectories.append(pool_trajectory)
         
         # 跟踪过的轨迹中不确定状态的轨迹
-        candidates = [candidates[i] for i in mismatch_col]
-        dists = iou_distance(unconfirmed_trajectories, candidates)
-        matches, mismatch_row, mismatch_col = linear_assignment(dists, cost_limit=0.7)
-        for pid, cid in matches:
-            unconfirmed_trajectories[pid].update(candidates[cid], self.timestamp)
-            activated_trajectories.append(unconfirmed_trajectories[pid])
+        cids = cids[mismatch_col]
+        unconfirmed_kids = np.array([t.kid for t in unconfirmed_trajectories], dtype=np.int64)
+        unconfirmed_ltrb = np.array([t.ltrb for t in unconfirmed_trajectories]).reshape(-1, 4)
+        rows, cols, mismatch_row, mismatch_col = self.workspace.iou_association(
+            unconfirmed_ltrb, det_ltrb[cids], self.unconfirmed_cost_limit,
+            self.assignment, name='unconfirmed_iou')
+        self._merge(unconfirmed_trajectories, unconfirmed_kids, rows, candidates,
+            det_xyah, cids[cols], activated_trajectories, retrieved_trajectories)
+        profiler.lap('correct')
         
         # 跟踪过的不确定状态的轨迹中完全没有匹配上的轨迹
         removed_trajectories = []
@@ -533,33 +1130,71 @@ class JDETracker(object):
             removed_trajectories.append(unconfirmed_trajectories[i])
         
         # 名花无主的候选轨迹转正, 加入轨迹库
-        for i in mismatch_col:
+        for i in cids[mismatch_col]:
             candidates[i].activate(self.timestamp)
             activated_trajectories.append(candidates[i])
         
         # 标记那些跟丢时间过长的轨迹
-        for trajectory in self.lost_trajectories:
+        for trajectory in self.store.lost.values():
             if self.timestamp - trajectory.timestamp > self.max_lost_time:
                 trajectory.mark_removed()
                 removed_trajectories.append(trajectory)
         
         # 更新跟踪过的轨迹列表
-        self.tracked_trajectories = [t for t in self.tracked_trajectories \
-            if t.state == TrajectoryState.Tracked]
-        self.tracked_trajectories = joint_trajectories(self.tracked_trajectories, activated_trajectories)
-        self.tracked_trajectories = joint_trajectories(self.tracked_trajectories, retrieved_trajectories)
+        store = self.store
+        store.discard(store.tracked, set(id for id, t in store.tracked.items() \
+            if t.state != TrajectoryState.Tracked))
+        store.add(store.tracked, activated_trajectories)
+        store.add(store.tracked, retrieved_trajectories)
         
-        # 更新跟丢的轨迹列表
-        self.lost_trajectories = exclude_trajectories(self.lost_trajectories, self.tracked_trajectories)
-        self.lost_trajectories.extend(lost_trajectories)
-        self.lost_trajectories = exclude_trajectories(self.lost_trajectories, self.removed_trajectories)
+        # 更新跟丢的轨迹列表. 本帧才移除的轨迹要到下一帧才会从跟丢的轨迹中排除
+        store.discard(store.lost, store.tracked)
+        store.add(store.lost, lost_trajectories)
+        store.discard(store.lost, store.recently_removed)
+        store.discard(store.lost, store.removed)
         
         # 更新移除的轨迹列表
-        self.removed_trajectories.extend(removed_trajectories)
-        self.tracked_trajectories, self.lost_trajectories = remove_duplicate_trajectories(\
-            self.tracked_trajectories, self.lost_trajectories)
+        store.remove(removed_trajectories)
+        store.reset(*remove_duplicate_trajectories(
+            self.tracked_trajectories, self.lost_trajectories))
+        
+        # 释放已经移出轨迹池的轨迹所占用的卡尔曼滤波器和表观嵌入
+        self.kalman.retain([t.kid for t in store.tracked.values()] + \
+            [t.kid for t in store.lost.values()])
+        self.embeddings.retain([t.eid for t in store.tracked.values()] + \
+            [t.eid for t in store.lost.values()])
+        profiler.lap('bookkeeping')
+        profiler.end()
+        
+        return [trajectory for trajectory in self.store.tracked.values() if trajectory.is_activated]
+    
+    def _merge(self, trajectories, kids, pids, candidates, measurements, cids,
+        activated_trajectories, retrieved_trajectories):
+        '''用匹配的候选轨迹批量更新卡尔曼滤波器, 再逐条更新轨迹的状态
         
-        return [trajectory for trajectory in self.tracked_trajectories if trajectory.is_activated]
+        Args:
+            trajectories (list of Trajectory): 轨迹组
+            kids (numpy.ndarray): trajectories在卡尔曼滤波器组中的行索引
+            pids (numpy.ndarray): 匹配的轨迹索引
+            candidates (list of Trajectory): 候选轨迹
+            measurements (numpy.ndarray): 候选轨迹的[x,y,a,h]格式测量
+            cids (numpy.ndarray): 与pids一一对应的候选轨迹索引
+            activated_trajectories (list of Trajectory): 追加继续跟踪的轨迹
+            retrieved_trajectories (list of Trajectory): 追加重新激活的轨迹
+        '''
+        if len(pids) == 0:
+            return
+        self.kalman.correct(kids[pids], measurements[cids])
+        for pid, cid in zip(pids.tolist(), cids.tolist()):
+            trajectory = trajectories[pid]
+            if trajectory.state == TrajectoryState.Lost:
+                # 如果轨迹处于休眠状态, 重新激活它
+                trajectory.reactivate(candidates[cid], self.timestamp, corrected=True)
+                retrieved_trajectories.append(trajectory)
+            else:
+                # 否则将候选轨迹融入轨迹
+                trajectory.update(candidates[cid], self.timestamp, corrected=True)
+                activated_trajectories.append(trajectory)
 
 def save_trajectories(path, trajectories, frame_id):
     line = '{},{},{},{},{},{},1,-1,-1,-1\n'
@@ -574,7 +1209,292 @@ def save_trajectories(path, trajectories, frame_id):
             file.write(line.format(frame_id, trajectory.id, l, t, w, h))
         file.close()
 
+class MOTWriter(object):
+    '''MOTChallenge格式的跟踪结果写入器. 文件在整个序列期间保持打开,
+        每flush_every帧批量写入一次.
+    
+    Args:
+        path (str): 结果文件路径, 已存在的文件会被覆盖
+        flush_every (int, optional): 每多少帧写入一次文件, 为0时只在关闭时写入
+    '''
+    line = '{},{},{},{},{},{},1,-1,-1,-1\n'
+    def __init__(self, path, flush_every=100):
+        if flush_every < 0:
+            raise ValueError('flush_every must be non-negative, got {}'.format(flush_every))
+        self.file = open(path, 'w')
+        self.flush_every = flush_every
+        self.lines = []
+        self.frames = 0
+    
+    def write(self, trajectories, frame_id):
+        '''缓存一帧的跟踪结果
+        
+        Args:
+            trajectories (list of Trajectory): 跟踪的轨迹列表
+            frame_id (int): 帧号, 从1开始
+        '''
+        for trajectory in trajectories:
+            if trajectory.id < 0:
+                continue
+            l, t, r, b = trajectory.ltrb
+            self.lines.append(self.line.format(frame_id, trajectory.id, l, t, r - l, b - t))
+        self.frames += 1
+        if self.flush_every > 0 and self.frames % self.flush_every == 0:
+            self.flush()
+    
+    def flush(self):
+        self.file.write(''.join(self.lines))
+        self.file.flush()
+        self.lines = []
+    
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class ColumnarWriter(object):
+    '''列式存储的跟踪结果写入器. 关闭时以.npz格式保存frame, id, l, t, w, h,
+        score等列, 可以用numpy.load直接读取.
+    
+    Args:
+        path (str): 结果文件路径
+    '''
+    columns = ('frame', 'id', 'l', 't', 'w', 'h', 'score')
+    def __init__(self, path):
+        self.path = path
+        self.chunks = []
+    
+    def write(self, trajectories, frame_id):
+        '''缓存一帧的跟踪结果, 参数同MOTWriter.write
+        '''
+        trajectories = [t for t in trajectories if t.id >= 0]
+        if len(trajectories) == 0:
+            return
+        chunk = np.empty((len(trajectories), len(self.columns)), dtype=np.float64)
+        chunk[:, 0] = frame_id
+        chunk[:, 1] = [t.id for t in trajectories]
+        chunk[:, 2:6] = [t.ltrb for t in trajectories]
+        chunk[:, 4:6] -= chunk[:, 2:4]
+        chunk[:, 6] = [t.score for t in trajectories]
+        self.chunks.append(chunk)
+    
+    def close(self):
+        data = np.concatenate(self.chunks) if len(self.chunks) > 0 \
+            else np.zeros((0, len(self.columns)))
+        arrays = {c: data[:, i] for i, c in enumerate(self.columns)}
+        arrays['frame'] = arrays['frame'].astype(np.int32)
+        arrays['id'] = arrays['id'].astype(np.int32)
+        np.savez(self.path, **arrays)
+
+class DetectionCache(object):
+    '''检测结果缓存写入器. 逐帧保存NMS后投影到图像坐标系的检测结果和表观嵌入,
+        关闭时在缓存目录中生成dets.npy和offsets.npy, 第i帧的检测结果为
+        dets[offsets[i]:offsets[i+1]]. 用load_detection_cache内存映射读取后,
+        可以只运行关联阶段回放跟踪.
+    
+    Args:
+        path (str): 缓存目录
+    '''
+    def __init__(self, path):
+        mkdir(path)
+        self.path = path
+        self.chunks = []
+        self.offsets = [0]
+    
+    def write(self, dets):
+        '''缓存一帧的检测结果
+        
+        Args:
+            dets (numpy.ndarray or None): 含检测结果的二维数组, dets[:]=
+                [l,t,r,b,objecness,class,embedding], 没有检测结果时为None
+        '''
+        if dets is not None and len(dets) > 0:
+            self.chunks.append(np.asarray(dets, dtype=np.float32))
+            self.offsets.append(self.offsets[-1] + len(dets))
+        else:
+            self.offsets.append(self.offsets[-1])
+    
+    def close(self):
+        dim = self.chunks[0].shape[1] if len(self.chunks) > 0 else 0
+        dets = np.concatenate(self.chunks) if len(self.chunks) > 0 \
+            else np.zeros((0, dim), dtype=np.float32)
+        np.save(os.path.join(self.path, 'dets.npy'), dets)
+        np.save(os.path.join(self.path, 'offsets.npy'), np.asarray(self.offsets, dtype=np.int64))
+
+def load_detection_cache(path, mmap=True):
+    '''读取DetectionCache保存的检测结果
+    
+    Args:
+        path (str): 缓存目录
+        mmap (bool, optional): 是否内存映射, 否则一次读入内存
+    Returns:
+        frames (list of numpy.ndarray): 逐帧的检测结果, 没有检测结果的帧为空数组
+    '''
+    dets = np.load(os.path.join(path, 'dets.npy'), mmap_mode='r' if mmap else None)
+    offsets = np.load(os.path.join(path, 'offsets.npy'))
+    return [dets[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+class VideoWriter(object):
+    '''直接编码视频的写入器, 不再经过逐帧的JPEG文件. 视频尺寸由第一帧决定.
+    
+    Args:
+        path (str): 视频文件路径
+        fps (float, optional): 帧率
+        backend (str, optional): 'opencv'使用cv2.VideoWriter, 'ffmpeg'通过
+            管道把原始BGR帧送给ffmpeg进程
+    '''
+    def __init__(self, path, fps=25, backend='opencv'):
+        if backend not in ['opencv', 'ffmpeg']:
+            raise ValueError('unknown video backend {}'.format(backend))
+        self.path = path
+        self.fps = fps
+        self.backend = backend
+        self.writer = None
+    
+    def _open(self, size):
+        h, w = size
+        if self.backend == 'opencv':
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            self.writer = cv2.VideoWriter(self.path, fourcc, self.fps, (w, h))
+        else:
+            command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo',
+                '-pix_fmt', 'bgr24', '-s', '{}x{}'.format(w, h), '-r', str(self.fps),
+                '-i', '-', '-pix_fmt', 'yuv420p', self.path]
+            self.writer = subprocess.Popen(command, stdin=subprocess.PIPE)
+    
+    def write(self, im):
+        '''编码一帧BGR格式图像
+        '''
+        if self.writer is None:
+            self._open(im.shape[:2])
+        if self.backend == 'opencv':
+            self.writer.write(im)
+        else:
+            self.writer.stdin.write(np.ascontiguousarray(im).tobytes())
+    
+    def close(self):
+        if self.writer is None:
+            return
+        if self.backend == 'opencv':
+            self.writer.release()
+        else:
+            self.writer.stdin.close()
+            self.writer.wait()
+
+class PipelineStage(threading.Thread):
+    '''流水线的一个处理阶段. 每个阶段独占一个线程, 按先进先出的顺序从输入队列
+        取数据, 处理后放入输出队列, 因此帧的顺序和跟踪器状态都是确定的.
+        输入为None表示数据结束, None会继续向下游传递.
+
+    Args:
+        name (str): 阶段名称
+        func (callable): 处理函数, 输入上游数据, 返回下游数据
+        inq (queue.Queue): 输入队列
+        outq (queue.Queue or None): 输出队列, 最后一个阶段为None
+    '''
+    def __init__(self, name, func, inq, outq=None):
+        super(PipelineStage, self).__init__(name=name, daemon=True)
+        self.func = func
+        self.inq = inq
+        self.outq = outq
+        self.count = 0
+        self.latency = 0
+        self.max_latency = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.error = None
+
+    def run(self):
+        while True:
+            depth = self.inq.qsize()
+            item = self.inq.get()
+            if item is None:
+                break
+            if self.error is not None:  # 出错后只排空输入队列, 避免上游阻塞
+                continue
+            self.depth += depth
+            self.max_depth = max(self.max_depth, depth)
+            start = time.perf_counter()
+            try:
+                item = self.func(item)
+            except Exception as e:
+                self.error = e
+                continue
+            latency = time.perf_counter() - start
+            self.count += 1
+            self.latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if self.outq is not None:
+                self.outq.put(item)
+        if self.outq is not None:
+            self.outq.put(None)
+
+    def report(self):
+        '''返回阶段统计信息: 处理帧数, 平均和最大延时(毫秒), 平均和最大输入队列深度
+        '''
+        count = max(self.count, 1)
+        return {'stage': self.name, 'frames': self.count,
+            'mean_ms': 1000 * self.latency / count,
+            'max_ms': 1000 * self.max_latency,
+            'mean_depth': self.depth / count,
+            'max_depth': self.max_depth}
+
+def run_pipeline(source, stages, maxsize=4):
+    '''以流水线方式运行多个处理阶段, 阶段之间用有界队列连接
+
+    Args:
+        source (iterable): 数据源, 例如对解码器的迭代
+        stages (list of tuple): [(name, func), ...], 按顺序排列的处理阶段
+        maxsize (int, optional): 队列容量
+    Returns:
+        reports (list of dict): 各阶段的统计信息, 见PipelineStage.report
+    '''
+    queues = [Queue(maxsize=maxsize) for _ in range(len(stages))]
+    threads = []
+    for i, (name, func) in enumerate(stages):
+        outq = queues[i + 1] if i + 1 < len(stages) else None
+        threads.append(PipelineStage(name, func, queues[i], outq))
+    for thread in threads:
+        thread.start()
+
+    count = 0
+    latency = 0
+    max_latency = 0
+    start = time.perf_counter()
+    try:
+        for item in source:
+            elapsed = time.perf_counter() - start
+            latency += elapsed
+            max_latency = max(max_latency, elapsed)
+            count += 1
+            queues[0].put(item)
+            if any(thread.error is not None for thread in threads):
+                break
+            start = time.perf_counter()
+    finally:
+        queues[0].put(None)
+        for thread in threads:
+            thread.join()
+    for thread in threads:
+        if thread.error is not None:
+            raise thread.error
+
+    reports = [{'stage': 'source', 'frames': count,
+        'mean_ms': 1000 * latency / max(count, 1), 'max_ms': 1000 * max_latency,
+        'mean_depth': 0, 'max_depth': 0}]
+    reports += [thread.report() for thread in threads]
+    return reports
+
+def print_pipeline_reports(reports):
+    '''打印流水线各阶段的统计信息
+    '''
+    print('{:<10}{:>8}{:>10}{:>10}{:>12}{:>11}'.format('stage', 'frames',
+        'mean(ms)', 'max(ms)', 'mean depth', 'max depth'))
+    for r in reports:
+        print('{:<10}{:>8}{:>10.2f}{:>10.2f}{:>12.2f}{:>11}'.format(r['stage'],
+            r['frames'], r['mean_ms'], r['max_ms'], r['mean_depth'], r['max_depth']))
+
 def main(args):
+    import dataset
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')    
     if os.path.isfile(args.config):
         config.merge_from_file(args.config)
@@ -586,45 +1506,95 @@ def main(args):
     model.cuda().eval()
 
     h, w = [int(s) for s in args.insize.split('x')]
-    tracker = JDETracker()
+    tracker = JDETracker(profiler=TrackerProfiler(enabled=bool(args.profile)))
+    # 流水线模式下, 队列中和正在推理的帧都占用一个letterbox缓冲区
+    ring = args.queue_size + 2 if args.pipeline else 1
     if os.path.isfile(args.img_path):
-        dataloader = dataset.VideoLoader(args.img_path, (h,w,3))
+        dataloader = dataset.VideoLoader(args.img_path, (h,w,3), ring=ring)
     else:
-        dataloader = dataset.ImagesLoader(args.img_path, (h,w,3), formats=['*.jpg', '*.png'])
+        dataloader = dataset.ImagesLoader(args.img_path, (h,w,3), formats=['*.jpg', '*.png'],
+            ring=ring)
     
     strs = re.split(r'[\\, /]', args.img_path)
     imgpath = os.path.join(args.workspace, 'result', strs[-3], 'img')
     mkdir(imgpath)
     traj_path = os.path.join(args.workspace, 'result', '{}.txt'.format(strs[-3]))
+    video_path = os.path.join(args.workspace, 'result', '{}.mp4'.format(strs[-3]))
+    
+    if args.video == 'images':
+        os.system('rm -f {}'.format(os.path.join(imgpath, '*')))
+    writers = [MOTWriter(traj_path, args.flush_every)]
+    if args.npz:
+        writers.append(ColumnarWriter(os.path.join(args.workspace, 'result',
+            '{}.npz'.format(strs[-3]))))
+    cache = None
+    if args.cache:
+        cache = DetectionCache(os.path.join(args.cache, strs[-3]))
+    video = None
+    if args.video in ['opencv', 'ffmpeg']:
+        video = VideoWriter(video_path, args.fps, args.video)
     
-    os.system('rm -f {}'.format(os.path.join(imgpath, '*')))
-    for i, (path, im, lb_im) in enumerate(dataloader):
-        input = torch.from_numpy(lb_im).unsqueeze(0).to(device)
+    def infer(frame):
+        input = torch.from_numpy(frame.pop('lb_im')).unsqueeze(0).to(device)
         with torch.no_grad():
             outputs = model(input)
-        print('{} {} {} {}'.format(path, im.shape, lb_im.shape, outputs.size()), end=' ')
-        outputs =  nonmax_suppression(outputs, args.score_thresh, args.iou_thresh)[0]
-        
-        if outputs is None:
-            print('no object detected!')
-            segments = re.split(r'[\\, /]', path)
-            cv2.imwrite(os.path.join(imgpath, segments[-1]), im)
-            continue
-        print('{}'.format(outputs.size()), end=' ')
-        outputs[:, :4] = ltrb_net2img(outputs[:, :4], (h,w), im.shape[:2])
-        if not args.only_detect:
-            trajectories = tracker.update(outputs.numpy())
-            print('{}'.format(len(trajectories)))        
+        outputs = nonmax_suppression(outputs, args.score_thresh, args.iou_thresh)[0]
+        if outputs is not None:
+            outputs = outputs.cpu()
+            outputs[:, :4] = ltrb_net2img(outputs[:, :4], (h,w), frame['im'].shape[:2])
+        if cache is not None:
+            cache.write(None if outputs is None else outputs.numpy())
+        frame['dets'] = outputs
+        return frame
+    
+    def track(frame):
+        if frame['dets'] is not None and not args.only_detect:
+            frame['trajectories'] = tracker.update(frame['dets'].numpy())
+        return frame
+    
+    def write(frame):
+        path, im, dets = frame['path'], frame['im'], frame['dets']
+        if dets is None:
+            print('{} no object detected!'.format(path))
+            result = im
+        elif not args.only_detect:
+            trajectories = frame['trajectories']
+            print('{} {} {}'.format(path, dets.size(), len(trajectories)))
             result = overlap_trajectory(trajectories, im)
-            save_trajectories(traj_path, trajectories, i + 1)
+            for writer in writers:
+                writer.write(trajectories, frame['index'] + 1)
+        else:
+            print('{} {}'.format(path, dets.size()))
+            result = overlap(dets, im)
+        if video is not None:
+            video.write(result)
+        elif args.video == 'images':
+            segments = re.split(r'[\\, /]', path)
+            cv2.imwrite(os.path.join(imgpath, segments[-1]), result)
+    
+    frames = ({'index': i, 'path': path, 'im': im, 'lb_im': lb_im}
+        for i, (path, im, lb_im) in enumerate(dataloader))
+    try:
+        if args.pipeline:
+            reports = run_pipeline(frames, [('infer', infer), ('track', track),
+                ('write', write)], maxsize=args.queue_size)
+            print_pipeline_reports(reports)
         else:
-            print('')
-            result = overlap(outputs, im)
-        segments = re.split(r'[\\, /]', path)
-        cv2.imwrite(os.path.join(imgpath, segments[-1]), result)
+            for frame in frames:
+                write(track(infer(frame)))
+    finally:
+        for writer in writers:
+            writer.close()
+        if video is not None:
+            video.close()
+        if cache is not None:
+            cache.close()
+        if args.profile:
+            tracker.profiler.save(args.profile, args.profile_format)
 
-    os.system('ffmpeg -f image2 -i {} {}.mp4 -y'.format(os.path.join(imgpath, '%06d.jpg'),
-        os.path.join(args.workspace, 'result', strs[-3])))
+    if args.video == 'images':
+        os.system('ffmpeg -f image2 -i {} {} -y'.format(os.path.join(imgpath, '%06d.jpg'),
+            video_path))
 
 if __name__ == '__main__':
     args = parse_args()